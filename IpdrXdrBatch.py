@@ -0,0 +1,127 @@
+###############################################################################
+# Batch conversion of many Ipdr-Xdr files with a bounded pool of processes.
+# Each file is converted on its own (IPDRDoc decoding resets the RecordDescriptor
+# table), so pool workers are reused across files.
+###############################################################################
+
+import os,glob,time,json,multiprocessing
+import IpdrXdrConvert
+
+# format -> (output file extension, conversion function(xdr_file,out_file,record_filter=None))
+converters={
+    "xml"  : (".xml",IpdrXdrConvert.xdr_to_xml),
+    "repr" : (".repr",IpdrXdrConvert.xdr_to_repr)
+}
+
+def expand_inputs(inputs,pattern="*.xdr"):
+    # Directories are expanded to the files matching pattern,
+    # glob patterns to the files they match, other paths are used as is.
+    paths=[]
+    for inp in inputs:
+        if os.path.isdir(inp):
+            paths+=sorted(glob.glob(os.path.join(inp,pattern)))
+        elif glob.has_magic(inp):
+            paths+=sorted(glob.glob(inp))
+        else:
+            paths.append(inp)
+    return paths
+
+def output_path(xdr_file,fmt="xml",output_dir=None):
+    out_file="%s%s" % (xdr_file,converters[fmt][0])
+    if output_dir is not None:
+        out_file=os.path.join(output_dir,os.path.basename(out_file))
+    return out_file
+
+def stamp_path(out_file):
+    # Sidecar of an output recording what it was converted from
+    return out_file+".stamp"
+
+def _stamp(xdr_file,out_file):
+    return {"input_size":os.path.getsize(xdr_file),"input_mtime":os.path.getmtime(xdr_file),
+            "output_size":os.path.getsize(out_file)}
+
+def write_stamp(xdr_file,out_file):
+    # Records the size and mtime of the input and the size of the output once converted
+    tmp_file="%s.tmp%d" % (stamp_path(out_file),os.getpid())
+    with open(tmp_file,"w") as outp:
+        json.dump(_stamp(xdr_file,out_file),outp,sort_keys=True)
+    os.rename(tmp_file,stamp_path(out_file))
+
+def is_up_to_date(xdr_file,out_file):
+    # An output is up to date when its stamp (see write_stamp) matches the size and mtime
+    # of the input and the size of the output. Outputs without a stamp, e.g. written by
+    # another tool or an interrupted run, are converted again.
+    if not os.path.exists(out_file) or not os.path.exists(stamp_path(out_file)):
+        return False
+    try:
+        with open(stamp_path(out_file)) as inp:
+            stamp=json.load(inp)
+    except ValueError:
+        return False
+    return stamp == _stamp(xdr_file,out_file)
+
+class BatchResult(object):
+    def __init__(self,xdr_file,out_file,status,size=0,seconds=0.0,error=None):
+        self.xdr_file=xdr_file
+        self.out_file=out_file
+        self.status=status # "converted", "skipped" or "failed"
+        self.size=size
+        self.seconds=seconds
+        self.error=error
+    def mb_per_sec(self):
+        if self.seconds <= 0:
+            return 0.0
+        return self.size/self.seconds/(1024*1024)
+    def __repr__(self):
+        return "%s(xdr_file=%r, out_file=%r, status=%r, size=%s, seconds=%.3f, error=%r)" % (self.__class__.__name__,self.xdr_file,self.out_file,self.status,self.size,self.seconds,self.error)
+
+def convert_file(xdr_file,fmt="xml",output_dir=None,force=False,record_filter=None):
+    # Never raises, failures are reported in the returned BatchResult.
+    # Outputs are checked against their input only, a filtered conversion
+    # into the same output directory needs force.
+    out_file=output_path(xdr_file,fmt,output_dir)
+    try:
+        size=os.path.getsize(xdr_file)
+        if not force and is_up_to_date(xdr_file,out_file):
+            return BatchResult(xdr_file,out_file,"skipped",size)
+        start=time.time()
+        # Written under a temporary name and stamped once renamed, so an interrupted
+        # conversion is never taken as up to date.
+        if os.path.exists(stamp_path(out_file)):
+            os.remove(stamp_path(out_file))
+        tmp_file="%s.tmp%d" % (out_file,os.getpid())
+        try:
+            converters[fmt][1](xdr_file,tmp_file,record_filter=record_filter)
+            os.rename(tmp_file,out_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        write_stamp(xdr_file,out_file)
+        return BatchResult(xdr_file,out_file,"converted",size,time.time()-start)
+    except Exception as e:
+        return BatchResult(xdr_file,out_file,"failed",error="%s: %s" % (e.__class__.__name__,e))
+
+def _convert_file(args):
+    return convert_file(*args)
+
+def iter_convert_files(inputs,fmt="xml",processes=None,output_dir=None,force=False,pattern="*.xdr",record_filter=None):
+    # Yields a BatchResult per input file as soon as it is done,
+    # a failing file does not stop the batch.
+    if fmt not in converters:
+        raise ValueError("unknown format %r, expected one of %s" % (fmt,", ".join(sorted(converters))))
+    tasks=[(xdr_file,fmt,output_dir,force,record_filter) for xdr_file in expand_inputs(inputs,pattern)]
+    if processes == 1:
+        for task in tasks:
+            yield _convert_file(task)
+        return
+    pool=multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_convert_file,tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def convert_files(inputs,fmt="xml",processes=None,output_dir=None,force=False,pattern="*.xdr",record_filter=None):
+    return list(iter_convert_files(inputs,fmt,processes,output_dir,force,pattern,record_filter))
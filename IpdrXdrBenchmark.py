@@ -0,0 +1,229 @@
+###############################################################################
+# Synthetic IPDR-XDR file generator and decoder throughput benchmark.
+#
+# Files are written with the pack() methods of the Ipdr types, each benchmark
+# stage runs in its own forked process so that its peak RSS can be reported.
+###############################################################################
+
+import os,sys,time,random,binascii,resource,platform,tempfile,json,multiprocessing,Queue
+from IpdrXdrDocumentClasses import *
+import IpdrXdrConvert
+
+fixed_classes=[cls for cls in ipdr_classes if cls.packed_size > 0]
+variable_classes=[IpdrString,IpdrHexBinary,IpdrIpAddr]
+
+EPOCH_MSEC=1520388001039
+
+def random_value(rnd,cls,ipv6_ratio=0.5):
+    if cls is IpdrBool:
+        return IpdrBool(rnd.randint(0,1))
+    if cls in (IpdrFloat,IpdrDouble):
+        return cls(rnd.uniform(-1e6,1e6))
+    if cls is IpdrDateTimeMsec:
+        return cls(EPOCH_MSEC+rnd.randint(0,86400*1000))
+    if cls is IpdrDateTimeUsec:
+        return cls(EPOCH_MSEC*1000+rnd.randint(0,86400*1000000))
+    if cls is IpdrDateTime:
+        return cls(EPOCH_MSEC//1000+rnd.randint(0,86400))
+    if cls is IpdrIpv4Addr:
+        return cls(rnd.randint(0,2**32-1))
+    if cls is IpdrIpv6Addr:
+        return cls(rnd.randint(0,2**128-1))
+    if cls is IpdrIpAddr:
+        if rnd.random() < ipv6_ratio:
+            return cls(str(ipaddress.IPv6Address(rnd.randint(0,2**128-1))))
+        return cls(str(ipaddress.IPv4Address(rnd.randint(0,2**32-1))))
+    if cls is IpdrUuid:
+        return cls(int=rnd.randint(0,2**128-1))
+    if cls is IpdrMacAddr:
+        return cls.from_value(rnd.randint(0,2**48-1))
+    if cls is IpdrString:
+        return cls("".join([rnd.choice("abcdefghijklmnopqrstuvwxyz0123456789_") for i in range(rnd.randint(0,32))]))
+    if cls is IpdrHexBinary:
+        return cls(binascii.hexlify("".join([chr(rnd.randint(0,255)) for i in range(rnd.randint(0,16))])))
+    # remaining integer types, bounds from their struct format
+    bits=cls.packed_size*8
+    if cls.unpack_str[-1].isupper():
+        return cls(rnd.randint(0,2**bits-1))
+    return cls(rnd.randint(-2**(bits-1),2**(bits-1)-1))
+
+def random_descriptor(rnd,descriptorId,fields,variable_ratio):
+    attributes=IpdrArray(AttributeDescriptor)
+    for i in range(fields):
+        if rnd.random() < variable_ratio:
+            cls=rnd.choice(variable_classes)
+        else:
+            cls=rnd.choice(fixed_classes)
+        attributes.append(AttributeDescriptor(attributeName=IpdrString("field_%d_%d" % (descriptorId,i)),typeId=IpdrInt(cls.type_id)))
+    attributes.length=IpdrInt(len(attributes))
+    return RecordDescriptor(descriptorId=IpdrInt(descriptorId),typeName=IpdrString("Synthetic %d" % descriptorId),attributes=attributes)
+
+def generate_file(path,records=100000,size=None,descriptors=2,fields=20,variable_ratio=0.2,ipv6_ratio=0.5,distinct_records=1000,seed=0):
+    # Writes a synthetic IPDRDoc with records IPDRRecords (or until size bytes when given),
+    # spread randomly over descriptors RecordDescriptors of fields attributes each.
+    # variable_ratio is the share of variable length attributes (string, hexBinary, ipAddr),
+    # ipv6_ratio the share of IPv6 ipAddr values. Each descriptor cycles through
+    # distinct_records pre-packed records, so large files are written quickly.
+    # Returns a dict describing the generated file.
+    rnd=random.Random(seed)
+    descs=[random_descriptor(rnd,i+1,fields,variable_ratio) for i in range(descriptors)]
+    packed={}
+    for desc in descs:
+        prefix=IpdrElementTypeEnum(IpdrElementTypeEnum.IPDRREC).pack()+desc.descriptorId.pack()
+        classes=[ipdr_class_from_type_id[a.typeId] for a in desc.attributes]
+        packed[int(desc.descriptorId)]=[prefix+"".join([random_value(rnd,cls,ipv6_ratio).pack() for cls in classes]) for i in range(distinct_records)]
+    header=IPDRHeader(
+        ipdrVersion=IpdrInt(4),
+        ipdrRecorderInfo=IpdrString("IpdrXdrBenchmark"),
+        startTime=IpdrDateTimeMsec(EPOCH_MSEC),
+        defaultNameSpaceURI=IpdrString("http://www.ipdr.org/namespaces/ipdr"),
+        otherNameSpaces=IpdrArray(NameSpaceInfo),
+        serviceDefinitionURIs=IpdrArray(IpdrString),
+        docId=IpdrUuid(int=rnd.randint(0,2**128-1)))
+    count=0
+    with open(path,"wb") as outp:
+        outp.write(header.pack()+IpdrInt(-1).pack())
+        for desc in descs:
+            outp.write(IPDRStreamElement(kind=IpdrElementTypeEnum(IpdrElementTypeEnum.RECORDDESC),desc=desc).pack())
+        pools=[packed[int(desc.descriptorId)] for desc in descs]
+        while (size is None and count < records) or (size is not None and outp.tell() < size):
+            outp.write(rnd.choice(rnd.choice(pools)))
+            count+=1
+        outp.write(IPDRStreamElement(kind=IpdrElementTypeEnum(IpdrElementTypeEnum.DOCEND),docEnd=IPDRDocEnd(count=IpdrInt(count),endTime=IpdrDateTimeMsec(EPOCH_MSEC+86400*1000))).pack())
+        file_size=outp.tell()
+    return {"path":path,"records":count,"size":file_size,"descriptors":descriptors,"fields":fields,
+            "variable_ratio":variable_ratio,"ipv6_ratio":ipv6_ratio,"distinct_records":distinct_records,"seed":seed}
+
+#
+# Benchmark stages, each is given the path of the generated file.
+#
+def stage_load(path):
+    with open(path,"rb") as filep:
+        IPDRDoc.load(filep)
+
+def stage_load_mmap(path):
+    with open(path,"rb") as filep:
+        buf=IpdrXdrConvert.map_file(filep)
+        for element in IPDRDoc.iter_elements_from(buf):
+            pass
+        buf.close()
+
+def stage_pack(path,doc=None):
+    doc.pack()
+
+def stage_xml(path):
+    IpdrXdrConvert.xdr_to_xml(path,os.devnull)
+
+def stage_repr(path):
+    IpdrXdrConvert.xdr_to_repr(path,os.devnull)
+
+def stage_columnar(path):
+    import IpdrXdrColumnar
+    with open(path,"rb") as filep:
+        IpdrXdrColumnar.load_columns(filep)
+
+stages={
+    "load"      : stage_load,
+    "load_mmap" : stage_load_mmap,
+    "pack"      : stage_pack,
+    "xml"       : stage_xml,
+    "repr"      : stage_repr,
+    "columnar"  : stage_columnar
+}
+default_stages=["load","load_mmap","pack","xml","repr","columnar"]
+
+def _run_stage(name,path,queue,value_cache=None):
+    try:
+        if value_cache:
+            enable_value_cache(value_cache)
+        kwargs={}
+        if name == "pack":
+            # pack needs a decoded document, which is not part of the timing
+            with open(path,"rb") as filep:
+                kwargs["doc"]=IPDRDoc.load(filep)
+        start=time.time()
+        stages[name](path,**kwargs)
+        seconds=time.time()-start
+        queue.put((seconds,resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,None,value_cache_stats()))
+    except Exception as e:
+        queue.put((0.0,0,"%s: %s" % (e.__class__.__name__,e),{}))
+
+def _stage_result(proc,queue,timeout=None,poll=1.0):
+    # What the stage process puts on queue, or a failed result when it exits without
+    # (e.g. killed for lack of memory) or is still running after timeout seconds
+    started=time.time()
+    while True:
+        try:
+            return queue.get(timeout=poll)
+        except Queue.Empty:
+            pass
+        if not proc.is_alive():
+            # its result may have been put just before it exited
+            try:
+                return queue.get(timeout=poll)
+            except Queue.Empty:
+                if proc.exitcode < 0:
+                    return (0.0,0,"stage process killed by signal %d" % -proc.exitcode,{})
+                return (0.0,0,"stage process exited with code %d" % proc.exitcode,{})
+        if timeout is not None and time.time()-started > timeout:
+            proc.terminate()
+            return (0.0,0,"stage timed out after %ss" % timeout,{})
+
+def run_stage(name,path,records,size,value_cache=None,timeout=None):
+    # value_cache, when given, is the size of the value caches enabled for the stage,
+    # their statistics are then part of the result.
+    # The stage fails (see _stage_result) after timeout seconds when given.
+    queue=multiprocessing.Queue()
+    proc=multiprocessing.Process(target=_run_stage,args=(name,path,queue,value_cache))
+    proc.start()
+    (seconds,peak_rss,error,cache_stats)=_stage_result(proc,queue,timeout)
+    proc.join()
+    result={"seconds":seconds,"peak_rss_kb":peak_rss}
+    if cache_stats:
+        result["value_cache"]=cache_stats
+    if error is not None:
+        result["error"]=error
+    elif seconds > 0:
+        result["records_per_sec"]=records/seconds
+        result["mb_per_sec"]=size/seconds/(1024*1024)
+    return result
+
+def run_benchmark(path=None,stage_names=None,keep=False,value_cache=None,timeout=None,**generate_args):
+    # Generates a synthetic file (in a temporary directory unless path is given),
+    # runs each stage on it and returns the machine readable results.
+    if stage_names is None:
+        stage_names=default_stages
+    tmp_dir=None
+    if path is None:
+        tmp_dir=tempfile.mkdtemp(prefix="ipdr_bench")
+        path=os.path.join(tmp_dir,"synthetic.xdr")
+    try:
+        generated=generate_file(path,**generate_args)
+        results={
+            "timestamp":time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python":sys.version.split()[0],
+            "platform":platform.platform(),
+            "file":generated,
+            "value_cache":value_cache,
+            "stages":{}
+        }
+        for name in stage_names:
+            results["stages"][name]=run_stage(name,path,generated["records"],generated["size"],value_cache,timeout)
+        return results
+    finally:
+        if tmp_dir is not None and not keep:
+            os.remove(path)
+            os.rmdir(tmp_dir)
+
+def compare(results,baseline):
+    # Returns {stage: ratio of records_per_sec against baseline}, >1 is faster
+    ratios={}
+    for (name,result) in results["stages"].items():
+        base=baseline.get("stages",{}).get(name,{})
+        if result.get("records_per_sec") and base.get("records_per_sec"):
+            ratios[name]=result["records_per_sec"]/base["records_per_sec"]
+    return ratios
+
+def dump_results(results,outp):
+    json.dump(results,outp,indent=2,sort_keys=True)
+    outp.write("\n")
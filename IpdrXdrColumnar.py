@@ -0,0 +1,211 @@
+###############################################################################
+# Columnar export of the IPDRRecords of an Ipdr-Xdr file:
+# the records are decoded straight into one numpy array per attribute,
+# grouped by RecordDescriptor typeName.
+# numpy is an optional dependency, only needed by this module.
+###############################################################################
+
+import mmap
+from collections import OrderedDict
+from IpdrXdrDocumentClasses import *
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+# numpy dtype of each Ipdr type, from the plain value struct unpacks for it.
+# The dateTime family is stored as datetime64 in its own granularity,
+# IPv6 addresses and UUIDs as their 16 raw bytes,
+# variable length types as object arrays of the decoded Ipdr* values.
+numpy_dtypes={
+    IpdrBool         : "bool",
+    IpdrUByte        : "uint8",
+    IpdrByte         : "int8",
+    IpdrUShort       : "uint16",
+    IpdrShort        : "int16",
+    IpdrUInt         : "uint32",
+    IpdrInt          : "int32",
+    IpdrULong        : "uint64",
+    IpdrLong         : "int64",
+    IpdrFloat        : "float32",
+    IpdrDouble       : "float64",
+    IpdrDateTimeMsec : "datetime64[ms]",
+    IpdrDateTimeUsec : "datetime64[us]",
+    IpdrDateTime     : "datetime64[s]",
+    IpdrIpv4Addr     : "uint32",
+    IpdrIpv6Addr     : "V16",
+    IpdrUuid         : "V16",
+    IpdrMacAddr      : "uint64",
+    IpdrString       : "object",
+    IpdrHexBinary    : "object",
+    IpdrIpAddr       : "object"
+}
+
+# (leading padding, big endian numpy format) of each fixed size Ipdr type as packed in XDR,
+# used to decode runs of fixed size records with a single numpy.frombuffer.
+numpy_formats={
+    IpdrBool         : (0,"b1"),
+    IpdrUByte        : (0,"u1"),
+    IpdrByte         : (0,"i1"),
+    IpdrUShort       : (0,">u2"),
+    IpdrShort        : (0,">i2"),
+    IpdrUInt         : (0,">u4"),
+    IpdrInt          : (0,">i4"),
+    IpdrULong        : (0,">u8"),
+    IpdrLong         : (0,">i8"),
+    IpdrFloat        : (0,">f4"),
+    IpdrDouble       : (0,">f8"),
+    IpdrDateTimeMsec : (0,">u8"),
+    IpdrDateTimeUsec : (0,">u8"),
+    IpdrDateTime     : (0,">u4"),
+    IpdrIpv4Addr     : (0,">u4"),
+    IpdrIpv6Addr     : (4,"V16"),
+    IpdrUuid         : (4,"V16"),
+    IpdrMacAddr      : (0,">u8")
+}
+
+def record_dtype(decoder):
+    # Unpadded structured dtype of a whole IPDRREC stream element (kind, descriptorId
+    # and the attributes) or None when the RecordDescriptor has variable length attributes.
+    if not all([cls in numpy_formats for cls in decoder.classes]):
+        return None
+    names=["kind","descriptorId"]
+    formats=[">i4",">i4"]
+    offsets=[0,4]
+    offset=8
+    for (i,cls) in enumerate(decoder.classes):
+        (pad,fmt)=numpy_formats[cls]
+        names.append("f%d" % i)
+        formats.append(fmt)
+        offsets.append(offset+pad)
+        offset+=cls.packed_size
+    return numpy.dtype({"names":names,"formats":formats,"offsets":offsets,"itemsize":offset})
+
+def _column(values,dtype):
+    if dtype.startswith("datetime64"):
+        return numpy.array(values,dtype="int64").view(dtype)
+    return numpy.array(values,dtype=dtype)
+
+def _block_column(values,dtype):
+    # values is a field of a structured array over the file, always copied
+    if dtype.startswith("datetime64"):
+        return values.astype("int64").view(dtype)
+    return values.astype(dtype)
+
+def datetime_strings(values):
+    # Vectorised text of a datetime64 column, the same as str() of the Ipdr dateTime
+    # type it was decoded from (IpdrDateTimeMsec.format_values does the same for plain values).
+    unit=numpy.datetime_data(values.dtype)[0]
+    return numpy.char.replace(numpy.datetime_as_string(values,unit=unit),"T"," ")
+
+class RecordColumns(object):
+    # Collects the records of one RecordDescriptor, rows are turned into
+    # numpy columns every chunk_rows records to bound the python objects held.
+    def __init__(self,decoder,chunk_rows=65536):
+        self.descriptorId=int(decoder.descriptor.descriptorId)
+        self.typeName=str(decoder.descriptor.typeName)
+        self.names=decoder.names
+        self.dtypes=[numpy_dtypes[cls] for cls in decoder.classes]
+        self.record_dtype=record_dtype(decoder)
+        self.chunk_rows=chunk_rows
+        self.rows=[]
+        self.chunks=[]
+
+    def same_layout(self,decoder):
+        return self.names == decoder.names and self.dtypes == [numpy_dtypes[cls] for cls in decoder.classes]
+
+    def append(self,values):
+        self.rows.append(values)
+        if len(self.rows) >= self.chunk_rows:
+            self.flush()
+
+    def append_block(self,buf,offset,count,descriptorId):
+        # Decodes up to count consecutive IPDRREC elements of descriptorId
+        # starting at offset with one numpy.frombuffer, stops at the first element
+        # of another kind or descriptorId, returns how many were decoded.
+        self.flush()
+        block=numpy.frombuffer(buf,self.record_dtype,count,offset)
+        same=(block["kind"] == IpdrElementTypeEnum.IPDRREC) & (block["descriptorId"] == descriptorId)
+        if not same.all():
+            block=block[:same.argmin()]
+        self.chunks.append([_block_column(block["f%d" % i],dtype) for (i,dtype) in enumerate(self.dtypes)])
+        return len(block)
+
+    def flush(self):
+        if self.rows:
+            self.chunks.append([_column(values,dtype) for (values,dtype) in zip(zip(*self.rows),self.dtypes)])
+            self.rows=[]
+
+    def __len__(self):
+        return sum([len(chunk[0]) for chunk in self.chunks])+len(self.rows)
+
+    def to_arrays(self):
+        # OrderedDict attributeName -> numpy array, in RecordDescriptor order
+        self.flush()
+        arrays=OrderedDict()
+        for (i,name) in enumerate(self.names):
+            if self.chunks:
+                arrays[name]=numpy.concatenate([chunk[i] for chunk in self.chunks])
+            else:
+                arrays[name]=numpy.array([],dtype=self.dtypes[i])
+        return arrays
+
+def decode_columns(buf,chunk_rows=65536,block_rows=65536):
+    # Decodes the IPDRDoc in buf (str, bytearray, mmap...) into
+    # OrderedDict typeName -> OrderedDict attributeName -> numpy array.
+    # Should two RecordDescriptors share a typeName with different attributes,
+    # the later one is keyed "typeName/descriptorId".
+    # Runs of records whose RecordDescriptor only has fixed size attributes 
+    # are decoded block_rows at a time with numpy.frombuffer.
+    if numpy is None:
+        raise ImportError("numpy is required for the columnar export")
+    (header,offset)=IPDRHeader.unpack_from(buf)
+    (length,offset)=IpdrInt.unpack_from(buf,offset)
+    end=len(buf)
+    groups=OrderedDict()
+    decoders={}
+    by_decoder={}
+    i=0
+    while((i<length or length < 0) and offset < end):
+        kind=struct.unpack_from("!l",buf,offset)[0]
+        if kind == IpdrElementTypeEnum.RECORDDESC:
+            (desc,offset)=RecordDescriptor.unpack_from(buf,offset+4)
+            decoders[int(desc.descriptorId)]=RecordDecoder(desc)
+        elif kind == IpdrElementTypeEnum.IPDRREC:
+            descriptorId=struct.unpack_from("!l",buf,offset+4)[0]
+            if descriptorId not in decoders:
+                raise XDRError, 'value=%d not a previously streamed RecordDescriptor Id' % descriptorId
+            decoder=decoders[descriptorId]
+            columns=by_decoder.get(decoder)
+            if columns is None:
+                columns=RecordColumns(decoder,chunk_rows)
+                key=columns.typeName
+                if key in groups and not groups[key].same_layout(decoder):
+                    key="%s/%d" % (columns.typeName,columns.descriptorId)
+                columns=by_decoder[decoder]=groups.setdefault(key,columns)
+            if columns.record_dtype is not None:
+                width=columns.record_dtype.itemsize
+                count=min(block_rows,(end-offset)//width)
+                if length >= 0:
+                    count=min(count,length-i)
+                # Only worth it when at least the next element continues the run
+                if count > 1 and struct.unpack_from("!ll",buf,offset+width) == (IpdrElementTypeEnum.IPDRREC,descriptorId):
+                    count=columns.append_block(buf,offset,count,descriptorId)
+                    offset+=count*width
+                    i+=count
+                    continue
+            (values,offset)=decoder.unpack_raw_from(buf,offset+8)
+            columns.append(values)
+        elif kind == IpdrElementTypeEnum.DOCEND:
+            offset=IPDRDocEnd.unpack_from(buf,offset+4)[1]
+        else:
+            raise XDRError, 'bad switch=%s' % kind
+        i+=1
+    return OrderedDict([(key,columns.to_arrays()) for (key,columns) in groups.items()])
+
+def load_columns(filep,chunk_rows=65536):
+    buf=mmap.mmap(filep.fileno(),0,access=mmap.ACCESS_READ)
+    try:
+        return decode_columns(buf,chunk_rows)
+    finally:
+        buf.close()
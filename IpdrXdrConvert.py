@@ -0,0 +1,140 @@
+###############################################################################
+# Conversion of Ipdr-Xdr files into their python representation or XML,
+# used by the ipdr_xdr_to_repr.py / ipdr_xdr_to_xml.py scripts and batch conversion.
+###############################################################################
+
+import sys,re,mmap,contextlib
+from IpdrXdrDocumentClasses import *
+from IpdrXdrStream import open_input,StreamReader
+
+def map_file(filep):
+    return mmap.mmap(filep.fileno(),0,access=mmap.ACCESS_READ)
+
+@contextlib.contextmanager
+def open_source(xdr_file):
+    # An mmap of a plain file, a StreamReader of a compressed file, of stdin ("-"),
+    # of a FIFO or of a connection ("tcp://host:port")
+    (filep,compression)=open_input(xdr_file)
+    try:
+        if not isinstance(filep,StreamReader):
+            buf=map_file(filep)
+            try:
+                yield buf
+            finally:
+                buf.close()
+        else:
+            yield filep
+    finally:
+        filep.close()
+
+def iter_document(ipdr,source,record_filter=None,context=None):
+    # The IPDRHeader then the IPDRStreamElements of the IPDRDoc in source, a buffer
+    # (str, mmap...) decoded at advancing offsets or a stream decoded with read(),
+    # within context (see DecoderContext) when given
+    if hasattr(source,"__len__"):
+        return ipdr.iter_unpack_from(source,record_filter=record_filter,context=context)
+    return ipdr.iter_load(source,record_filter=record_filter,context=context)
+
+class ReprFormatter(object):
+    # Pretty prints a python representation written to it in chunks:
+    # a line break and indentation after "(", "[" and ",", before ")" and "]",
+    # only up to max_indent. Each chunk is split on those characters once, 
+    # so formatting is linear and the indentation state is carried across chunks.
+    tokens=re.compile(r"([\t\n()\[\],])")
+
+    def __init__(self,outp,max_indent=15):
+        self.outp=outp
+        self.max_indent=max_indent
+        self.indent=0
+        self.a_new_line=False
+
+    def write(self,s):
+        out=[]
+        for token in self.tokens.split(s):
+            if token == "" or token == "\t" or token == "\n":
+                continue
+            if token == ")" or token == "]":
+                self.a_new_line=False
+                self.indent -= 2
+                if self.indent < (self.max_indent-2):
+                    out.append("\n"+" "*self.indent)
+                out.append(token)
+            elif token == "(" or token == "[":
+                self.a_new_line=False
+                out.append(token)
+                self.indent += 2
+                if self.indent < self.max_indent:
+                    out.append("\n"+" "*self.indent)
+            elif token == ",":
+                self.a_new_line=False
+                out.append(token)
+                if self.indent < self.max_indent:
+                    out.append("\n"+" "*self.indent)
+                    self.a_new_line=True
+            else:
+                if self.a_new_line:
+                    # spaces following a line break are dropped
+                    token=token.lstrip(" ")
+                    if token == "":
+                        continue
+                    self.a_new_line=False
+                out.append(token)
+        self.outp.write("".join(out))
+
+# Produces the same text as repr(IPDRDoc.load(filep)), one element at a time,
+# decoding from a buffer (e.g. an mmap of the file) rather than with small reads,
+# or from a stream (see iter_document).
+# With a record_filter only the selected records and attributes are output.
+def repr_chunks(buf,record_filter=None,context=None):
+    ipdr=IPDRDoc()
+    elements=iter_document(ipdr,buf,record_filter,context)
+    yield "%s(header=%s, " % (ipdr.__class__.__name__,repr(next(elements)))
+    yield "elements=%s(types=%s,length=%s,array=[" % (ipdr.elements.__class__.__name__,ipdr.elements.cls.__name__,ipdr.elements.length)
+    sep=""
+    for element in elements:
+        yield sep+repr(element)
+        sep=", "
+    yield "]))"
+
+def write_repr(buf,outp,max_indent=15,record_filter=None,context=None):
+    formatter=ReprFormatter(outp,max_indent)
+    for s in repr_chunks(buf,record_filter,context):
+        formatter.write(s)
+
+# Each IPDRStreamElement is written out as soon as it is decoded,
+# so the whole IPDRDoc is never held in memory.
+def write_xml(buf,outp,pretty=True,record_filter=None,context=None):
+    writer=IpdrXmlWriter(outp,pretty)
+    writer.declaration()
+    ipdr=IPDRDoc()
+    elements=iter_document(ipdr,buf,record_filter,context)
+    writer.start(ipdr.__class__.__name__)
+    next(elements).write_xml(writer)
+    writer.start("array",[("length",ipdr.elements.length)])
+    for element in elements:
+        element.write_xml(writer)
+    writer.end("array")
+    writer.end(ipdr.__class__.__name__)
+    writer.close()
+
+@contextlib.contextmanager
+def open_output(path):
+    # The file opened for writing, stdout for "-"
+    if path == "-":
+        yield sys.stdout
+        sys.stdout.flush()
+    else:
+        with open(path,"w") as outp:
+            yield outp
+
+# xdr_file may be gzip, bz2 or xz compressed, it is then decompressed as it is decoded,
+# and may be read from stdin, a FIFO or a connection, see open_source.
+def xdr_to_repr(xdr_file,repr_file,record_filter=None,context=None):
+    with open_source(xdr_file) as source:
+        with open_output(repr_file) as outp:
+            write_repr(source,outp,record_filter=record_filter,context=context)
+
+def xdr_to_xml(xdr_file,xml_file,pretty=True,record_filter=None,context=None):
+    with open_source(xdr_file) as source:
+        with open_output(xml_file) as outp:
+            write_xml(source,outp,pretty,record_filter,context)
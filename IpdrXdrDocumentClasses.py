@@ -6,7 +6,9 @@
 from IpdrXdrElementaryTypes import *
 from collections import OrderedDict
 from xdrlib import Error as XDRError
-import copy
+from IpdrXdrStream import StreamReader,TruncatedError
+from IpdrXdrProfile import DecodeProfile,ProfilingLoader
+import copy,mmap,re,operator
 
 class IpdrStructure(object):
     _struc=OrderedDict([])
@@ -17,6 +19,9 @@ class IpdrStructure(object):
             self.__setattr__(attr,value)
             
     def __getattr__(self,attr):
+        # Special methods (e.g. __getstate__ when pickling) must not default to None
+        if attr.startswith("__"):
+            raise AttributeError(attr)
         return None
                 
     def __repr__(self):
@@ -29,20 +34,27 @@ class IpdrStructure(object):
     __str__ = __repr__
     
     def to_xml(self):
-        out = ""
+        writer=IpdrXmlWriter()
+        self.write_xml(writer)
+        return writer.getvalue()
+
+    def write_xml(self,writer):
+        writer.start(self.__class__.__name__)
         for attr in self._struc.keys():
             value=getattr(self,attr)
             if value is not None:
-                #if hasattr(value,"to_xml"):
-                #    value=value.to_xml()
+                attrs=[]
                 if hasattr(value,"ipdr_type"):
-                    out += '<{attr} type=\"{type}\">'.format(attr=attr,type=value.ipdr_type)
+                    attrs=[("type",value.ipdr_type)]
+                if hasattr(value,"write_xml"):
+                    writer.start(attr,attrs)
+                    value.write_xml(writer)
+                    writer.end(attr)
+                elif hasattr(value,"to_xml"):
+                    writer.element(attr,value.to_xml(),attrs)
                 else:
-                    out += '<{attr}>'.format(attr=attr)
-                if hasattr(value,"to_xml"):
-                    value=value.to_xml()
-                out += '{value}</{attr}>'.format(attr=attr,value=value)
-        return '<{cls}>{inner}</{cls}>'.format(cls=self.__class__.__name__,inner=out)
+                    writer.element(attr,str(value),attrs)
+        writer.end(self.__class__.__name__)
     
     def pack(self):
         out = ""
@@ -61,6 +73,16 @@ class IpdrStructure(object):
             obj.__setattr__(k,v.load(filep))
         return obj
 
+    @classmethod
+    def unpack_from(cls,buf,offset=0):
+        obj=cls()
+        for (k,v) in obj._struc.items():
+            if isinstance(v,object):
+                v=copy.deepcopy(v)
+            (val,offset)=v.unpack_from(buf,offset)
+            obj.__setattr__(k,val)
+        return (obj,offset)
+
 class AttributeDescriptor(IpdrStructure):
     # XDR definition:
     # struct AttributeDescriptor {
@@ -72,14 +94,9 @@ class AttributeDescriptor(IpdrStructure):
         ("typeId",IpdrInt)
     ])
     
-    def to_xml(self):
-        return "<AttributeDescriptor attributeName=\"{}\" typeId=\"{}\" derivedType=\"{}\"/>".format(self.attributeName,self.typeId,ipdr_class_from_type_id[self.typeId].ipdr_type)
+    def write_xml(self,writer):
+        writer.empty("AttributeDescriptor",[("attributeName",self.attributeName),("typeId",self.typeId),("derivedType",ipdr_class_from_type_id[self.typeId].ipdr_type)])
         
-#
-# Store RecordDescriptors so they can used to unpack RecordData
-#
-recordDescriptorDict={} 
-
 class RecordDescriptor(IpdrStructure):
     # XDR definition:
     # struct RecordDescriptor {
@@ -93,17 +110,336 @@ class RecordDescriptor(IpdrStructure):
         ("attributes",IpdrArray(AttributeDescriptor))
     ])
 
+class RecordDecoder(object):
+    # Compiled once per RecordDescriptor.
+    # Consecutive fixed size attributes are collapsed into a single struct.Struct, 
+    # (the TM Forum format does not pad, so their unpack_str simply concatenate)
+    # variable length attributes (IpdrString, IpdrHexBinary, IpdrIpAddr) use their own load().
+    # With value_caches ({class: ValueCache}, see DecoderContext) the values of those
+    # classes are decoded through these caches (types are then CachedValueTypes)
+    # rather than the process wide ones, classes remain the Ipdr classes.
+    # With a profile (see IpdrXdrProfile.DecodeProfile) the types count and time their calls.
+    def __init__(self,recordDescriptor,value_caches=None,profile=None):
+        self.descriptor=recordDescriptor
+        self.names=[]
+        self.classes=[]
+        self.types=[]
+        self.steps=[]
+        fmt=""
+        converters=[]
+        for attributeDescriptor in recordDescriptor.attributes:
+            ipdr_class=ipdr_class_from_type_id[attributeDescriptor.typeId]
+            ipdr_type=ipdr_class
+            if value_caches and ipdr_class in value_caches:
+                ipdr_type=CachedValueType(ipdr_class,value_caches[ipdr_class])
+            if profile is not None:
+                ipdr_type=profile.profiled_type(ipdr_type,ipdr_class)
+            self.names.append(str(attributeDescriptor.attributeName))
+            self.classes.append(ipdr_class)
+            self.types.append(ipdr_type)
+            if ipdr_class.packed_size > 0:
+                fmt+=ipdr_class.unpack_str.lstrip("!")
+                converters.append(ipdr_type.from_value)
+                continue
+            if converters:
+                self.steps.append((struct.Struct("!"+fmt),converters))
+                fmt=""
+                converters=[]
+            self.steps.append((None,ipdr_type))
+        if converters:
+            self.steps.append((struct.Struct("!"+fmt),converters))
+        self.record_class=record_class(self.names)
+        # Offset of each attribute within the record data, 
+        # only known in advance when they are all fixed size.
+        self.fixed_offsets=None
+        if all([cls.packed_size > 0 for cls in self.classes]):
+            self.fixed_offsets=[]
+            offset=0
+            for cls in self.classes:
+                self.fixed_offsets.append(offset)
+                offset+=cls.packed_size
+        self.lazy_class=None
+
+    def load(self,filep):
+        values=[]
+        for (packer,converters) in self.steps:
+            if packer is None:
+                values.append(converters.load(filep))
+            else:
+                values.extend([f(v) for (f,v) in zip(converters,packer.unpack(filep.read(packer.size)))])
+        return values
+
+    def unpack_from(self,buf,offset=0):
+        values=[]
+        for (packer,converters) in self.steps:
+            if packer is None:
+                (val,offset)=converters.unpack_from(buf,offset)
+                values.append(val)
+            else:
+                values.extend([f(v) for (f,v) in zip(converters,packer.unpack_from(buf,offset))])
+                offset+=packer.size
+        return (values,offset)
+
+    def unpack_raw_from(self,buf,offset=0):
+        # As unpack_from, but the fixed size attributes are returned as the plain
+        # values struct unpacks (int, long, float, str) without building Ipdr* objects.
+        values=[]
+        for (packer,converters) in self.steps:
+            if packer is None:
+                (val,offset)=converters.unpack_from(buf,offset)
+                values.append(val)
+            else:
+                values.extend(packer.unpack_from(buf,offset))
+                offset+=packer.size
+        return (values,offset)
+
+    def read_raw(self,filep):
+        # Reads the packed record data without decoding it
+        parts=[]
+        size=0
+        for (packer,converters) in self.steps:
+            if packer is None:
+                prefix=filep.read(4)
+                parts.append(prefix)
+                size+=4
+                if len(prefix) == 4:
+                    length=struct.unpack("!L",prefix)[0]
+                    parts.append(filep.read(length))
+                    size+=length
+            else:
+                parts.append(filep.read(packer.size))
+                size+=packer.size
+        raw="".join(parts)
+        if len(raw) < size:
+            raise TruncatedError, 'truncated stream, record data of %d bytes is %d bytes short' % (size,size-len(raw))
+        return raw
+
+    def field_offsets(self,buf,offset=0):
+        # Offset of each attribute of the record data packed at offset
+        if self.fixed_offsets is not None and offset == 0:
+            return self.fixed_offsets
+        offsets=[]
+        for cls in self.classes:
+            offsets.append(offset)
+            if cls.packed_size > 0:
+                offset+=cls.packed_size
+            else:
+                offset+=4+struct.unpack_from("!L",buf,offset)[0]
+        return offsets
+
+    def skip_from(self,buf,offset=0):
+        # Returns the offset following the record without decoding it,
+        # only the length prefix of variable length attributes is read.
+        # A record running past the end of buf raises a TruncatedError.
+        for (packer,converters) in self.steps:
+            if packer is None:
+                offset+=4+struct.unpack_from("!L",buf,offset)[0]
+            else:
+                offset+=packer.size
+        if offset > len(buf):
+            raise TruncatedError, 'truncated stream, record data ends at offset %d past %d' % (offset,len(buf))
+        return offset
+
+class DecoderContext(object):
+    # State of the decoding of one IPDRDoc: the RecordDescriptors streamed so far and
+    # the RecordDecoder compiled from each, whether records are decoded lazily, the
+    # value caches and statistics. Documents decoded each with their own context do
+    # not share anything, so they may be decoded at the same time (e.g. in threads).
+    # value_cache: None to use the process wide value caches (see enable_value_cache),
+    #     otherwise the maxsize (or dict class -> size) of caches owned by the context.
+    # profile: an IpdrXdrProfile.DecodeProfile gathering decoding statistics, None
+    #     (the default) for no profiling at all.
+    # A context is also the loader (see IpdrArray.iter_load) of the IPDRStreamElements
+    # decoded within it.
+    def __init__(self,lazy=False,value_cache=None,profile=None):
+        self.lazy=lazy
+        self.profile=profile
+        self.descriptors={}  # descriptorId -> RecordDescriptor
+        self.decoders={}     # descriptorId -> RecordDecoder
+        self.value_caches=None if value_cache is None else make_value_caches(value_cache)
+        self.documents=0
+        self.records=0       # IPDRRecords decoded and kept (see accept)
+
+    def reset(self):
+        # Empties the descriptor table, e.g. at the start of a document.
+        # Cached values and statistics are kept.
+        self.descriptors.clear()
+        self.decoders.clear()
+
+    def add_descriptor(self,desc):
+        descriptorId=int(desc.descriptorId)
+        self.descriptors[descriptorId]=desc
+        self.decoders[descriptorId]=RecordDecoder(desc,self.value_caches,self.profile)
+        if self.profile is not None:
+            self.profile.type_names[descriptorId]=str(desc.typeName)
+
+    def decoder(self,descriptorId):
+        decoder=self.decoders.get(descriptorId)
+        if decoder is None:
+            if descriptorId not in self.descriptors:
+                raise XDRError, 'value=%d not a previously streamed RecordDescriptor Id' % descriptorId
+            decoder=self.decoders[descriptorId]=RecordDecoder(self.descriptors[descriptorId],self.value_caches,self.profile)
+        return decoder
+
+    def load(self,filep):
+        return IPDRStreamElement.load(filep,self)
+
+    def unpack_from(self,buf,offset=0):
+        return IPDRStreamElement.unpack_from(buf,offset,self)
+
+    def accept(self,obj):
+        # The reader (see IpdrArray) keeps the element obj it decoded, possibly None.
+        # Elements are counted here rather than as decoded: a stream reader decodes
+        # an element cut by the end of its buffer again once it has read more.
+        if obj is not None and obj.kind == IpdrElementTypeEnum.IPDRREC:
+            self.records+=1
+
+    def element_loader(self,record_filter=None):
+        # Loader of the IPDRStreamElements decoded within this context, 
+        # through record_filter (see IpdrXdrFilter.RecordFilter) when given
+        loader=self
+        if record_filter is not None:
+            loader=ContextLoader(record_filter,self)
+        if self.profile is not None:
+            loader=ProfilingLoader(loader,self.profile)
+        return loader
+
+    def watch(self,filep,offset=0):
+        # The stream a document is read from, its reads are counted when profiling,
+        # or the buffer it is decoded from at offset
+        if self.profile is not None:
+            self.profile.watch(filep,offset)
+        return filep
+
+    def stats(self):
+        if self.value_caches is None:
+            caches=value_cache_stats()
+        else:
+            caches=dict([(cls.__name__,cache.stats()) for (cls,cache) in self.value_caches.items()])
+        stats={"documents":self.documents,"descriptors":len(self.descriptors),"records":self.records,"value_caches":caches}
+        if self.profile is not None:
+            stats["profile"]=self.profile.stats()
+        return stats
+
+class ContextLoader(object):
+    # Element loader calling loader.load(filep,context) and loader.unpack_from(buf,offset,context)
+    def __init__(self,loader,context):
+        self.loader=loader
+        self.context=context
+
+    def load(self,filep):
+        return self.loader.load(filep,self.context)
+
+    def unpack_from(self,buf,offset=0):
+        return self.loader.unpack_from(buf,offset,self.context)
+
+    def accept(self,obj):
+        self.context.accept(obj)
+
+def document_context(lazy=False,context=None):
+    # The DecoderContext of a new IPDRDoc: context emptied of the RecordDescriptors of the
+    # previous document (its lazy setting, caches and statistics are kept), or a new one.
+    if context is None:
+        context=DecoderContext(lazy)
+    else:
+        context.reset()
+    context.documents+=1
+    if context.profile is not None:
+        context.profile.documents+=1
+    return context
+
+#
+# Context of the IPDRStreamElements and IPDRRecords decoded without one
+#
+default_context=DecoderContext()
+# Kept for compatibility, the descriptor tables of default_context
+recordDescriptorDict=default_context.descriptors
+recordDecoderDict=default_context.decoders
+
+def reset_record_descriptors(lazy=False):
+    # Starts a new document in default_context
+    default_context.reset()
+    default_context.lazy=lazy
+
+def get_record_decoder(descriptorId):
+    return default_context.decoder(descriptorId)
+
+def iter_element_spans(buf,offset):
+    # Walks the IPDRStreamElement array starting at offset (i.e. just after the IPDRHeader) 
+    # without decoding the records, yields (kind,start,end,item) for each element, 
+    # item being the RecordDescriptor, the RecordDecoder of the record or the IPDRDocEnd.
+    # The RecordDescriptors are kept in a table local to the walk.
+    elements=IpdrArray(IPDRStreamElement)
+    for (span,offset) in elements.iter_unpack_from(buf,offset,RawElementLoader(spans=True)):
+        yield span
+
+class RawElementLoader(object):
+    # Element loader (see IpdrArray.iter_load/iter_unpack_from) leaving the elements packed:
+    # each is (kind,item,packed), item as for iter_element_spans, packed the whole element,
+    # or (kind,start,end,item) with spans, nothing being copied.
+    # The RecordDescriptors are kept in a table local to the loader.
+    def __init__(self,spans=False):
+        self.spans=spans
+        self.decoders={}
+
+    def unpack_from(self,buf,offset=0):
+        start=offset
+        kind=struct.unpack_from("!l",buf,offset)[0]
+        offset+=4
+        if kind == IpdrElementTypeEnum.RECORDDESC:
+            (item,offset)=RecordDescriptor.unpack_from(buf,offset)
+            self.decoders[int(item.descriptorId)]=RecordDecoder(item)
+        elif kind == IpdrElementTypeEnum.IPDRREC:
+            descriptorId=struct.unpack_from("!l",buf,offset)[0]
+            item=self.decoders.get(descriptorId)
+            if item is None:
+                raise XDRError, 'value=%d not a previously streamed RecordDescriptor Id' % descriptorId
+            offset=item.skip_from(buf,offset+4)
+        elif kind == IpdrElementTypeEnum.DOCEND:
+            (item,offset)=IPDRDocEnd.unpack_from(buf,offset)
+        else:
+            raise XDRError, 'bad switch=%s' % kind
+        if offset > len(buf):
+            raise TruncatedError, 'truncated stream, element at offset %d ends at offset %d past %d' % (start,offset,len(buf))
+        if self.spans:
+            return ((kind,start,offset,item),offset)
+        return ((kind,item,buf[start:offset]),offset)
+
+def iter_raw_elements(source):
+    # Yields the IPDRHeader, then (kind,item,packed) for each IPDRStreamElement (see
+    # RawElementLoader) of the IPDRDoc in source, a buffer (str, mmap...) or a stream,
+    # the records are not decoded.
+    loader=RawElementLoader()
+    elements=IpdrArray(IPDRStreamElement)
+    if hasattr(source,"__len__"):
+        (header,offset)=IPDRHeader.unpack_from(source)
+        yield header
+        for (element,offset) in elements.iter_unpack_from(source,offset,loader):
+            yield element
+    else:
+        source=buffered(source)
+        yield IPDRHeader.load(source)
+        for element in elements.iter_load(source,loader):
+            yield element
+
 class IPDRRecordData(IpdrStructure):
     _struc=OrderedDict([])
     
+    def __init__(self,**kwargs):
+        # Each instance records its own attributes, the class level _struc stays empty.
+        object.__setattr__(self,"_struc",OrderedDict())
+        super(IPDRRecordData,self).__init__(**kwargs)
+
     def __setattr__(self,attr,val):
         if attr != "_struc" and attr not in self._struc:
                 self._struc[attr]=None
         return super(IPDRRecordData,self).__setattr__(attr,val)
         
     def __getattr__(self,attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
         return None
-        
+
     def ___repr__(self):
         out = []
         for attr in self._struc.keys():
@@ -112,15 +448,163 @@ class IPDRRecordData(IpdrStructure):
                 out += ['{}={}({})'.format(attr,val.ipdr_type,val)]
         return (', '.join(out))
         
-    def to_xml(self):
-        out = ""
+    def write_xml(self,writer):
         for attr in self._struc.keys():
             val=getattr(self,attr)
             if val is not None:
-                out += "<{attr} type=\"{type}\">{value}</{attr}>".format(attr=attr,type=val.ipdr_type,value=val.to_xml())
-        return out
+                writer.element(attr,val.to_xml(),[("type",val.ipdr_type)])
+
+class RecordRowBase(object):
+    # Output shared by the eager and lazy forms of the data of a decoded IPDRRecord,
+    # the same as for the list of single attribute IPDRRecordData used previously.
+    __slots__=()
+    _fields=()
+    _index={}
+
+    def __getattr__(self,attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        i=self._index.get(attr)
+        if i is None:
+            return None
+        return self[i]
+
+    def items(self):
+        return zip(self._fields,self)
+
+    def get(self,attr,default=None):
+        # Value of attributeName attr, also when attr is not usable as a row attribute
+        # (e.g. an attributeName "pack" or "count", see _row_namespace)
+        i=self._index.get(attr)
+        if i is None:
+            return default
+        return self[i]
+
+    def record_data(self,i):
+        # The i-th attribute as the single attribute IPDRRecordData that data[i] was
+        # before records were rows, e.g. rec.data.record_data(0).Test_String
+        data=IPDRRecordData()
+        setattr(data,self._fields[i],self[i])
+        return data
+
+    def __repr__(self):
+        return "[%s]" % ", ".join(["IPDRRecordData(%s=%r)" % (attr,val) for (attr,val) in zip(self._fields,self) if val is not None])
+
+    def write_xml(self,writer):
+        for (attr,val) in zip(self._fields,self):
+            if val is not None:
+                writer.element(attr,val.to_xml(),[("type",val.ipdr_type)])
+
+class IPDRRecordRow(RecordRowBase,tuple):
+    # Compact form of the data of a decoded IPDRRecord: the attribute values in
+    # RecordDescriptor order, with no per field object or __dict__.
+    # A subclass is generated per attribute list by record_class(), giving access 
+    # to the values by attributeName.
+    __slots__=()
+
+    def __reduce__(self):
+        return (_restore_record_row,(self._fields,tuple(self)))
+
+    def pack(self):
+        return "".join([val.pack() for val in self])
+
+_record_classes={}
+
+def record_class(fields):
+    # IPDRRecordRow subclass for the attribute names in fields, shared by all 
+    # RecordDescriptors with the same attribute names.
+    fields=tuple(fields)
+    cls=_record_classes.get(fields)
+    if cls is None:
+        cls=_record_classes[fields]=type("IPDRRecordRow",(IPDRRecordRow,),_row_namespace(fields,operator.itemgetter))
+    return cls
+
+def _row_namespace(fields,getter):
+    # Class attributes of a row class: field order, index by name
+    # and a property per attributeName usable as a python identifier.
+    # attributeNames that are also names of the row classes (pack, items, count,
+    # _fields...) get no property, they are read with get().
+    index={}
+    namespace={"__slots__":(),"_fields":fields,"_index":index}
+    for (i,attr) in enumerate(fields):
+        if attr not in index:
+            index[attr]=i
+            if re.match(r"^[A-Za-z_][A-Za-z0-9_]*$",attr) and not attr.startswith("__") and attr not in _row_names:
+                namespace[attr]=property(getter(i))
+    return namespace
+
+def _restore_record_row(fields,values):
+    return record_class(fields)(values)
+
+class IPDRLazyRecordRow(RecordRowBase):
+    # Lazy form of IPDRRecordRow: keeps the packed record data and decodes an attribute 
+    # into its Ipdr* type the first time it is accessed, caching the result.
+    # Attribute offsets come from the RecordDecoder: fixed once per RecordDescriptor 
+    # when all its attributes are fixed size, otherwise found per record on first access
+    # by reading the length prefixes of the variable length attributes only.
+    # A subclass is generated per RecordDecoder by lazy_record_class().
+    __slots__=("_raw","_offsets","_values")
+    _decoder=None
+
+    def __init__(self,raw):
+        self._raw=raw
+        self._offsets=None
+        self._values=None
+
+    def _value(self,i):
+        if self._values is None:
+            self._values=[None]*len(self._fields)
+        val=self._values[i]
+        if val is None:
+            if self._offsets is None:
+                self._offsets=self._decoder.field_offsets(self._raw)
+            val=self._values[i]=self._decoder.types[i].unpack_from(self._raw,self._offsets[i])[0]
+        return val
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return tuple([self._value(j) for j in range(*i.indices(len(self._fields)))])
+        if i < 0:
+            i+=len(self._fields)
+        if i < 0 or i >= len(self._fields):
+            raise IndexError("record index out of range")
+        return self._value(i)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __iter__(self):
+        for i in range(len(self._fields)):
+            yield self._value(i)
+
+    def __eq__(self,other):
+        return tuple(self) == tuple(other)
+
+    def __ne__(self,other):
+        return not self == other
+
+    def decode(self):
+        # Eager IPDRRecordRow with every attribute decoded
+        return self._decoder.record_class(self)
+
+    def __reduce__(self):
+        # Pickled decoded, the RecordDecoder is not sent along
+        return self.decode().__reduce__()
+
+    def pack(self):
+        return self._raw
+
+# Names of the eager and lazy row classes, not to be shadowed by attributeNames
+_row_names=frozenset(dir(IPDRRecordRow))|frozenset(dir(IPDRLazyRecordRow))
+
+def lazy_record_class(decoder):
+    # IPDRLazyRecordRow subclass bound to decoder, created once per RecordDecoder
+    if decoder.lazy_class is None:
+        namespace=_row_namespace(tuple(decoder.names),lambda i: lambda self: self._value(i))
+        namespace["_decoder"]=decoder
+        decoder.lazy_class=type("IPDRLazyRecordRow",(IPDRLazyRecordRow,),namespace)
+    return decoder.lazy_class
 
-        
 class IPDRRecord(IpdrStructure):
     # XDR definition:
     # struct IPDRRecord {
@@ -134,29 +618,53 @@ class IPDRRecord(IpdrStructure):
     
     def pack(self):
         out=self.descriptorId.pack()
+        if isinstance(self.data,RecordRowBase):
+            return out+self.data.pack()
         for el in self.data:
             out+=el.pack()
         return out
     
+    # context: the DecoderContext of the document, default_context when None
     @classmethod
-    def load(cls,filep):
+    def load(cls,filep,context=None):
+        if context is None:
+            context=default_context
         obj=cls()
         obj.descriptorId=IpdrInt.load(filep)
-        if obj.descriptorId not in recordDescriptorDict:
-            raise XDRError, 'value=%d not a previously streamed RecordDescriptor Id' % obj.descriptorId
-        list=[]
-        for attributeDescriptor in recordDescriptorDict[int(obj.descriptorId)].attributes:
-            ipdr_class=ipdr_class_from_type_id[attributeDescriptor.typeId]
-            el = IPDRRecordData() 
-            attr=attributeDescriptor.attributeName
-            val=ipdr_class.load(filep)
-            setattr(el,attr,val)
-            list.append(el)
-        obj.data=list
+        decoder=context.decoder(int(obj.descriptorId))
+        if context.lazy:
+            obj.data=lazy_record_class(decoder)(decoder.read_raw(filep))
+        else:
+            obj.data=decoder.record_class(decoder.load(filep))
         return obj
+
+    @classmethod
+    def unpack_from(cls,buf,offset=0,context=None):
+        if context is None:
+            context=default_context
+        obj=cls()
+        (obj.descriptorId,offset)=IpdrInt.unpack_from(buf,offset)
+        decoder=context.decoder(int(obj.descriptorId))
+        if context.lazy:
+            # The span is copied, buf (e.g. an mmap) may be closed once decoded
+            start=offset
+            offset=decoder.skip_from(buf,offset)
+            obj.data=lazy_record_class(decoder)(buf[start:offset])
+        else:
+            (values,offset)=decoder.unpack_from(buf,offset)
+            obj.data=decoder.record_class(values)
+        return (obj,offset)
         
-    def to_xml(self):
-        return '<IPDRRecord descriptorId=\"%s\"><IPDRRecordData>%s</IPDRRecordData></IPDRRecord>' % (self.descriptorId,"".join([x.to_xml() for x in self.data]))
+    def write_xml(self,writer):
+        writer.start("IPDRRecord",[("descriptorId",self.descriptorId)])
+        writer.start("IPDRRecordData")
+        if isinstance(self.data,RecordRowBase):
+            self.data.write_xml(writer)
+        else:
+            for x in self.data:
+                x.write_xml(writer)
+        writer.end("IPDRRecordData")
+        writer.end("IPDRRecord")
         
     def __repr__(self):
         return 'IPDRRecord(descriptorId=%s,data=%s)' % (repr(self.descriptorId),repr(self.data))
@@ -190,6 +698,8 @@ class IPDRStreamElement(IpdrStructure):
     ])
 
     def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
         return getattr(self.switch, attr)
 
     def __repr__(self):
@@ -200,16 +710,15 @@ class IPDRStreamElement(IpdrStructure):
                 out += ['%s=%s' % (attr,repr(val))]
         return '%s(%s)' % (self.__class__.__name__, ', '.join(out))
         
-    def to_xml(self):
-        out = "<IPDRStreamElement kind=\"%s\">" % self.kind
+    def write_xml(self,writer):
+        writer.start("IPDRStreamElement",[("kind",self.kind)])
         if self.kind == IpdrElementTypeEnum.RECORDDESC:
-            out += self.desc.to_xml()
+            self.desc.write_xml(writer)
         elif self.kind == IpdrElementTypeEnum.IPDRREC:
-            out += self.rec.to_xml()
+            self.rec.write_xml(writer)
         elif self.kind == IpdrElementTypeEnum.DOCEND:
-            out += self.docEnd.to_xml()
-        out += "</IPDRStreamElement>"
-        return out
+            self.docEnd.write_xml(writer)
+        writer.end("IPDRStreamElement")
         
     def pack(self):
         out=self.kind.pack()
@@ -221,21 +730,41 @@ class IPDRStreamElement(IpdrStructure):
             out += self.docEnd.pack()
         return out
         
+    # context: the DecoderContext of the document, default_context when None
     @classmethod
-    def load(cls,filep):
+    def load(cls,filep,context=None):
+        if context is None:
+            context=default_context
         obj=cls()
         obj.kind=IpdrElementTypeEnum.load(filep)
         if obj.kind == IpdrElementTypeEnum.RECORDDESC:
             obj.desc = RecordDescriptor.load(filep)
-            recordDescriptorDict[int(obj.desc.descriptorId)]=obj.desc
+            context.add_descriptor(obj.desc)
         elif obj.kind == IpdrElementTypeEnum.IPDRREC:
-            obj.rec = IPDRRecord.load(filep)
+            obj.rec = IPDRRecord.load(filep,context)
         elif obj.kind == IpdrElementTypeEnum.DOCEND:
             obj.docEnd = IPDRDocEnd.load(filep)
         else:
             raise XDRError, 'bad switch=%s' % obj.kind
         return obj
 
+    @classmethod
+    def unpack_from(cls,buf,offset=0,context=None):
+        if context is None:
+            context=default_context
+        obj=cls()
+        (obj.kind,offset)=IpdrElementTypeEnum.unpack_from(buf,offset)
+        if obj.kind == IpdrElementTypeEnum.RECORDDESC:
+            (obj.desc,offset) = RecordDescriptor.unpack_from(buf,offset)
+            context.add_descriptor(obj.desc)
+        elif obj.kind == IpdrElementTypeEnum.IPDRREC:
+            (obj.rec,offset) = IPDRRecord.unpack_from(buf,offset,context)
+        elif obj.kind == IpdrElementTypeEnum.DOCEND:
+            (obj.docEnd,offset) = IPDRDocEnd.unpack_from(buf,offset)
+        else:
+            raise XDRError, 'bad switch=%s' % obj.kind
+        return (obj,offset)
+
 class NameSpaceInfo(IpdrStructure):
     # XDR definition:
     # struct NameSpaceInfo {
@@ -268,6 +797,11 @@ class IPDRHeader(IpdrStructure):
         ("docId",IpdrUuid)
     ])
 
+def buffered(filep):
+    if hasattr(filep,"iter_unpack"):
+        return filep
+    return StreamReader(filep)
+
 class IPDRDoc(IpdrStructure):
     # XDR definition:
     # struct IPDRDoc {
@@ -278,11 +812,108 @@ class IPDRDoc(IpdrStructure):
         ("header",IPDRHeader),
         ("elements",IpdrArray(IPDRStreamElement))
     ])
-    def to_xml(self):
-        out = ""
+    def write_xml(self,writer):
+        writer.start(self.__class__.__name__)
         for attr in self._struc.keys():
             val=getattr(self,attr)
             if val is not None:
-                out += val.to_xml()
-        return '<%s>%s</%s>' % (self.__class__.__name__,out,self.__class__.__name__)
+                val.write_xml(writer)
+        writer.end(self.__class__.__name__)
+
+    # Each document is decoded within its own DecoderContext (see document_context), 
+    # so that decoding several files one after the other, or at the same time in
+    # threads, does not mix their RecordDescriptors. A context may be given, e.g.
+    # to share its value caches between documents or read its statistics, lazy is
+    # then the one of the context.
+    # With lazy=True the IPDRRecord data is an IPDRLazyRecordRow, attributes are
+    # only decoded when accessed. A record_filter (see IpdrXdrFilter.RecordFilter)
+    # selects and projects the records while they are decoded, elements.length
+    # remains the one of the file.
+    # filep is read through a StreamReader (large block reads, elements decoded from
+    # its buffer, no size needed to find the end), unless it is one already:
+    # it may be read past the end of the document.
+    @classmethod
+    def load(cls,filep,lazy=False,record_filter=None,context=None):
+        context=document_context(lazy,context)
+        filep=context.watch(buffered(filep))
+        obj=cls()
+        obj.header=IPDRHeader.load(filep)
+        obj.elements=IpdrArray(IPDRStreamElement)
+        obj.elements.load(filep,context.element_loader(record_filter))
+        return obj
+
+    @classmethod
+    def unpack_from(cls,buf,offset=0,lazy=False,record_filter=None,context=None):
+        context=document_context(lazy,context)
+        context.watch(buf,offset)
+        obj=cls()
+        (obj.header,offset)=IPDRHeader.unpack_from(buf,offset)
+        obj.elements=IpdrArray(IPDRStreamElement)
+        offset=obj.elements.unpack_from(buf,offset,context.element_loader(record_filter))[1]
+        return (obj,offset)
+
+    def iter_load(self,filep,lazy=False,record_filter=None,context=None):
+        # Streaming alternative to load(): yields the IPDRHeader and then each 
+        # IPDRStreamElement as it is decoded, nothing is kept in self.elements.
+        # Once the header has been yielded self.elements.length is known.
+        context=document_context(lazy,context)
+        filep=context.watch(buffered(filep))
+        self.header=IPDRHeader.load(filep)
+        self.elements=IpdrArray(IPDRStreamElement)
+        elements=self.elements.iter_load(filep,context.element_loader(record_filter))
+        yield self.header
+        for element in elements:
+            yield element
+
+    @classmethod
+    def iter_elements(cls,filep,lazy=False,record_filter=None,context=None):
+        return cls().iter_load(filep,lazy,record_filter,context)
+
+    # Same as iter_load/iter_elements, but decoding from a str, bytearray, 
+    # memoryview or mmap at advancing offsets rather than with filep.read().
+    def iter_unpack_from(self,buf,offset=0,lazy=False,record_filter=None,context=None):
+        for (element,offset) in self._iter_unpack_from(buf,offset,lazy,record_filter,context):
+            if element is not None:
+                yield element
+
+    def _iter_unpack_from(self,buf,offset,lazy,record_filter,context=None):
+        context=document_context(lazy,context)
+        context.watch(buf,offset)
+        (self.header,offset)=IPDRHeader.unpack_from(buf,offset)
+        self.elements=IpdrArray(IPDRStreamElement)
+        elements=self.elements.iter_unpack_from(buf,offset,context.element_loader(record_filter))
+        yield (self.header,offset)
+        for (element,offset) in elements:
+            yield (element,offset)
+
+    @classmethod
+    def iter_elements_from(cls,buf,offset=0,lazy=False,record_filter=None,context=None):
+        return cls().iter_unpack_from(buf,offset,lazy,record_filter,context)
+
+    @classmethod
+    def load_mmap(cls,filep,lazy=False,record_filter=None,context=None):
+        # Whole document decoded from a read-only mmap of filep
+        buf=mmap.mmap(filep.fileno(),0,access=mmap.ACCESS_READ)
+        try:
+            return cls.unpack_from(buf,0,lazy,record_filter,context)[0]
+        finally:
+            buf.close()
+
 
+def test():
+    # Migration from the list of single attribute IPDRRecordData the data of a record
+    # used to be: data[i] is now the value, data.record_data(i) the former data[i]
+    import os
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),"example.xdr"),"rb") as filep:
+        raw=filep.read()
+    for lazy in (False,True):
+        records=[e.rec for e in IPDRDoc.iter_elements_from(raw,lazy=lazy) if e.kind == IpdrElementTypeEnum.IPDRREC]
+        data=records[1].data
+        assert(data[0]=="Test_String" and data.Test_String is data[0] and data.get("Test_String") is data[0])
+        assert(data.record_data(0).Test_String is data[0])
+        assert(data.record_data(0).__dict__["Test_String"] is data[0])
+        assert(data.record_data(-1).Test_HexBinary=="ff00")
+        assert([data.record_data(i)._struc.keys() for i in range(len(data))]==[[name] for name in data._fields])
+        assert(data.items()==[(name,data.get(name)) for name in data._fields])
+        assert(repr(data)=="[%s]" % ", ".join([repr(data.record_data(i)) for i in range(len(data))]))
+        assert(int(records[0].data[7])==-1 and int(records[0].data.record_data(7).Test_Int)==-1)
@@ -8,7 +8,89 @@
 import os,re,datetime,time,struct
 import ipaddress,uuid,binascii
 import StringIO
+from IpdrXdrXmlWriter import IpdrXmlWriter
+from IpdrXdrStream import TruncatedError
 
+#
+# Optional bounded LRU caches of decoded values, per Ipdr class, keyed on the raw
+# value (the struct unpacked value or the raw bytes). Repeated values (e.g. CMTS
+# addresses, service class names) then decode to the same immutable instance.
+# Disabled by default, see enable_value_cache() and value_cache_stats().
+#
+value_caches={}
+
+class ValueCache(object):
+    # Least recently used entries are evicted beyond maxsize. The entries form a 
+    # circular doubly linked list of [prev,next,key,value] from the oldest to the newest.
+    def __init__(self,maxsize=65536):
+        self.maxsize=maxsize
+        self.entries={}
+        self.root=[]
+        self.root[:]=[self.root,self.root,None,None]
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def get(self,key):
+        # The cached value, None on a miss
+        entry=self.entries.get(key)
+        if entry is None:
+            self.misses+=1
+            return None
+        self.hits+=1
+        # move to the newest end
+        (prev,nxt)=(entry[0],entry[1])
+        prev[1]=nxt
+        nxt[0]=prev
+        root=self.root
+        last=root[0]
+        last[1]=root[0]=entry
+        entry[0]=last
+        entry[1]=root
+        return entry[3]
+
+    def put(self,key,value):
+        root=self.root
+        if len(self.entries) >= self.maxsize:
+            oldest=root[1]
+            if oldest is root:
+                return value
+            root[1]=oldest[1]
+            oldest[1][0]=root
+            del self.entries[oldest[2]]
+            self.evictions+=1
+        last=root[0]
+        entry=[last,root,key,value]
+        last[1]=root[0]=self.entries[key]=entry
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.root[:]=[self.root,self.root,None,None]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        lookups=self.hits+self.misses
+        return {"size":len(self.entries),"maxsize":self.maxsize,"hits":self.hits,"misses":self.misses,
+                "evictions":self.evictions,"hit_ratio":float(self.hits)/lookups if lookups else 0.0}
+
+def cached_by_value(func):
+    # Wraps a from_value(cls,val) classmethod function: when a ValueCache is enabled 
+    # for cls, equal val (hashable) give the same instance.
+    def from_value(cls,val):
+        cache=value_caches.get(cls)
+        if cache is None:
+            return func(cls,val)
+        obj=cache.get(val)
+        if obj is None:
+            obj=cache.put(val,func(cls,val))
+        return obj
+    from_value.__name__=func.__name__
+    # the undecorated function, for caches other than value_caches (see CachedValueType)
+    from_value.uncached=func
+    return from_value
 
 # Most Ipdr datatypes can be represented as long, the few exceptions are string based.
 class IpdrNumericalBaseType(long):
@@ -26,6 +108,21 @@ class IpdrNumericalBaseType(long):
     @classmethod
     def load(cls,filep):
         return cls(struct.unpack(cls.unpack_str,filep.read(cls.packed_size))[0])
+    # Builds an instance from the value struct.unpack yields for unpack_str,
+    # used when several fixed size fields are unpacked with a single struct.
+    @classmethod
+    def from_value(cls,val):
+        return cls(val)
+    # Inverse of from_value: the value struct packs for unpack_str, from an instance
+    # or a plain python value, used when several fields are packed with a single struct.
+    @classmethod
+    def to_value(cls,val):
+        return val
+    # Decodes directly from a str/bytearray/mmap/memoryview at offset, without
+    # copying, returns the decoded value and the offset of the next field.
+    @classmethod
+    def unpack_from(cls,buf,offset=0):
+        return (cls.from_value(struct.unpack_from(cls.unpack_str,buf,offset)[0]),offset+cls.packed_size)
     def pack(self):
         return struct.pack(self.unpack_str, self) 
     def to_xml(self): return str(self)
@@ -48,7 +145,24 @@ class IpdrString(str):
     @classmethod
     def load(cls,filep):
         length=struct.unpack("!L",filep.read(4))[0]
-        return cls(struct.unpack("%ds" % length,filep.read(length))[0])
+        return cls.from_value(struct.unpack("%ds" % length,filep.read(length))[0])
+    # Builds an instance from the raw bytes following the length
+    @classmethod
+    @cached_by_value
+    def from_value(cls,val):
+        return cls(val)
+    @classmethod
+    def unpack_from(cls,buf,offset=0):
+        length=struct.unpack_from("!L",buf,offset)[0]
+        return (cls.from_value(struct.unpack_from("%ds" % length,buf,offset+4)[0]),offset+4+length)
+    # Packs a plain python value (or instance) with its length, without building an instance
+    @classmethod
+    def pack_value(cls,val):
+        if isinstance(val,unicode):
+            val=val.encode("utf-8")
+        else:
+            val=str(val)
+        return struct.pack("!L",len(val))+val
     def pack(self):
         #return struct.pack(self.unpack_str, self.packed_size-4,self) 
         return struct.pack(self.unpack_str, len(self),self) 
@@ -66,6 +180,15 @@ class IpdrBool(IpdrNumericalBaseType):
             elif val.lower() == "false" or val=="0":
                 val=0
         super(IpdrBool,self).__init__(val)
+    @classmethod
+    def to_value(cls,val):
+        if isinstance(val,basestring):
+            if val.lower() in ("true","1"):
+                return True
+            if val.lower() in ("false","0"):
+                return False
+            raise ValueError("not a boolean: %r" % val)
+        return val
     def __str__(self):
         if self == 0:
             return "false"
@@ -136,6 +259,21 @@ class IpdrFloat(float):
     @classmethod
     def load(cls,filep):
         return cls(struct.unpack(cls.unpack_str,filep.read(cls.packed_size))[0])
+    # Builds an instance from the value struct.unpack yields for unpack_str,
+    # used when several fixed size fields are unpacked with a single struct.
+    @classmethod
+    def from_value(cls,val):
+        return cls(val)
+    # Inverse of from_value: the value struct packs for unpack_str, from an instance
+    # or a plain python value, used when several fields are packed with a single struct.
+    @classmethod
+    def to_value(cls,val):
+        return val
+    # Decodes directly from a str/bytearray/mmap/memoryview at offset, without
+    # copying, returns the decoded value and the offset of the next field.
+    @classmethod
+    def unpack_from(cls,buf,offset=0):
+        return (cls.from_value(struct.unpack_from(cls.unpack_str,buf,offset)[0]),offset+cls.packed_size)
     def pack(self):
         return struct.pack(self.unpack_str, self) 
     def to_xml(self): return str(self)
@@ -146,38 +284,144 @@ class IpdrDouble(IpdrFloat):
     packed_size=8
     unpack_str='!d'
 
+#
+# Fast path of the dateTime family conversions: integer arithmetic on the value,
+# with the "YYYY-mm-dd" text of each day cached both ways, and the 
+# "YYYY-mm-dd HH:MM:" text of each minute when formatting.
+# The produced strings are the same as str(datetime) based formatting.
+#
+EPOCH=datetime.datetime(1970,1,1)
+EPOCH_ORDINAL=EPOCH.toordinal()
+DATE_CACHE_SIZE=4096
+_day_to_str={}
+_str_to_day={}
+_minute_to_str={}
+_two_digits=["%02d" % i for i in range(60)]
+_datetime_re=re.compile(r"^(\d{4}-\d{2}-\d{2}) (\d{2}):(\d{2}):(\d{2})$")
+
+def format_day(days):
+    # "YYYY-mm-dd" of the day days after 1970-01-01
+    s=_day_to_str.get(days)
+    if s is None:
+        if not 1 <= days+EPOCH_ORDINAL <= datetime.date.max.toordinal():
+            raise ValueError("year is out of range")
+        d=datetime.date.fromordinal(days+EPOCH_ORDINAL)
+        s="%04d-%02d-%02d" % (d.year,d.month,d.day)
+        if len(_day_to_str) >= DATE_CACHE_SIZE:
+            _day_to_str.clear()
+        _day_to_str[days]=s
+    return s
+
+def format_minute(minutes):
+    # "YYYY-mm-dd HH:MM:" of the minute minutes after 1970-01-01 00:00
+    s=_minute_to_str.get(minutes)
+    if s is None:
+        (days,minute)=divmod(minutes,1440)
+        s="%s %02d:%02d:" % (format_day(days),minute//60,minute%60)
+        if len(_minute_to_str) >= DATE_CACHE_SIZE:
+            _minute_to_str.clear()
+        _minute_to_str[minutes]=s
+    return s
+
+def parse_day(s):
+    # Days after 1970-01-01 of "YYYY-mm-dd", ValueError when not a valid date
+    days=_str_to_day.get(s)
+    if days is None:
+        days=datetime.date(int(s[0:4]),int(s[5:7]),int(s[8:10])).toordinal()-EPOCH_ORDINAL
+        if len(_str_to_day) >= DATE_CACHE_SIZE:
+            _str_to_day.clear()
+        _str_to_day[s]=days
+    return days
+
 class IpdrDateTimeMsec(IpdrNumericalBaseType):
     packed_size=8
     unpack_str='!Q'
     ipdr_type="ipdr:dateTimeMsec"
     type_id=0x00000224
     sec_granularity=1000
+    frac_format=".%03d" # fraction of second as formatted after the seconds
+    numpy_unit="ms"     # of the numpy datetime64 of the same granularity
     def __init__(self,val):
         if isinstance(val,str):
             self=IpdrDateTimeMsec.from_str(val)
         else:
             super(IpdrDateTimeMsec,self).__init__(val)
     def to_datetime(self):
-        d1=datetime.datetime.utcfromtimestamp(self/self.sec_granularity)
-        microsecs=0
-        if self.sec_granularity > 1:
-            microsecs=(self % self.sec_granularity) * (1000000/self.sec_granularity)
-        return datetime.datetime(d1.year,d1.month,d1.day,d1.hour,d1.minute,d1.second,microsecs)
+        (secs,frac)=divmod(long(self),self.sec_granularity)
+        return EPOCH+datetime.timedelta(seconds=secs,microseconds=frac*(1000000//self.sec_granularity))
     @classmethod
     def from_datetime(cls,d1):
-        return cls(int((d1-datetime.datetime(1970,1,1)).total_seconds()*cls.sec_granularity))
+        # Truncated towards zero as int() of the float seconds used to be, but exact
+        delta=d1-EPOCH
+        usecs=((delta.days*86400+delta.seconds)*1000000+delta.microseconds)*cls.sec_granularity
+        if usecs < 0:
+            return cls(-(-usecs//1000000))
+        return cls(usecs//1000000)
+    @classmethod
+    def format_value(cls,val):
+        # Text of the plain value val (as unpacked by struct) for this granularity
+        (secs,frac)=divmod(val,cls.sec_granularity)
+        (minutes,second)=divmod(secs,60)
+        s=format_minute(minutes)+_two_digits[second]
+        if cls.frac_format:
+            return s+cls.frac_format % frac
+        return s
+    @classmethod
+    def format_values(cls,values):
+        # Bulk variant of format_value, e.g. for a column of plain values: vectorised
+        # with numpy (an optional dependency, imported on first use here rather than
+        # with this module) as a datetime64 column, see IpdrXdrColumnar.datetime_strings.
+        # Values outside the years 1 to 9999 are left to format_value, which rejects them.
+        try:
+            import numpy
+        except ImportError:
+            numpy=None
+        if numpy is not None and len(values) > 0:
+            day=86400*cls.sec_granularity
+            try:
+                column=numpy.asarray(values,dtype="int64")
+            except OverflowError:
+                column=None
+            if (column is not None and column.min() >= (1-EPOCH_ORDINAL)*day
+                and column.max() < (datetime.date.max.toordinal()+1-EPOCH_ORDINAL)*day):
+                text=numpy.datetime_as_string(column.view("datetime64[%s]" % cls.numpy_unit),unit=cls.numpy_unit).astype("S")
+                return numpy.char.replace(text,"T"," ").tolist()
+        return [cls.format_value(val) for val in values]
     def __str__(self):
-        s=str(self.to_datetime())
+        return self.format_value(long(self))
+    @classmethod
+    def parse_value(cls,s):
+        # Plain value of the text s, "YYYY-mm-dd HH:MM:SS[.ffffff][Z]"
         dt, _, usec= s.partition(".")
-        if self.sec_granularity==1:
-            return dt
-        elif self.sec_granularity==1000:
-            usec =  "{0:<03s}".format(usec[0:3])
-        elif self.sec_granularity==1000000:
-            usec =  "{0:<06s}".format(usec[0:6])
-        return "%s.%s" % (dt,usec)
+        match=_datetime_re.match(dt)
+        if match is None:
+            return long(cls.from_str_strptime(s))
+        (day,hour,minute,second)=match.groups()
+        (hour,minute,second)=(int(hour),int(minute),int(second))
+        if hour > 23 or minute > 59 or second > 59:
+            return long(cls.from_str_strptime(s))
+        usecs=(parse_day(day)*86400+hour*3600+minute*60+second)*1000000
+        if len(usec) > 0:
+            usecs+=int("{0:<06s}".format(usec.rstrip("Z")),10) # use format to ensure RHS zero-padded
+        if usecs < 0:
+            return -(-usecs*cls.sec_granularity//1000000)
+        return usecs*cls.sec_granularity//1000000
     @classmethod
     def from_str(cls,s):
+        return cls(cls.parse_value(s))
+    @classmethod
+    def to_value(cls,val):
+        # The plain value, an instance of any granularity, text or a datetime.datetime
+        if isinstance(val,(int,long)):
+            if isinstance(val,IpdrDateTimeMsec) and val.sec_granularity != cls.sec_granularity:
+                return long(val)*cls.sec_granularity//val.sec_granularity
+            return val
+        if isinstance(val,basestring):
+            return cls.parse_value(val)
+        return long(cls.from_datetime(val))
+    @classmethod
+    def from_str_strptime(cls,s):
+        # Reference parser, used for the text the fast path does not recognise
         dt, _, usec= s.partition(".")
         dt= datetime.datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
         if len(usec) > 0:
@@ -195,6 +439,8 @@ class IpdrDateTimeUsec(IpdrDateTimeMsec):
     ipdr_type="ipdr:dateTimeUsec"
     type_id=0x00000623
     sec_granularity=1000000
+    frac_format=".%06d"
+    numpy_unit="us"
     
 class IpdrDateTime(IpdrDateTimeMsec):
     packed_size=4
@@ -202,6 +448,8 @@ class IpdrDateTime(IpdrDateTimeMsec):
     ipdr_type="dateTime"
     type_id=0x00000122
     sec_granularity=1
+    frac_format=""
+    numpy_unit="s"
 
 class IpdrIpv4Addr(ipaddress.IPv4Address):
     ipdr_type="ipdr:ipV4Addr"
@@ -219,7 +467,21 @@ class IpdrIpv4Addr(ipaddress.IPv4Address):
         return cls(ipaddress.ip_address(struct.unpack(cls.unpack_str, val[0:cls.packed_size])[0]))
     @classmethod
     def load(cls,filep):
-        return cls(ipaddress.ip_address(struct.unpack(cls.unpack_str, filep.read(cls.packed_size))[0]))
+        return cls.from_value(struct.unpack(cls.unpack_str, filep.read(cls.packed_size))[0])
+    @classmethod
+    @cached_by_value
+    def from_value(cls,val):
+        return cls(val)
+    @classmethod
+    def to_value(cls,val):
+        if isinstance(val,(int,long)):
+            return val
+        if isinstance(val,basestring):
+            val=ipaddress.IPv4Address(unicode(val))
+        return int(val)
+    @classmethod
+    def unpack_from(cls,buf,offset=0):
+        return (cls.from_value(struct.unpack_from(cls.unpack_str,buf,offset)[0]),offset+cls.packed_size)
     def pack(self):
         return self.packed
     def to_xml(self): return str(self)
@@ -240,7 +502,20 @@ class IpdrIpv6Addr(ipaddress.IPv6Address):
         return cls(ipaddress.IPv6Address(struct.unpack(cls.unpack_str, val[0:cls.packed_size])[0]))
     @classmethod
     def load(cls,filep):
-        return cls(ipaddress.IPv6Address(struct.unpack(cls.unpack_str, filep.read(cls.packed_size))[0]))
+        return cls.from_value(struct.unpack(cls.unpack_str, filep.read(cls.packed_size))[0])
+    @classmethod
+    @cached_by_value
+    def from_value(cls,val):
+        return cls(ipaddress.IPv6Address(val))
+    @classmethod
+    def to_value(cls,val):
+        # The 16 raw bytes, from text, an int or an IPv6Address
+        if not isinstance(val,ipaddress.IPv6Address):
+            val=ipaddress.IPv6Address(unicode(val) if isinstance(val,str) else val)
+        return val.packed
+    @classmethod
+    def unpack_from(cls,buf,offset=0):
+        return (cls.from_value(struct.unpack_from(cls.unpack_str,buf,offset)[0]),offset+cls.packed_size)
     def pack(self):
         return struct.pack("4x")+self.packed
     def to_xml(self): return str(self)
@@ -266,6 +541,9 @@ class IpdrIpAddr(object):
         return str(self.__ipaddress)
     def __int__(self):
         return int(self.__ipaddress)
+    @property
+    def version(self):
+        return self.__ipaddress.version
     def __repr__(self):
         return "%s('%s')" % (self.__class__.__name__,str(self.__ipaddress))
     @classmethod
@@ -280,11 +558,26 @@ class IpdrIpAddr(object):
     @classmethod
     def load(cls,filep):
         length=struct.unpack("!L",filep.read(4))[0]
-        if length==4:
-            local_unpack_str='!L'
-        else:
-            local_unpack_str="!%ds" % length
-        return cls(ipaddress.ip_address(struct.unpack(local_unpack_str, filep.read(length))[0]))
+        return cls.from_value(filep.read(length))
+    # Builds an instance from the raw bytes following the length
+    @classmethod
+    @cached_by_value
+    def from_value(cls,val):
+        if len(val)==4:
+            return cls(ipaddress.ip_address(struct.unpack('!L',val)[0]))
+        return cls(ipaddress.ip_address(val))
+    @classmethod
+    def pack_value(cls,val):
+        if isinstance(val,IpdrIpAddr):
+            return val.pack()
+        if not isinstance(val,(ipaddress.IPv4Address,ipaddress.IPv6Address)):
+            val=ipaddress.ip_address(unicode(val) if isinstance(val,str) else val)
+        b=val.packed
+        return struct.pack("!L",len(b))+b
+    @classmethod
+    def unpack_from(cls,buf,offset=0):
+        length=struct.unpack_from("!L",buf,offset)[0]
+        return (cls.from_value(struct.unpack_from("!%ds" % length,buf,offset+4)[0]),offset+4+length)
     def pack(self):
         b=self.__ipaddress.packed
         return struct.pack("!L",len(b)) + b
@@ -295,6 +588,7 @@ class IpdrUuid(uuid.UUID):
     type_id=0x00000527
     packed_size=20
     unpack_str='4x16s'
+    pack_str='!20s' # the length 16 is written, see pack() and to_value()
     def __repr__(self):
         return "%s('%s')" % (self.__class__.__name__,str(self))
     @classmethod
@@ -302,7 +596,19 @@ class IpdrUuid(uuid.UUID):
         return cls(str(uuid.UUID(bytes=struct.unpack(cls.unpack_str, val[0:cls.packed_size])[0])))
     @classmethod
     def load(cls,filep):
-        return cls(str(uuid.UUID(bytes=struct.unpack(cls.unpack_str, filep.read(cls.packed_size))[0])))
+        return cls.from_value(struct.unpack(cls.unpack_str, filep.read(cls.packed_size))[0])
+    @classmethod
+    @cached_by_value
+    def from_value(cls,val):
+        return cls(bytes=val)
+    @classmethod
+    def to_value(cls,val):
+        if not isinstance(val,uuid.UUID):
+            val=uuid.UUID(val)
+        return struct.pack("!L",16)+val.bytes
+    @classmethod
+    def unpack_from(cls,buf,offset=0):
+        return (cls.from_value(struct.unpack_from(cls.unpack_str,buf,offset)[0]),offset+cls.packed_size)
     def pack(self):
         return struct.pack("!L",16)+self.bytes
     def to_xml(self): return str(self)
@@ -327,7 +633,20 @@ class IpdrMacAddr(str):
         return cls("%02X:%02X:%02X:%02X:%02X:%02X" % struct.unpack("xxBBBBBB",val[0:cls.packed_size]))
     @classmethod
     def load(cls,filep):
-        return cls("%02X:%02X:%02X:%02X:%02X:%02X" % struct.unpack("xxBBBBBB",filep.read(cls.packed_size)))
+        return cls.from_value(struct.unpack(cls.unpack_str,filep.read(cls.packed_size))[0])
+    @classmethod
+    @cached_by_value
+    def from_value(cls,val):
+        h="%012X" % (val & 0xffffffffffff)
+        return cls("%s:%s:%s:%s:%s:%s" % (h[0:2],h[2:4],h[4:6],h[6:8],h[8:10],h[10:12]))
+    @classmethod
+    def to_value(cls,val):
+        if isinstance(val,basestring):
+            return long(val.replace(":","").replace("-",""),16)
+        return val
+    @classmethod
+    def unpack_from(cls,buf,offset=0):
+        return (cls.from_value(struct.unpack_from(cls.unpack_str,buf,offset)[0]),offset+cls.packed_size)
     def pack(self):
         return struct.pack("!Q",int(self))
     def to_xml(self): return str(self)
@@ -351,6 +670,18 @@ class IpdrHexBinary(str):
     def load(cls,filep):
         length=struct.unpack("!L",filep.read(4))[0]
         return cls(binascii.hexlify(filep.read(length)))
+    @classmethod
+    def unpack_from(cls,buf,offset=0):
+        length=struct.unpack_from("!L",buf,offset)[0]
+        return (cls(binascii.hexlify(struct.unpack_from("%ds" % length,buf,offset+4)[0])),offset+4+length)
+    @classmethod
+    def pack_value(cls,val):
+        # val is hex text (as instances are) or a bytearray of the raw bytes
+        if isinstance(val,bytearray):
+            in_bytes=str(val)
+        else:
+            in_bytes=binascii.unhexlify(val)
+        return struct.pack("!L",len(in_bytes))+in_bytes
     def pack(self):
         in_bytes=binascii.unhexlify(self)
         length=len(in_bytes)
@@ -382,6 +713,61 @@ ipdr_classes=[
 ]
 ipdr_class_from_type_id={cls.type_id:cls for cls in ipdr_classes}
 
+# Classes whose decoded values can be cached, see ValueCache
+cacheable_classes=[IpdrString,IpdrIpv4Addr,IpdrIpv6Addr,IpdrIpAddr,IpdrUuid,IpdrMacAddr]
+
+def make_value_caches(maxsize=65536,classes=None):
+    # {class: ValueCache} of up to maxsize values for each of classes (default 
+    # cacheable_classes), maxsize may also be a dict class -> size.
+    caches={}
+    for cls in classes or cacheable_classes:
+        if cls not in cacheable_classes:
+            raise ValueError("%s values are not cacheable" % cls.__name__)
+        size=maxsize.get(cls,65536) if isinstance(maxsize,dict) else maxsize
+        caches[cls]=ValueCache(size)
+    return caches
+
+def enable_value_cache(maxsize=65536,classes=None):
+    # Caches values process wide, see make_value_caches. Existing caches are replaced.
+    value_caches.update(make_value_caches(maxsize,classes))
+
+def disable_value_cache(classes=None):
+    for cls in classes or cacheable_classes:
+        value_caches.pop(cls,None)
+
+def value_cache_stats():
+    # {class name: {size,maxsize,hits,misses,evictions,hit_ratio}} of the enabled caches
+    return dict([(cls.__name__,cache.stats()) for (cls,cache) in value_caches.items()])
+
+class CachedValueType(object):
+    # Stands for cls (one of cacheable_classes) when decoding, with its own cache
+    # rather than the process wide value_caches, e.g. owned by a DecoderContext.
+    # ValueCaches are not thread safe: one is only to be used by one thread at a time.
+    def __init__(self,cls,cache):
+        self.cls=cls
+        self.cache=cache
+        self.uncached=cls.from_value.im_func.uncached
+        self.packed_size=cls.packed_size
+        self.unpack_str=cls.unpack_str
+
+    def from_value(self,val):
+        obj=self.cache.get(val)
+        if obj is None:
+            obj=self.cache.put(val,self.uncached(self.cls,val))
+        return obj
+
+    def load(self,filep):
+        if self.packed_size > 0:
+            return self.from_value(struct.unpack(self.unpack_str,filep.read(self.packed_size))[0])
+        length=struct.unpack("!L",filep.read(4))[0]
+        return self.from_value(filep.read(length))
+
+    def unpack_from(self,buf,offset=0):
+        if self.packed_size > 0:
+            return (self.from_value(struct.unpack_from(self.unpack_str,buf,offset)[0]),offset+self.packed_size)
+        length=struct.unpack_from("!L",buf,offset)[0]
+        return (self.from_value(struct.unpack_from("%ds" % length,buf,offset+4)[0]),offset+4+length)
+
 class IpdrArray(list):
     length=0
     def __init__(self,types,length=None,array=[]):
@@ -391,32 +777,81 @@ class IpdrArray(list):
         self.length = IpdrInt(length)
         # tbd map kwargs to cls.
         super(IpdrArray,self).__init__(array)
-    def load(self,filep):
+    def load(self,filep,loader=None):
+        self.extend(self.iter_load(filep,loader))
+        return self 
+    def iter_load(self,filep,loader=None):
+        # The length is consumed immediately, the elements are then decoded 
+        # one at a time by the returned generator instead of being appended to self.
+        # The elements are decoded by loader instead of self.cls when given 
+        # (e.g. a RecordFilter), elements it returns as None are not yielded.
+        # A loader with an accept(obj) method is told of each element kept.
+        # A buffered stream reader (see IpdrXdrStream.StreamReader) decodes them
+        # from its buffer and knows where the stream ends.
         self.length = IpdrInt.load(filep)
+        if hasattr(filep,"iter_unpack"):
+            return filep.iter_unpack(loader or self.cls,self.length)
+        return self._iter_elements(filep,loader or self.cls)
+    def _iter_elements(self,filep,loader):
+        accept=getattr(loader,"accept",None)
         i=1
         while(i<=self.length or self.length < 0):
-            obj=self.cls.load(filep)
-            self.append(obj)
+            obj=loader.load(filep)
+            if accept is not None:
+                accept(obj)
+            if obj is not None:
+                yield obj
             i+=1
             # A semi-standard is to use length==0xffffffff to signify an unlimited array-size
-            # Additionally, RFC1832 can be mis-read to indicate that length value greater than
-            # what is presented should still be digested.
             # For this reason we check for EOF after consuming each element,
-            # if stream is a pipe, this should be modified.
-            if isinstance(filep,StringIO.StringIO):
+            # pipes and sockets are read through an IpdrXdrStream.StreamReader instead.
+            # Readers of a stream of unknown size (e.g. decompressed) tell by themselves.
+            # The end of the data before length elements is a truncation.
+            if hasattr(filep,"at_eof"):
+                eof=filep.at_eof()
+            elif isinstance(filep,StringIO.StringIO):
                 # StringIO has no "fileno" method.
-                if filep.tell() == filep.len:
-                    break
-            elif filep.tell() == os.fstat(filep.fileno()).st_size:
-                    break
-            
-        return self 
+                eof=filep.tell() == filep.len
+            else:
+                eof=filep.tell() == os.fstat(filep.fileno()).st_size
+            if eof:
+                if i<=self.length:
+                    raise TruncatedError, 'truncated stream, %d of %d elements at offset %d' % (i-1,self.length,filep.tell())
+                break
     def pack(self):
         out=self.length.pack() 
         for x in self:
             out+= x.pack()
         return out
         
+    def unpack_from(self,buf,offset=0,loader=None):
+        (self.length,offset) = IpdrInt.unpack_from(buf,offset)
+        for (obj,offset) in self._iter_elements_from(buf,offset,len(buf),loader or self.cls):
+            if obj is not None:
+                self.append(obj)
+        return (self,offset)
+    def iter_unpack_from(self,buf,offset=0,loader=None):
+        # Buffer equivalent of iter_load, the generator yields each element 
+        # together with the offset that follows it. 
+        # The end of the buffer is known up front, so no fstat is needed for EOF.
+        # Elements a loader returns as None are yielded too, to keep their offset.
+        (self.length,offset) = IpdrInt.unpack_from(buf,offset)
+        return self._iter_elements_from(buf,offset,len(buf),loader or self.cls)
+    def _iter_elements_from(self,buf,offset,end,loader):
+        accept=getattr(loader,"accept",None)
+        i=1
+        try:
+            while((i<=self.length or self.length < 0) and offset < end):
+                (obj,offset)=loader.unpack_from(buf,offset)
+                if accept is not None:
+                    accept(obj)
+                yield (obj,offset)
+                i+=1
+        except (struct.error,IndexError,TruncatedError):
+            # The buffer ends within the element (e.g. a truncated file), as for a stream
+            raise TruncatedError, 'truncated stream, element %d at offset %d is incomplete' % (i,offset)
+        if i<=self.length:
+            raise TruncatedError, 'truncated stream, %d of %d elements at offset %d' % (i-1,self.length,offset)
     def __repr__(self):
         return "%s(types=%s,length=%s,array=%s)" % (self.__class__.__name__, self.cls.__name__,self.length, super(IpdrArray,self).__repr__())
         
@@ -424,7 +859,18 @@ class IpdrArray(list):
         return (super(IpdrArray,self).__repr__())
     
     def to_xml(self):
-        return "<array length=\"%s\">%s</array>" % (self.length,"".join([x.to_xml() for x in self]))
+        writer=IpdrXmlWriter()
+        self.write_xml(writer)
+        return writer.getvalue()
+
+    def write_xml(self,writer):
+        writer.start("array",[("length",self.length)])
+        for x in self:
+            if hasattr(x,"write_xml"):
+                x.write_xml(writer)
+            else:
+                writer.characters(x.to_xml())
+        writer.end("array")
 
 class IpdrElementTypeEnum(IpdrInt):
     RECORDDESC = 1
@@ -459,6 +905,12 @@ def test():
     assert(str(IpdrDateTimeMsec(1))=='1970-01-01 00:00:00.001')
     assert(str(IpdrDateTimeUsec(1))=='1970-01-01 00:00:00.000001')
     assert(str(IpdrDateTime(1))=='1970-01-01 00:00:01')
+    assert(IpdrDateTimeUsec(1520388001039123)==IpdrDateTimeUsec.from_str(str(IpdrDateTimeUsec(1520388001039123))))
+    assert(IpdrDateTimeMsec.from_str('2018-03-07 02:00:01.039Z')==IpdrDateTimeMsec.from_str_strptime('2018-03-07 02:00:01.039Z'))
+    assert(IpdrDateTimeMsec.format_values([1,1000])==['1970-01-01 00:00:00.001','1970-01-01 00:00:01.000'])
+    for cls in (IpdrDateTimeMsec,IpdrDateTimeUsec,IpdrDateTime):
+        values=[-1,0,1520388001039123//(1000000//cls.sec_granularity),(EPOCH_ORDINAL-1)*-86400*cls.sec_granularity]
+        assert(cls.format_values(values)==[cls.format_value(val) for val in values])
     # Test IpAddr classes
     assert(int(IpdrIpv4Addr('254.253.252.251'))==4278058235)
     assert(int(IpdrIpAddr('254.253.252.251'))==4278058235)
@@ -472,16 +924,22 @@ def test():
     # IpdrMacAddr classes
     assert(int(IpdrMacAddr('FF:FE:FD:FC:FB:FA'))==281470647991290)
     assert(int(IpdrMacAddr.from_bytes(IpdrMacAddr('FF:FE:FD:FC:FB:FA').pack()))==281470647991290)
+    assert(IpdrMacAddr.from_value(281470647991290)=='FF:FE:FD:FC:FB:FA')
     # hexBinary and String Classes
     assert(str(IpdrHexBinary.from_bytes('\x00\x00\x00\x02\xFF\x00'))=='ff00')
     assert(IpdrHexBinary('6142634465').pack()=='\x00\x00\x00\x05aBcDe')
     assert(IpdrString("12345").pack()=='\x00\x00\x00\x0512345')
+    assert(IpdrString.unpack_from('\xff\x00\x00\x00\x0512345',1)==('12345',10))
+    assert(IpdrHexBinary.unpack_from(memoryview('\x00\x00\x00\x02\xFF\x00'))==('ff00',6))
+    assert(IpdrUuid.unpack_from(IpdrUuid('12345678-1234-5678-1234-567812345678').pack())[1]==20)
+    assert(str(IpdrIpAddr.unpack_from(bytearray(struct.pack("!LL",4,4278058235)))[0])=='254.253.252.251')
     assert(str(IpdrString.from_bytes(IpdrHexBinary('6142634465').pack()))=='aBcDe')
     # Int and UInt
     assert(IpdrInt(-1).pack()=='\xff\xff\xff\xff')
     assert(IpdrUInt(4294967295).pack()=='\xff\xff\xff\xff')
     assert(int(IpdrUInt.from_bytes('\xff\xff\xff\xff'))==4294967295)
     assert(int(IpdrInt.from_bytes('\xff\xff\xff\xff'))==-1)
+    assert(IpdrInt.unpack_from('\x00\xff\xff\xff\xff',1)==(-1,5))
     # Long and ULong
     assert(int(IpdrULong.from_bytes('\xff\xff\xff\xff\xff\xff\xff\xff'))==18446744073709551615)
     assert(int(IpdrLong.from_bytes('\xff\xff\xff\xff\xff\xff\xff\xff'))==-1)
@@ -504,3 +962,16 @@ def test():
     assert(IpdrFloat(1.17549435082e-38).pack()=='\x00\x80\x00\x00')
     assert(str(IpdrDouble(9007199254740992))=='9.00719925474e+15')
     assert(str(IpdrDouble.from_bytes('\xff\x7f\xff\xff\xff\xff\xff\xff'))=='-1.40444776161e+306')
+    # Arrays: the data ending before length elements is a truncation, from a buffer, a file or a stream
+    from IpdrXdrStream import StreamReader
+    packed=IpdrInt(3).pack()+IpdrInt(1).pack()+IpdrInt(2).pack()
+    assert(list(IpdrArray(IpdrInt).iter_load(StreamReader(StringIO.StringIO(IpdrInt(-1).pack()+packed[4:]))))==[1,2])
+    for load in (lambda: IpdrArray(IpdrInt).unpack_from(packed),
+                 lambda: IpdrArray(IpdrInt).load(StringIO.StringIO(packed)),
+                 lambda: IpdrArray(IpdrInt).load(StreamReader(StringIO.StringIO(packed)))):
+        try:
+            load()
+        except TruncatedError, e:
+            assert(str(e)=='truncated stream, 2 of 3 elements at offset 12')
+        else:
+            assert False, 'truncation not detected'
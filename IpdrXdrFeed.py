@@ -0,0 +1,241 @@
+###############################################################################
+# Decoding of live Ipdr-Xdr feeds, as the bytes arrive.
+#
+# A FeedDecoder is pushed the data received (in chunks of any size) and returns
+# the elements completed by each chunk, keeping the incomplete tail for the next
+# one. It needs no blocking read, so it fits any event loop: FeedClient runs it
+# over asyncore, many connections being served by one thread, and pausing a
+# connection stops reading it so that TCP flow control slows its collector down.
+# Several documents may follow each other on one connection.
+#
+# ReplayServer serves files over TCP, optionally in small chunks at a limited
+# rate, to test feed consumers without a real collector.
+###############################################################################
+
+import sys,time,struct,socket,asyncore,SocketServer
+from IpdrXdrDocumentClasses import *
+from IpdrXdrStream import open_input,parse_address,TruncatedError
+
+class FeedDecoder(object):
+    # Yields (see feed) the IPDRHeader of each document then its IPDRStreamElements.
+    # Each document is decoded within its own DecoderContext (see document_context),
+    # lazy, record_filter and context being as for IPDRDoc.iter_load.
+    def __init__(self,lazy=False,record_filter=None,context=None):
+        self.lazy=lazy
+        self.record_filter=record_filter
+        self.context=context
+        self.buf=""
+        self.pos=0       # of the next element in buf
+        self.offset=0    # feed offset of buf[0]
+        self.header=None # of the current document, None between documents
+        self.length=None # IPDRStreamElement count of the current document, -1 when unknown
+        self.count=0     # IPDRStreamElements of the current document decoded so far
+        self.documents=0 # documents ended
+        self.loader=None
+
+    def feed(self,data):
+        # Returns an iterator over the elements data completes, an IPDRHeader starting
+        # each document (elements a record_filter leaves out are not returned).
+        # They are decoded as it is iterated, header, length and count being those of
+        # the document of the last element returned: it is to be consumed before the
+        # next feed().
+        if self.pos:
+            self.offset+=self.pos
+            self.buf=self.buf[self.pos:]+data
+            self.pos=0
+        else:
+            self.buf+=data
+        return self._decode(False)
+
+    def close(self):
+        # End of the feed: iterator over the last elements, raising an XDRError
+        # when data is left over from an incomplete element.
+        for element in self._decode(True):
+            yield element
+        if self.pos < len(self.buf):
+            raise XDRError, 'truncated feed, %d bytes of an incomplete element at offset %d' % (len(self.buf)-self.pos,self.offset+self.pos)
+
+    def _decode(self,final):
+        buf=self.buf
+        while self.pos < len(buf):
+            if self.header is None:
+                if not self._start_document():
+                    break
+                yield self.header
+                continue
+            try:
+                kind=struct.unpack_from("!l",buf,self.pos)[0]
+                (obj,end)=self.loader.unpack_from(buf,self.pos)
+            except (struct.error,TruncatedError):
+                break
+            # A RecordDescriptor ending exactly at the end of the data may have lost
+            # attributes (its array stops at the end of the buffer), it is decoded
+            # again once more data is received.
+            if end > len(buf) or (end == len(buf) and kind == IpdrElementTypeEnum.RECORDDESC and not final):
+                break
+            self.pos=end
+            self.count+=1
+            self.loader.accept(obj)
+            if kind == IpdrElementTypeEnum.DOCEND or (self.length >= 0 and self.count >= self.length):
+                self.header=None
+                self.documents+=1
+            if obj is not None:
+                yield obj
+
+    def _start_document(self):
+        try:
+            (header,offset)=IPDRHeader.unpack_from(self.buf,self.pos)
+            (length,offset)=IpdrInt.unpack_from(self.buf,offset)
+        except (struct.error,TruncatedError):
+            return False
+        context=document_context(self.lazy,self.context)
+        self.loader=context.element_loader(self.record_filter)
+        self.header=header
+        self.length=int(length)
+        self.count=0
+        self.pos=offset
+        return True
+
+def iter_feed(chunks,lazy=False,record_filter=None,context=None):
+    # The elements (see FeedDecoder) of the data in chunks, an iterable of str
+    decoder=FeedDecoder(lazy,record_filter,context)
+    for data in chunks:
+        for element in decoder.feed(data):
+            yield element
+    for element in decoder.close():
+        yield element
+
+class FeedClient(asyncore.dispatcher):
+    # Connection to a collector at address ("tcp://host:port"), the elements received
+    # are passed to handle_element (default handler(client,element)) as they are decoded,
+    # handle_end is called once the connection is closed, self.error being the exception
+    # that ended it, if any.
+    # pause() stops reading the connection (e.g. while the elements cannot be consumed
+    # fast enough), resume() restarts it.
+    # profile: an IpdrXdrProfile.DecodeProfile, possibly shared by several clients
+    def __init__(self,address,handler=None,lazy=False,record_filter=None,block_size=1<<16,map=None,profile=None):
+        asyncore.dispatcher.__init__(self,map=map)
+        self.address=address
+        self.handler=handler
+        self.block_size=block_size
+        self.decoder=FeedDecoder(lazy,record_filter,None if profile is None else DecoderContext(lazy,profile=profile))
+        self.paused=False
+        self.ended=False
+        self.error=None
+        self.received=0
+        self.profile=profile
+        (host,port)=parse_address(address)
+        self.create_socket(socket.AF_INET6 if ":" in host else socket.AF_INET,socket.SOCK_STREAM)
+        self.connect((host,port))
+
+    def pause(self):
+        self.paused=True
+
+    def resume(self):
+        self.paused=False
+
+    def readable(self):
+        return not self.paused
+
+    def writable(self):
+        # only until connected, nothing is sent
+        return not self.connected
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        pass
+
+    def handle_read(self):
+        data=self.recv(self.block_size)
+        if data:
+            self.received+=len(data)
+            if self.profile is not None:
+                self.profile.reads+=1
+                self.profile.bytes_read+=len(data)
+            for element in self.decoder.feed(data):
+                self.handle_element(element)
+
+    def handle_close(self):
+        self.close()
+        if self.ended:
+            return
+        self.ended=True
+        if self.error is None:
+            try:
+                for element in self.decoder.close():
+                    self.handle_element(element)
+            except XDRError as e:
+                self.error=e
+        self.handle_end()
+
+    def handle_error(self):
+        self.error=sys.exc_info()[1]
+        self.handle_close()
+
+    def handle_element(self,element):
+        if self.handler is not None:
+            self.handler(self,element)
+
+    def handle_end(self):
+        pass
+
+def run_feeds(clients,timeout=1.0,map=None):
+    # Serves FeedClients (created with the same map) until all their connections are closed
+    asyncore.loop(timeout,map=map)
+    return clients
+
+class ReplayHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        server=self.server
+        try:
+            for n in range(server.repeat):
+                for path in server.paths:
+                    self.send_file(path)
+        except socket.error:
+            # the client went away
+            pass
+
+    def send_file(self,path):
+        server=self.server
+        (filep,compression)=open_input(path)
+        try:
+            started=time.time()
+            sent=0
+            while True:
+                data=filep.read(server.chunk_size)
+                if not data:
+                    break
+                self.request.sendall(data)
+                sent+=len(data)
+                if server.rate:
+                    delay=started+float(sent)/server.rate-time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+        finally:
+            filep.close()
+
+class ReplayServer(SocketServer.ThreadingMixIn,SocketServer.TCPServer):
+    # Sends the documents of paths (decompressed when compressed), repeat times,
+    # to each client that connects, chunk_size bytes at a time and at most
+    # rate bytes per second when given, then closes the connection.
+    # Usage:
+    #   server=ReplayServer(["example.xdr"])
+    #   threading.Thread(target=server.serve_forever).start()
+    #   ... FeedClient(server.url) ...
+    #   server.shutdown()
+    daemon_threads=True
+    allow_reuse_address=True
+
+    def __init__(self,paths,address=("127.0.0.1",0),chunk_size=1<<16,rate=None,repeat=1):
+        self.paths=list(paths)
+        self.chunk_size=chunk_size
+        self.rate=rate
+        self.repeat=repeat
+        SocketServer.TCPServer.__init__(self,address,ReplayHandler)
+
+    @property
+    def url(self):
+        (host,port)=self.server_address[:2]
+        return "tcp://%s:%d" % ("[%s]" % host if ":" in host else host,port)
@@ -0,0 +1,329 @@
+###############################################################################
+# Record filtering and projection pushed down into the decoder.
+#
+# A RecordFilter selects records by descriptorId, by conditions on attribute
+# values and by a python predicate, and keeps only the requested attributes.
+# Per RecordDescriptor a plan is compiled: unwanted fixed size attributes are
+# skipped as struct pad bytes, unwanted variable length attributes by reading
+# their length prefix only, so no object is built for them.
+###############################################################################
+
+import re,struct,weakref,operator,uuid,ipaddress
+from IpdrXdrDocumentClasses import *
+from IpdrXdrWriter import projected_descriptor
+
+operators={
+    "==" : operator.eq,
+    "="  : operator.eq,
+    "!=" : operator.ne,
+    "<"  : operator.lt,
+    "<=" : operator.le,
+    ">"  : operator.gt,
+    ">=" : operator.ge
+}
+
+condition_re=re.compile(r"^\s*([^<>=!\s]+)\s*(==|!=|<=|>=|<|>|=)\s*(.*?)\s*$")
+
+def parse_condition(text):
+    # "startTime>=2018-03-07 02:00:00" -> ("startTime",">=","2018-03-07 02:00:00")
+    match=condition_re.match(text)
+    if match is None:
+        raise ValueError("bad condition %r, expected <attributeName><op><value> with op one of %s" % (text," ".join(sorted(operators))))
+    return match.groups()
+
+def projection(names,fields):
+    # Indexes in names of the attributeNames in fields, in that order (all of them when fields is None)
+    if fields is None:
+        return range(len(names))
+    return [names.index(name) for name in fields if name in names]
+
+# Types whose struct value compares as their values do: numbers, the dateTime family,
+# addresses (an int for IPv4 and MAC, 16 big endian bytes for IPv6) and UUIDs (16 bytes)
+_raw_types=(IpdrNumericalBaseType,IpdrFloat,IpdrIpv4Addr,IpdrIpv6Addr,IpdrMacAddr,IpdrUuid)
+
+# Types with no meaningful order, only == and != apply to them
+_unordered_types=(IpdrMacAddr,IpdrUuid)
+
+def _ip_key(val):
+    # IPv4 addresses before IPv6 ones, each in numeric order (as ipaddress sorts them)
+    return (val.version,int(val))
+
+def condition_key(cls):
+    # Function turning a decoded attribute of type cls into what condition values
+    # compare with, None when the struct value is compared as it is unpacked
+    if issubclass(cls,_raw_types):
+        return None
+    if issubclass(cls,IpdrIpAddr):
+        return _ip_key
+    return str
+
+def condition_value(cls,value):
+    # Value compared against the attributes of type cls (see condition_key): numbers
+    # and the dateTime family compare by value, addresses in numeric order, other
+    # types as their str(). Text (e.g. from the command line) is parsed according
+    # to cls: integers in base 10 (16 with a 0x prefix), booleans as true/false/1/0.
+    if issubclass(cls,(IpdrIpv4Addr,IpdrIpv6Addr)):
+        return cls.to_value(value)
+    if issubclass(cls,IpdrIpAddr):
+        if isinstance(value,IpdrIpAddr):
+            return _ip_key(value)
+        return _ip_key(ipaddress.ip_address(unicode(value) if isinstance(value,str) else value))
+    if issubclass(cls,IpdrMacAddr):
+        return cls.to_value(value.strip() if isinstance(value,basestring) else value)
+    if issubclass(cls,IpdrUuid):
+        if not isinstance(value,uuid.UUID):
+            value=uuid.UUID(value.strip())
+        return value.bytes
+    if not isinstance(value,basestring):
+        if issubclass(cls,_raw_types):
+            return value
+        return str(value)
+    if issubclass(cls,IpdrDateTimeMsec):
+        return long(cls.from_str(value))
+    if issubclass(cls,IpdrFloat):
+        return float(value)
+    if issubclass(cls,IpdrBool):
+        return cls.to_value(value.strip())
+    if issubclass(cls,IpdrNumericalBaseType):
+        if value.strip().lstrip("+-").lower().startswith("0x"):
+            return long(value,16)
+        return long(value,10)
+    return value
+
+class RecordPlan(object):
+    # Compiled once per RecordDecoder and RecordFilter.
+    # steps are (struct.Struct,indexes) for runs of fixed size attributes, unwanted
+    # ones being pad bytes, or (None,index) for a variable length attribute,
+    # index None when it is only skipped.
+    def __init__(self,decoder,fields,conditions):
+        self.decoder=decoder
+        self.projection=projection(decoder.names,fields)
+        wanted=set(self.projection)
+        self.record_class=record_class([decoder.names[i] for i in self.projection])
+        self.conditions=[]
+        for (name,op,value) in conditions:
+            if name not in decoder.names:
+                # the condition can never hold for this RecordDescriptor
+                self.conditions=None
+                break
+            i=decoder.names.index(name)
+            cls=decoder.classes[i]
+            if issubclass(cls,_unordered_types) and op not in ("==","=","!="):
+                raise ValueError("%s %s has no order, only == and != apply to it" % (cls.__name__,name))
+            wanted.add(i)
+            self.conditions.append((i,condition_key(cls),operators[op],condition_value(cls,value)))
+        self.steps=[]
+        fmt=""
+        indexes=[]
+        for (i,cls) in enumerate(decoder.classes):
+            if cls.packed_size > 0:
+                if i in wanted:
+                    fmt+=cls.unpack_str.lstrip("!")
+                    indexes.append(i)
+                else:
+                    fmt+="%dx" % cls.packed_size
+                continue
+            if fmt:
+                self.steps.append((struct.Struct("!"+fmt),indexes))
+                fmt=""
+                indexes=[]
+            self.steps.append((None,i if i in wanted else None))
+        if fmt:
+            self.steps.append((struct.Struct("!"+fmt),indexes))
+
+    def _row(self,raw):
+        # raw maps attribute index to the struct value (fixed size) or Ipdr* object (variable length)
+        for (i,key,op,value) in self.conditions:
+            val=raw[i]
+            if key is not None:
+                val=key(val)
+            if not op(val,value):
+                return None
+        values=[]
+        for i in self.projection:
+            cls=self.decoder.types[i]
+            if cls.packed_size > 0:
+                values.append(cls.from_value(raw[i]))
+            else:
+                values.append(raw[i])
+        return self.record_class(values)
+
+    def load(self,filep):
+        # Returns the projected IPDRRecordRow, or None when the conditions do not hold
+        raw={}
+        for (packer,indexes) in self.steps:
+            if packer is not None:
+                raw.update(zip(indexes,packer.unpack(filep.read(packer.size))))
+            elif indexes is not None:
+                raw[indexes]=self.decoder.types[indexes].load(filep)
+            else:
+                filep.read(struct.unpack("!L",filep.read(4))[0])
+        if self.conditions is None:
+            return None
+        return self._row(raw)
+
+    def unpack_from(self,buf,offset=0):
+        raw={}
+        for (packer,indexes) in self.steps:
+            if packer is not None:
+                raw.update(zip(indexes,packer.unpack_from(buf,offset)))
+                offset+=packer.size
+            elif indexes is not None:
+                (raw[indexes],offset)=self.decoder.types[indexes].unpack_from(buf,offset)
+            else:
+                offset+=4+struct.unpack_from("!L",buf,offset)[0]
+        if self.conditions is None:
+            return (None,offset)
+        return (self._row(raw),offset)
+
+class RecordFilter(object):
+    # descriptorIds: only the records (and RecordDescriptors) of these descriptorIds
+    # fields: attributeNames kept in each record, in this order (default all)
+    # conditions: (attributeName,op,value) all of which must hold, op one of operators,
+    #     value a python value or text parsed for the attribute type, e.g.
+    #     [("startTime",">=","2018-03-07 02:00:00"),("startTime","<","2018-03-07 03:00:00")]
+    # predicate: called with each selected (projected) IPDRRecord, kept when true
+    # The RecordDescriptors are returned projected like the records.
+    # Used as the element class of the IPDRStreamElement array, see IPDRDoc.iter_load:
+    # load() and unpack_from() return None for the elements filtered out.
+    def __init__(self,descriptorIds=None,fields=None,conditions=(),predicate=None):
+        self.descriptorIds=None if descriptorIds is None else set([int(x) for x in descriptorIds])
+        self.fields=None if fields is None else list(fields)
+        self.conditions=[parse_condition(c) if isinstance(c,basestring) else tuple(c) for c in conditions]
+        for (name,op,value) in self.conditions:
+            if op not in operators:
+                raise ValueError("unknown operator %r" % op)
+        self.predicate=predicate
+        self.plans=weakref.WeakKeyDictionary()
+
+    def __getstate__(self):
+        # plans are rebuilt on demand, e.g. in a pool worker
+        state=dict(self.__dict__)
+        del state["plans"]
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.plans=weakref.WeakKeyDictionary()
+
+    def plan(self,decoder):
+        plan=self.plans.get(decoder)
+        if plan is None:
+            plan=self.plans[decoder]=RecordPlan(decoder,self.fields,self.conditions)
+        return plan
+
+    def wants(self,descriptorId):
+        return self.descriptorIds is None or descriptorId in self.descriptorIds
+
+    def projection(self,names):
+        # Indexes of the attributes kept in the records of a RecordDescriptor of attributeNames names
+        return projection(names,self.fields)
+
+    def _descriptor(self,element):
+        # The RECORDDESC element with its RecordDescriptor projected as the records are,
+        # the DecoderContext keeps the original one to decode them
+        if self.fields is not None:
+            desc=element.desc
+            element.desc=projected_descriptor(desc,self.projection([str(a.attributeName) for a in desc.attributes]))
+        return element
+
+    def _record(self,descriptorId,data):
+        if data is None:
+            return None
+        rec=IPDRRecord(descriptorId=IpdrInt(descriptorId),data=data)
+        if self.predicate is not None and not self.predicate(rec):
+            return None
+        return IPDRStreamElement(kind=IpdrElementTypeEnum(IpdrElementTypeEnum.IPDRREC),rec=rec)
+
+    # context: the DecoderContext of the document (see DecoderContext.element_loader),
+    # default_context when None
+    def load(self,filep,context=None):
+        if context is None:
+            context=default_context
+        kind=IpdrElementTypeEnum.load(filep)
+        if kind != IpdrElementTypeEnum.IPDRREC:
+            element=IPDRStreamElement()
+            element.kind=kind
+            if kind == IpdrElementTypeEnum.RECORDDESC:
+                element.desc=RecordDescriptor.load(filep)
+                context.add_descriptor(element.desc)
+                if not self.wants(int(element.desc.descriptorId)):
+                    return None
+                return self._descriptor(element)
+            elif kind == IpdrElementTypeEnum.DOCEND:
+                element.docEnd=IPDRDocEnd.load(filep)
+            else:
+                raise XDRError, 'bad switch=%s' % kind
+            return element
+        descriptorId=int(IpdrInt.load(filep))
+        decoder=context.decoder(descriptorId)
+        if not self.wants(descriptorId):
+            decoder.read_raw(filep)
+            return None
+        return self._record(descriptorId,self.plan(decoder).load(filep))
+
+    def unpack_from(self,buf,offset=0,context=None):
+        if context is None:
+            context=default_context
+        kind=struct.unpack_from("!l",buf,offset)[0]
+        if kind != IpdrElementTypeEnum.IPDRREC:
+            (element,offset)=IPDRStreamElement.unpack_from(buf,offset,context)
+            if kind == IpdrElementTypeEnum.RECORDDESC:
+                if not self.wants(int(element.desc.descriptorId)):
+                    return (None,offset)
+                return (self._descriptor(element),offset)
+            return (element,offset)
+        descriptorId=struct.unpack_from("!l",buf,offset+4)[0]
+        decoder=context.decoder(descriptorId)
+        if not self.wants(descriptorId):
+            return (None,decoder.skip_from(buf,offset+8))
+        (data,offset)=self.plan(decoder).unpack_from(buf,offset+8)
+        return (self._record(descriptorId,data),offset)
+
+#
+# Command line options shared by the conversion scripts
+#
+def add_filter_arguments(parser):
+    parser.add_argument("-d","--descriptor",type=int,action="append",default=None,dest="descriptorIds",help="only records of this descriptorId (repeatable)")
+    parser.add_argument("-F","--fields",default=None,help="comma separated attributeNames kept in each record")
+    parser.add_argument("-w","--where",action="append",default=[],help="condition on an attribute, e.g. \"startTime>=2018-03-07 02:00:00\" (repeatable, all must hold)")
+
+def record_filter_from_args(args):
+    # None when no filtering option is given
+    fields=None
+    if args.fields:
+        fields=[name.strip() for name in args.fields.split(",") if name.strip()]
+    if args.descriptorIds is None and fields is None and not args.where:
+        return None
+    return RecordFilter(args.descriptorIds,fields,args.where)
+
+def test():
+    # Conditions on example.xdr: addresses compare in numeric order, MAC and UUID only for equality
+    import os
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),"example.xdr"),"rb") as filep:
+        raw=filep.read()
+    def count(*conditions):
+        record_filter=RecordFilter([2],conditions=conditions)
+        return len([e for e in IPDRDoc.iter_elements_from(raw,record_filter=record_filter) if e.kind == IpdrElementTypeEnum.IPDRREC])
+    assert(count("Test_Ipv4Addr>10.0.0.10")==1)
+    assert(count("Test_Ipv4Addr<254.253.252.99")==0)
+    assert(count("Test_Ipv4Addr==254.253.252.251","Test_Ipv4Addr>=254.253.252.251")==1)
+    assert(count("Test_Ipv6Addr>ff:fe:fd:fc:fb:fa:0:0","Test_Ipv6Addr<ff:fe:fd:fc:fb:fa:0:2")==1)
+    assert(count("Test_Ipv6Addr<9::")==0)
+    assert(count("Test_IpAddr_1>1.2.3.10")==0)
+    assert(count("Test_IpAddr_1<1.2.3.10","Test_IpAddr_2>1.2.3.10","Test_IpAddr_2<ff::")==0)
+    assert(count("Test_IpAddr_1<1.2.3.10","Test_IpAddr_2>1.2.3.10")==1)
+    assert(count("Test_MacAddr==ff:fe:fd:fc:fb:fa","Test_Uuid=12345678-1234-5678-1234-567812345678")==1)
+    assert(count("Test_MacAddr!=FF:FE:FD:FC:FB:FA")==0)
+    # the RecordDescriptors are projected as the records
+    record_filter=RecordFilter(fields=["Test_Int","Test_String"])
+    elements=list(IPDRDoc.iter_elements_from(raw,record_filter=record_filter))
+    assert([[str(a.attributeName) for a in e.desc.attributes] for e in elements if e.kind == IpdrElementTypeEnum.RECORDDESC]==[["Test_Int"],["Test_String"]])
+    assert([e.rec.data.items() for e in elements if e.kind == IpdrElementTypeEnum.IPDRREC]==[[("Test_Int",-1)],[("Test_String","Test_String")]])
+    for condition in ("Test_MacAddr>00:00:00:00:00:00","Test_Uuid<=12345678-1234-5678-1234-567812345678"):
+        try:
+            count(condition)
+        except ValueError:
+            pass
+        else:
+            assert False, condition
@@ -0,0 +1,395 @@
+###############################################################################
+# Persistent record offset index of an Ipdr-Xdr file, kept in a sidecar file
+# (<xdr_file>.idx) so that records can be reached by ordinal, descriptorId or
+# key timestamp without decoding the file from the start.
+# The key is the value of a chosen dateTime attribute, the minimum and maximum key
+# of each block of block_records records are kept too, so that a time range
+# query only scans the blocks that overlap it.
+#
+# The index is built in one pass over the element boundaries (see
+# iter_element_spans) and is reused as long as the size and mtime of the
+# Ipdr-Xdr file recorded in it are unchanged. The sidecar is read through
+# an mmap, nothing proportional to the number of records is loaded.
+#
+# Sidecar layout, big endian:
+#     header        index_header (see below)
+#     key_field     key_length bytes, the key attribute(s) (see key_fields) or empty
+#     records       record_count entries of record_entry: offset of the
+#                   IPDRStreamElement, descriptorId, key in microseconds
+#                   (no_key when the record has no such dateTime attribute)
+#     descriptors   descriptor_count entries of descriptor_entry: descriptorId,
+#                   offset of the RecordDescriptor, in file order
+#     blocks        block_count entries of block_entry: minimum and maximum key
+#                   of block_records consecutive records (no_key when none has a key)
+###############################################################################
+
+import os,mmap,struct,datetime
+from IpdrXdrDocumentClasses import *
+from IpdrXdrBatch import expand_inputs
+
+index_magic="IPDRXIDX"
+index_version=2
+# magic, version, xdr size, xdr mtime, offset of the IPDRStreamElement array length,
+# offset of the DOCEND element (-1 when none), record count, descriptor count, key length,
+# records per block, block count
+index_header=struct.Struct("!8sLQdQqQLLLL")
+record_entry=struct.Struct("!Qlq")
+descriptor_entry=struct.Struct("!lQ")
+block_entry=struct.Struct("!qq")
+no_key=-2**63
+default_block_records=1024
+# record entries unpacked at once when scanning
+scan_entries=4096
+
+def index_path(xdr_file):
+    return "%s.idx" % xdr_file
+
+def to_usec(value):
+    # Key timestamps are compared in microseconds since the epoch, value may
+    # be an Ipdr dateTime (any granularity), a datetime, a "YYYY-mm-dd HH:MM:SS[.ffffff]"
+    # string or a number of microseconds.
+    if isinstance(value,IpdrDateTimeMsec):
+        return long(value)*(1000000//value.sec_granularity)
+    if isinstance(value,datetime.datetime):
+        return long(IpdrDateTimeUsec.from_datetime(value))
+    if isinstance(value,basestring):
+        return long(IpdrDateTimeUsec.from_str(value))
+    return long(value)
+
+def key_fields(key_field):
+    # key_field is the name of the key attribute of all RecordDescriptors, or a
+    # different one per descriptorId "1:startTime,3:eventTime" (optionally with a
+    # default for the other descriptorIds "startTime,3:eventTime").
+    # Returns (default name or None,{descriptorId:name}).
+    default=None
+    names={}
+    for part in (key_field or "").split(","):
+        part=part.strip()
+        if not part:
+            continue
+        (descriptorId,sep,name)=part.rpartition(":")
+        if sep:
+            names[int(descriptorId)]=name
+        else:
+            default=name
+    return (default,names)
+
+def key_reader(decoder,key_field):
+    # (attribute index,struct format,microseconds per unit) of the key attribute in
+    # the records of decoder, None when they have no such dateTime attribute.
+    (default,names)=key_fields(key_field)
+    name=names.get(int(decoder.descriptor.descriptorId),default)
+    if name is None or name not in decoder.names:
+        return None
+    i=decoder.names.index(name)
+    cls=decoder.classes[i]
+    if not issubclass(cls,IpdrDateTimeMsec):
+        return None
+    return (i,cls.unpack_str,1000000//cls.sec_granularity)
+
+def read_key(decoder,reader,buf,start):
+    # Key in microseconds of the IPDRREC element packed at start of buf,
+    # reader being the key_reader() of decoder
+    (i,fmt,scale)=reader
+    if decoder.fixed_offsets is not None:
+        offset=start+8+decoder.fixed_offsets[i]
+    else:
+        offset=decoder.field_offsets(buf,start+8)[i]
+    return struct.unpack_from(fmt,buf,offset)[0]*scale
+
+def build_index(xdr_file,index_file=None,key_field=None,block_records=default_block_records):
+    # Writes the sidecar of xdr_file (under a temporary name, then renamed),
+    # key_field is the dateTime attribute whose value is kept per record (see key_fields).
+    if index_file is None:
+        index_file=index_path(xdr_file)
+    tmp_file="%s.tmp%d" % (index_file,os.getpid())
+    key=key_field or ""
+    with open(xdr_file,"rb") as filep:
+        stat=os.fstat(filep.fileno())
+        buf=mmap.mmap(filep.fileno(),0,access=mmap.ACCESS_READ)
+        try:
+            header_end=IPDRHeader.unpack_from(buf)[1]
+            descriptors=[]
+            docend=-1
+            count=0
+            keys={}
+            blocks=[]
+            (block_min,block_max)=(no_key,no_key)
+            try:
+                with open(tmp_file,"wb") as outp:
+                    outp.write("\0"*index_header.size+key)
+                    entries=[]
+                    for (kind,start,end,item) in iter_element_spans(buf,header_end):
+                        if kind == IpdrElementTypeEnum.IPDRREC:
+                            reader=keys.get(item,False)
+                            if reader is False:
+                                reader=keys[item]=key_reader(item,key_field)
+                            value=no_key
+                            if reader is not None:
+                                value=read_key(item,reader,buf,start)
+                                if block_min == no_key or value < block_min:
+                                    block_min=value
+                                if block_max == no_key or value > block_max:
+                                    block_max=value
+                            entries.append(record_entry.pack(start,int(item.descriptor.descriptorId),value))
+                            if len(entries) >= scan_entries:
+                                outp.write("".join(entries))
+                                entries=[]
+                            count+=1
+                            if count % block_records == 0:
+                                blocks.append(block_entry.pack(block_min,block_max))
+                                (block_min,block_max)=(no_key,no_key)
+                        elif kind == IpdrElementTypeEnum.RECORDDESC:
+                            descriptors.append(descriptor_entry.pack(int(item.descriptorId),start+4))
+                        elif kind == IpdrElementTypeEnum.DOCEND:
+                            docend=start
+                    if count % block_records:
+                        blocks.append(block_entry.pack(block_min,block_max))
+                    outp.write("".join(entries))
+                    outp.write("".join(descriptors))
+                    outp.write("".join(blocks))
+                    outp.seek(0)
+                    outp.write(index_header.pack(index_magic,index_version,stat.st_size,stat.st_mtime,header_end,docend,count,len(descriptors),len(key),block_records,len(blocks)))
+                os.rename(tmp_file,index_file)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+        finally:
+            buf.close()
+    return index_file
+
+def read_index_header(index_file):
+    # The index_header fields as a dict, None when index_file is not a readable index
+    try:
+        with open(index_file,"rb") as filep:
+            data=filep.read(index_header.size)
+            if len(data) < index_header.size:
+                return None
+            (magic,version,size,mtime,header_end,docend,count,descriptors,key_length,block_records,blocks)=index_header.unpack(data)
+            if magic != index_magic or version != index_version:
+                return None
+            key_field=filep.read(key_length) or None
+    except IOError:
+        return None
+    return {"size":size,"mtime":mtime,"header_end":header_end,"docend":docend,
+            "record_count":count,"descriptor_count":descriptors,"key_field":key_field,
+            "block_records":block_records,"block_count":blocks}
+
+def is_index_current(xdr_file,index_file=None,key_field=None):
+    # An index is reused when it was built for the same size and mtime, 
+    # and for key_field unless it is None.
+    info=read_index_header(index_file or index_path(xdr_file))
+    if info is None:
+        return False
+    stat=os.stat(xdr_file)
+    if key_field is not None and info["key_field"] != key_field:
+        return False
+    return info["size"] == stat.st_size and info["mtime"] == stat.st_mtime
+
+class IpdrIndex(object):
+    # Random access to the records of an indexed Ipdr-Xdr file.
+    # Records are decoded with the RecordDescriptor in force at their offset,
+    # as IPDRRecord (eager, or lazy rows with lazy=True).
+    def __init__(self,xdr_file,index_file=None,key_field=None,rebuild=False,block_records=default_block_records):
+        self.xdr_file=xdr_file
+        self.index_file=index_file or index_path(xdr_file)
+        if rebuild or not is_index_current(xdr_file,self.index_file,key_field):
+            build_index(xdr_file,self.index_file,key_field,block_records)
+        info=read_index_header(self.index_file)
+        self.header_end=info["header_end"]
+        self.docend=info["docend"]
+        self.record_count=info["record_count"]
+        self.key_field=info["key_field"]
+        self.records_start=index_header.size+len(self.key_field or "")
+        self.descriptors_start=self.records_start+self.record_count*record_entry.size
+        self.block_records=info["block_records"]
+        self.block_count=info["block_count"]
+        self.blocks_start=self.descriptors_start+info["descriptor_count"]*descriptor_entry.size
+        with open(self.index_file,"rb") as filep:
+            self.idx=mmap.mmap(filep.fileno(),0,access=mmap.ACCESS_READ)
+        with open(self.xdr_file,"rb") as filep:
+            self.buf=mmap.mmap(filep.fileno(),0,access=mmap.ACCESS_READ)
+        # descriptorId -> [(offset,RecordDescriptor)] in file order, decoders built on demand
+        self.descriptors={}
+        for i in range(info["descriptor_count"]):
+            (descriptorId,offset)=descriptor_entry.unpack_from(self.idx,self.descriptors_start+i*descriptor_entry.size)
+            self.descriptors.setdefault(descriptorId,[]).append([offset,None])
+
+    def close(self):
+        self.idx.close()
+        self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def __len__(self):
+        return self.record_count
+
+    def header(self):
+        return IPDRHeader.unpack_from(self.buf)[0]
+
+    def doc_end(self):
+        if self.docend < 0:
+            return None
+        return IPDRDocEnd.unpack_from(self.buf,self.docend+4)[0]
+
+    def record_descriptors(self):
+        # [(descriptorId,RecordDescriptor)] in file order
+        out=[]
+        for (descriptorId,offsets) in self.descriptors.items():
+            for (offset,decoder) in offsets:
+                out.append((offset,descriptorId,RecordDescriptor.unpack_from(self.buf,offset)[0]))
+        return [(descriptorId,desc) for (offset,descriptorId,desc) in sorted(out)]
+
+    def entry(self,i):
+        # (offset,descriptorId,key in microseconds or None) of the i-th record
+        if i < 0:
+            i+=self.record_count
+        if i < 0 or i >= self.record_count:
+            raise IndexError("record index out of range")
+        (offset,descriptorId,key)=record_entry.unpack_from(self.idx,self.records_start+i*record_entry.size)
+        return (offset,descriptorId,None if key == no_key else key)
+
+    def iter_entries(self,first=0,last=None):
+        # Yields (ordinal,offset,descriptorId,key) of the records first..last-1
+        if last is None or last > self.record_count:
+            last=self.record_count
+        i=first
+        while i < last:
+            n=min(scan_entries,last-i)
+            values=struct.unpack_from("!"+"Qlq"*n,self.idx,self.records_start+i*record_entry.size)
+            for j in range(n):
+                (offset,descriptorId,key)=values[3*j:3*j+3]
+                yield (i+j,offset,descriptorId,None if key == no_key else key)
+            i+=n
+
+    def decoder(self,descriptorId,offset):
+        # RecordDecoder of the last RecordDescriptor of descriptorId before offset
+        found=None
+        for entry in self.descriptors.get(descriptorId,()):
+            if entry[0] > offset:
+                break
+            found=entry
+        if found is None:
+            raise XDRError, 'value=%d not a previously streamed RecordDescriptor Id' % descriptorId
+        if found[1] is None:
+            found[1]=RecordDecoder(RecordDescriptor.unpack_from(self.buf,found[0])[0])
+        return found[1]
+
+    def record_at(self,offset,descriptorId,lazy=False):
+        decoder=self.decoder(descriptorId,offset)
+        rec=IPDRRecord(descriptorId=IpdrInt(descriptorId))
+        if lazy:
+            rec.data=lazy_record_class(decoder)(self.buf[offset+8:decoder.skip_from(self.buf,offset+8)])
+        else:
+            rec.data=decoder.record_class(decoder.unpack_from(self.buf,offset+8)[0])
+        return rec
+
+    def record(self,i,lazy=False):
+        # The i-th IPDRRecord of the file (ordinal among the records only)
+        (offset,descriptorId,key)=self.entry(i)
+        return self.record_at(offset,descriptorId,lazy)
+
+    def __getitem__(self,i):
+        return self.record(i)
+
+    def block_range(self,b):
+        # (minimum,maximum) key of the b-th block, None when none of its records has a key
+        (low,high)=block_entry.unpack_from(self.idx,self.blocks_start+b*block_entry.size)
+        if low == no_key:
+            return None
+        return (low,high)
+
+    def iter_blocks(self,start=None,end=None):
+        # Yields (first,last) ordinals of the blocks whose key range overlaps [start,end)
+        for b in range(self.block_count):
+            keys=self.block_range(b)
+            if keys is None or (start is not None and keys[1] < start) or (end is not None and keys[0] >= end):
+                continue
+            yield (b*self.block_records,(b+1)*self.block_records)
+
+    def select(self,descriptorId=None,start=None,end=None):
+        # Yields (ordinal,offset,descriptorId,key) of the records of descriptorId (any when None)
+        # whose key is within [start,end) (see to_usec), records without key never match a time range.
+        # With a time range only the blocks overlapping it are scanned.
+        if start is not None:
+            start=to_usec(start)
+        if end is not None:
+            end=to_usec(end)
+        if start is None and end is None:
+            spans=[(0,None)]
+        else:
+            spans=self.iter_blocks(start,end)
+        for (first,last) in spans:
+            for entry in self.iter_entries(first,last):
+                if descriptorId is not None and entry[2] != descriptorId:
+                    continue
+                if start is not None or end is not None:
+                    key=entry[3]
+                    if key is None or (start is not None and key < start) or (end is not None and key >= end):
+                        continue
+                yield entry
+
+    def ordinals(self,descriptorId=None,start=None,end=None):
+        return [entry[0] for entry in self.select(descriptorId,start,end)]
+
+    def records(self,descriptorId=None,start=None,end=None,lazy=False):
+        # Yields the selected IPDRRecords, see select()
+        for (i,offset,recordDescriptorId,key) in self.select(descriptorId,start,end):
+            yield self.record_at(offset,recordDescriptorId,lazy)
+
+def open_index(xdr_file,key_field=None,rebuild=False):
+    return IpdrIndex(xdr_file,key_field=key_field,rebuild=rebuild)
+
+#
+# File level pruning from IPDRHeader.startTime and IPDRDocEnd.endTime
+#
+docend_size=4+IPDRDocEnd.unpack_from("\0"*12)[1]
+
+def file_time_range(xdr_file):
+    # (startTime,endTime) of the document in microseconds, read from the IPDRHeader
+    # and from the DOCEND element expected at the end of the file. endTime is None
+    # when there is no DOCEND or its endTime is before startTime.
+    with open(xdr_file,"rb") as filep:
+        buf=mmap.mmap(filep.fileno(),0,access=mmap.ACCESS_READ)
+        try:
+            header=IPDRHeader.unpack_from(buf)[0]
+            start=to_usec(header.startTime)
+            end=None
+            if len(buf) >= docend_size:
+                kind=struct.unpack_from("!l",buf,len(buf)-docend_size)[0]
+                if kind == IpdrElementTypeEnum.DOCEND:
+                    end=to_usec(IPDRDocEnd.unpack_from(buf,len(buf)-docend_size+4)[0].endTime)
+                    if end < start:
+                        end=None
+        finally:
+            buf.close()
+    return (start,end)
+
+def file_may_overlap(xdr_file,start=None,end=None):
+    # False when the document times show it holds no record in [start,end)
+    (file_start,file_end)=file_time_range(xdr_file)
+    if end is not None and file_start >= to_usec(end):
+        return False
+    if start is not None and file_end is not None and file_end < to_usec(start):
+        return False
+    return True
+
+def iter_window(inputs,start=None,end=None,key_field=None,descriptorId=None,pattern="*.xdr",prune=True,lazy=False):
+    # Yields (xdr_file,IPDRRecord) for the records of descriptorId (any when None) whose key
+    # is within [start,end) in the files, directories or glob patterns of inputs.
+    # Files are first pruned on their header and DOCEND times (unless prune=False),
+    # the others are indexed (or their index reused) and only overlapping blocks are scanned.
+    if start is not None:
+        start=to_usec(start)
+    if end is not None:
+        end=to_usec(end)
+    for xdr_file in expand_inputs(inputs,pattern):
+        if prune and not file_may_overlap(xdr_file,start,end):
+            continue
+        with IpdrIndex(xdr_file,key_field=key_field) as index:
+            for rec in index.records(descriptorId,start,end,lazy):
+                yield (xdr_file,rec)
@@ -0,0 +1,156 @@
+###############################################################################
+# Merging of many Ipdr-Xdr files into one document.
+#
+# RecordDescriptors are deduplicated across the inputs: identical ones (same
+# typeName and attributes) share one descriptorId in the output, one whose
+# descriptorId is already taken by another layout gets a new one. Records are
+# copied as packed, only their 4 byte descriptorId is patched when remapped.
+# The inputs are concatenated, or merged on the value of a dateTime attribute
+# (each input being in that order) with a k-way merge.
+###############################################################################
+
+import copy,uuid,struct,heapq,contextlib
+from IpdrXdrWriter import *
+from IpdrXdrConvert import open_source
+from IpdrXdrBatch import expand_inputs
+from IpdrXdrIndex import key_reader,read_key,no_key
+
+def descriptor_layout(desc):
+    # What makes two RecordDescriptors identical, whatever their descriptorId
+    return (str(desc.typeName),tuple([(str(a.attributeName),int(a.typeId)) for a in desc.attributes]))
+
+class DescriptorTable(object):
+    # Output descriptorIds of the RecordDescriptors of all inputs, each layout
+    # is streamed to the writer once, the first time it is met.
+    def __init__(self,writer):
+        self.writer=writer
+        self.ids={}       # layout -> output descriptorId
+        self.used=set()
+        self.remapped=[]  # (input descriptorId,output descriptorId,typeName)
+
+    def map(self,desc):
+        layout=descriptor_layout(desc)
+        out_id=self.ids.get(layout)
+        if out_id is None:
+            out_id=int(desc.descriptorId)
+            if out_id in self.used:
+                out_id=max(self.used)+1
+                self.remapped.append((int(desc.descriptorId),out_id,layout[0]))
+                desc=copy.copy(desc)
+                desc.descriptorId=IpdrInt(out_id)
+            self.ids[layout]=out_id
+            self.used.add(out_id)
+            self.writer.add_descriptor(desc)
+        return out_id
+
+class MergeInput(object):
+    # The records of one input with their output descriptorId
+    def __init__(self,elements,table,key_field=None):
+        self.elements=elements
+        self.table=table
+        self.key_field=key_field
+        self.endTime=None
+        self.keys={}
+
+    def __iter__(self):
+        # Yields (key,descriptorId,packed), key in microseconds (the one of the record
+        # before for records without the key attribute) or None without key_field
+        ids={}
+        key=no_key if self.key_field is not None else None
+        for (kind,item,packed) in self.elements:
+            if kind == IpdrElementTypeEnum.IPDRREC:
+                in_id=int(item.descriptor.descriptorId)
+                out_id=ids[in_id]
+                if out_id != in_id:
+                    packed=packed[:4]+struct.pack("!l",out_id)+packed[8:]
+                if self.key_field is not None:
+                    reader=self.keys.get(item,False)
+                    if reader is False:
+                        reader=self.keys[item]=key_reader(item,self.key_field)
+                    if reader is not None:
+                        key=read_key(item,reader,packed,0)
+                yield (key,out_id,packed)
+            elif kind == IpdrElementTypeEnum.RECORDDESC:
+                ids[int(item.descriptorId)]=self.table.map(item)
+            elif kind == IpdrElementTypeEnum.DOCEND:
+                self.endTime=long(item.endTime)
+
+def merge_files(inputs,output,key_field=None,pattern="*.xdr",header=None,buffer_bytes=1<<20):
+    # Merges the files, directories or glob patterns of inputs (see IpdrXdrBatch.expand_inputs,
+    # files may be compressed) into the file output.
+    # Without key_field the inputs are concatenated in order, with key_field (a dateTime
+    # attribute, see IpdrXdrIndex.key_fields) their records are merged in key order,
+    # all inputs being open at once.
+    # The output IPDRHeader is header, by default the one of the first input with a new
+    # docId, its IPDRDocEnd endTime the latest of the inputs.
+    # Returns {"inputs","records","descriptors","remapped"}, remapped listing the
+    # (input descriptorId,output descriptorId,typeName) given a new descriptorId.
+    paths=expand_inputs(inputs,pattern)
+    if not paths:
+        raise ValueError("no input to merge")
+    with open(output,"wb") as outp:
+        with contextlib.closing(_Sources(paths,key_field is not None)) as sources:
+            first=sources.header(0)
+            if header is None:
+                header=copy.copy(first)
+                header.docId=IpdrUuid(str(uuid.uuid4()))
+            writer=IpdrXdrWriter(outp,header,buffer_bytes=buffer_bytes)
+            table=DescriptorTable(writer)
+            merged=[]
+            if key_field is None:
+                for i in range(len(paths)):
+                    merge_input=MergeInput(sources.elements(i),table)
+                    merged.append(merge_input)
+                    for (key,descriptorId,packed) in merge_input:
+                        writer.write_packed(descriptorId,packed)
+                    sources.close(i)
+            else:
+                merged=[MergeInput(sources.elements(i),table,key_field) for i in range(len(paths))]
+                # (key,input,sequence) orders records of equal keys as the inputs are given
+                streams=[_ordered(merge_input,i) for (i,merge_input) in enumerate(merged)]
+                for (order,descriptorId,packed) in heapq.merge(*streams):
+                    writer.write_packed(descriptorId,packed)
+            endTimes=[merge_input.endTime for merge_input in merged if merge_input.endTime is not None]
+            writer.close(max(endTimes) if endTimes else None)
+    return {"inputs":len(paths),"records":writer.count,"descriptors":len(table.used),"remapped":table.remapped}
+
+def _ordered(merge_input,i):
+    n=0
+    for (key,descriptorId,packed) in merge_input:
+        yield ((key,i,n),descriptorId,packed)
+        n+=1
+
+class _Sources(object):
+    # The inputs, opened one after the other or all at once (open_all)
+    def __init__(self,paths,open_all):
+        self.paths=paths
+        self.managers={}
+        self.iterators={}
+        self.headers={}
+        if open_all:
+            for i in range(len(paths)):
+                self._open(i)
+
+    def _open(self,i):
+        manager=open_source(self.paths[i])
+        elements=iter_raw_elements(manager.__enter__())
+        self.managers[i]=manager
+        self.headers[i]=next(elements)
+        self.iterators[i]=elements
+
+    def header(self,i):
+        if i not in self.headers:
+            self._open(i)
+        return self.headers[i]
+
+    def elements(self,i):
+        if i not in self.iterators:
+            self._open(i)
+        return self.iterators[i]
+
+    def close(self,i=None):
+        for j in ([i] if i is not None else self.managers.keys()):
+            manager=self.managers.pop(j,None)
+            self.iterators.pop(j,None)
+            if manager is not None:
+                manager.__exit__(None,None,None)
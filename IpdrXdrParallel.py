@@ -0,0 +1,211 @@
+###############################################################################
+# Parallel decoding of a single IPDR-XDR file over a pool of processes.
+#
+# A pre-scan walks the element boundaries using only the element kind,
+# the descriptorId and the field widths known from each RecordDescriptor,
+# the file is then cut into chunks which are decoded by the pool workers.
+# Workers return what the caller outputs (XML or repr text, or the results
+# of a function) rather than the decoded elements: pickling the elements
+# back to the parent costs more than decoding them.
+###############################################################################
+
+import os,stat,mmap,collections,multiprocessing
+from IpdrXdrDocumentClasses import *
+from cStringIO import StringIO
+from IpdrXdrStream import detect_compression
+from IpdrXdrConvert import ReprFormatter,open_output
+
+def scan_chunks(buf,chunk_bytes=4*1024*1024):
+    # Yields (start,end,descriptors) for consecutive runs of IPDRStreamElements,
+    # descriptors maps each descriptorId in force at start to the offset of its RecordDescriptor.
+    offset=IPDRHeader.unpack_from(buf)[1]
+    descriptors={}
+    chunk_start=None
+    chunk_descriptors={}
+    for (kind,start,end,item) in iter_element_spans(buf,offset):
+        if chunk_start is None:
+            chunk_start=start
+        if kind == IpdrElementTypeEnum.RECORDDESC:
+            descriptors[int(item.descriptorId)]=start+4
+        if end-chunk_start >= chunk_bytes:
+            yield (chunk_start,end,chunk_descriptors)
+            chunk_start=None
+            chunk_descriptors=dict(descriptors)
+    if chunk_start is not None:
+        yield (chunk_start,end,chunk_descriptors)
+
+def map_path(path):
+    # mmap of the uncompressed regular file path, parallel decoding needs random access
+    if path == "-" or path.startswith("tcp://"):
+        raise ValueError("parallel decoding needs a regular file, not %r" % path)
+    with open(path,"rb") as filep:
+        if not stat.S_ISREG(os.fstat(filep.fileno()).st_mode):
+            raise ValueError("parallel decoding needs a regular file, not %r" % path)
+        if detect_compression(filep.read(6)) is not None:
+            raise ValueError("parallel decoding needs an uncompressed file, %r is compressed" % path)
+        return mmap.mmap(filep.fileno(),0,access=mmap.ACCESS_READ)
+
+#
+# Worker side, each pool process maps the file once.
+#
+_worker_buf=None
+_worker_func=None
+_worker_args=()
+_worker_filter=None
+
+def _init_worker(path,func,args,record_filter):
+    global _worker_buf,_worker_func,_worker_args,_worker_filter
+    _worker_buf=map_path(path)
+    _worker_func=func
+    _worker_args=args
+    _worker_filter=record_filter
+
+def _decode_chunk(chunk):
+    (start,end,descriptors)=chunk
+    # Decoded within a context holding the RecordDescriptors in force at start.
+    context=DecoderContext()
+    for (descriptorId,offset) in descriptors.items():
+        context.add_descriptor(RecordDescriptor.unpack_from(_worker_buf,offset)[0])
+    loader=context.element_loader(_worker_filter)
+    elements=[]
+    offset=start
+    while offset < end:
+        (element,offset)=loader.unpack_from(_worker_buf,offset)
+        loader.accept(element)
+        if element is not None:
+            elements.append(element)
+    return _worker_func(elements,*_worker_args)
+
+# Chunk functions, called in the workers with the elements decoded from a chunk
+
+def _elements(elements):
+    return elements
+
+def _map(elements,func):
+    return [func(element) for element in elements]
+
+def _xml_text(elements,pretty,depth):
+    # The elements as written by write_xml within the <array> at depth
+    writer=IpdrXmlWriter(None,pretty)
+    writer.depth=depth
+    writer.first=False
+    for element in elements:
+        element.write_xml(writer)
+    return writer.getvalue()
+
+def _repr_text(elements,max_indent,indent):
+    # The elements as written by write_repr within the array at indent
+    out=StringIO()
+    formatter=ReprFormatter(out,max_indent)
+    formatter.indent=indent
+    sep=""
+    for element in elements:
+        formatter.write(sep+repr(element))
+        sep=", "
+    return out.getvalue()
+
+def _bounded_imap(pool,func,tasks,max_pending,ordered=True):
+    # pool.imap(func,tasks) (or imap_unordered) submitting tasks only as results
+    # are consumed, so that at most max_pending results are decoded ahead.
+    tasks=iter(tasks)
+    pending=collections.deque()
+    while True:
+        for task in tasks:
+            pending.append(pool.apply_async(func,(task,)))
+            if len(pending) >= max_pending:
+                break
+        if not pending:
+            return
+        if ordered:
+            yield pending.popleft().get()
+            continue
+        while not any(result.ready() for result in pending):
+            pending[0].wait(0.01)
+        for result in pending:
+            if result.ready():
+                pending.remove(result)
+                yield result.get()
+                break
+
+def iter_chunks_parallel(path,func=_elements,args=(),processes=None,ordered=True,record_filter=None,chunk_bytes=4*1024*1024,max_pending=None,ipdr=None):
+    # Yields the IPDRHeader followed by func(elements,*args) for each chunk of the file,
+    # elements being the IPDRStreamElements of the chunk (through record_filter when given).
+    # func is called within the workers and must be a module level function, its result
+    # is pickled back. At most max_pending chunks (default twice the processes) are
+    # decoded ahead of the consumer. With ordered=False chunks are yielded as soon as
+    # they are decoded. When ipdr is given, its header and (empty) elements with their
+    # length are set once the header has been yielded, as by IPDRDoc.iter_load.
+    buf=map_path(path)
+    try:
+        (header,offset)=IPDRHeader.unpack_from(buf)
+        if ipdr is not None:
+            ipdr.header=header
+            ipdr.elements=IpdrArray(IPDRStreamElement)
+            ipdr.elements.length=IpdrInt.unpack_from(buf,offset)[0]
+        yield header
+        if processes is None:
+            processes=multiprocessing.cpu_count()
+        pool=multiprocessing.Pool(processes,_init_worker,(path,func,args,record_filter))
+        try:
+            for result in _bounded_imap(pool,_decode_chunk,scan_chunks(buf,chunk_bytes),max_pending or 2*processes,ordered):
+                yield result
+        finally:
+            pool.terminate()
+    finally:
+        buf.close()
+
+def iter_elements_parallel(path,processes=None,ordered=True,func=None,chunk_bytes=4*1024*1024,record_filter=None):
+    # Yields the IPDRHeader followed by the IPDRStreamElements, decoded in a process pool.
+    # func, when given, must be a module level function, it is applied to each element
+    # within the worker and its results are yielded instead of the elements, which
+    # are otherwise pickled back to this process (slower than decoding them here).
+    chunks=iter_chunks_parallel(path,_elements if func is None else _map,() if func is None else (func,),
+                                processes,ordered,record_filter,chunk_bytes)
+    header=next(chunks)
+    yield header if func is None else func(header)
+    for chunk in chunks:
+        for element in chunk:
+            yield element
+
+# Same output as write_xml / write_repr (see IpdrXdrConvert), the workers
+# producing the text of each chunk and this process only writing it out in order.
+
+def write_xml_parallel(path,outp,pretty=True,processes=None,record_filter=None,chunk_bytes=4*1024*1024):
+    writer=IpdrXmlWriter(outp,pretty)
+    writer.declaration()
+    ipdr=IPDRDoc()
+    writer.start(ipdr.__class__.__name__)
+    chunks=iter_chunks_parallel(path,_xml_text,(pretty,writer.depth+1),processes,True,record_filter,chunk_bytes,ipdr=ipdr)
+    next(chunks).write_xml(writer)
+    writer.start("array",[("length",ipdr.elements.length)])
+    for text in chunks:
+        if text:
+            writer.raw(text)
+    writer.end("array")
+    writer.end(ipdr.__class__.__name__)
+    writer.close()
+
+def write_repr_parallel(path,outp,max_indent=15,processes=None,record_filter=None,chunk_bytes=4*1024*1024):
+    formatter=ReprFormatter(outp,max_indent)
+    ipdr=IPDRDoc()
+    formatter.write("%s(header=" % ipdr.__class__.__name__)
+    chunks=iter_chunks_parallel(path,_repr_text,(max_indent,formatter.indent+4),processes,True,record_filter,chunk_bytes,ipdr=ipdr)
+    formatter.write(repr(next(chunks))+", ")
+    formatter.write("elements=%s(types=%s,length=%s,array=[" % (ipdr.elements.__class__.__name__,ipdr.elements.cls.__name__,ipdr.elements.length))
+    sep=""
+    for text in chunks:
+        if text:
+            formatter.write(sep)
+            outp.write(text)
+            sep=", "
+    formatter.write("]))")
+
+def xdr_to_xml_parallel(xdr_file,xml_file,pretty=True,processes=None,record_filter=None):
+    map_path(xdr_file).close() # fails before the output is created
+    with open_output(xml_file) as outp:
+        write_xml_parallel(xdr_file,outp,pretty,processes,record_filter)
+
+def xdr_to_repr_parallel(xdr_file,repr_file,processes=None,record_filter=None):
+    map_path(xdr_file).close()
+    with open_output(repr_file) as outp:
+        write_repr_parallel(xdr_file,outp,processes=processes,record_filter=record_filter)
@@ -0,0 +1,232 @@
+###############################################################################
+# Opt-in profiling of the decoding.
+#
+# A DecodeProfile given to a DecoderContext counts and times the elements
+# decoded per kind and per descriptorId, the attribute values decoded per Ipdr
+# type, and the reads from the source (or the size of the buffer decoded in
+# place, e.g. an mmap). Instrumentation is put in place by
+# substitution when the context (its element loader, RecordDecoders and
+# stream reader) is set up, the decoding code itself has no "if profiling"
+# test: without a DecodeProfile nothing is added to the hot path.
+# Times include the profiling overhead, they are to be compared with each
+# other rather than taken as absolute.
+###############################################################################
+
+import sys,struct,timeit
+from IpdrXdrElementaryTypes import IpdrElementTypeEnum
+
+timer=timeit.default_timer
+
+class ProfiledType(object):
+    # Stands for an Ipdr class (or a CachedValueType) when decoding, counting and
+    # timing its from_value/load/unpack_from calls in counters [calls,seconds].
+    def __init__(self,ipdr_type,counters):
+        self.ipdr_type=ipdr_type
+        self.counters=counters
+        self.packed_size=ipdr_type.packed_size
+        self.unpack_str=ipdr_type.unpack_str
+
+    def from_value(self,val):
+        started=timer()
+        obj=self.ipdr_type.from_value(val)
+        counters=self.counters
+        counters[0]+=1
+        counters[1]+=timer()-started
+        return obj
+
+    def load(self,filep):
+        started=timer()
+        obj=self.ipdr_type.load(filep)
+        counters=self.counters
+        counters[0]+=1
+        counters[1]+=timer()-started
+        return obj
+
+    def unpack_from(self,buf,offset=0):
+        started=timer()
+        result=self.ipdr_type.unpack_from(buf,offset)
+        counters=self.counters
+        counters[0]+=1
+        counters[1]+=timer()-started
+        return result
+
+class ProfilingLoader(object):
+    # Element loader (see DecoderContext.element_loader) timing the elements loader decodes.
+    # An element is counted once the reader keeps it (see accept): a stream reader decodes
+    # an element cut by the end of its buffer again, the type calls of the decoding it
+    # dropped are then taken back.
+    def __init__(self,loader,profile):
+        self.loader=loader
+        self.profile=profile
+        self.loader_accept=getattr(loader,"accept",None)
+        self.decoded=None  # add_element() arguments of the element last decoded
+        self.calls=[]      # type calls made decoding it, see DecodeProfile.type_calls_since
+
+    def _decoding(self):
+        # A new element is decoded, the one before was dropped unless accepted
+        for (counters,calls,seconds) in self.calls:
+            counters[0]-=calls
+            counters[1]-=seconds
+        self.calls=[]
+        self.decoded=None
+        return self.profile.type_counts()
+
+    def unpack_from(self,buf,offset=0):
+        before=self._decoding()
+        started=timer()
+        try:
+            (obj,end)=self.loader.unpack_from(buf,offset)
+        finally:
+            elapsed=timer()-started
+            self.calls=self.profile.type_calls_since(before)
+        # every element is at least 8 bytes, the descriptorId only means something for an IPDRREC
+        (kind,descriptorId)=struct.unpack_from("!ll",buf,offset)
+        self.decoded=(kind,descriptorId,obj,elapsed,end-offset)
+        return (obj,end)
+
+    def load(self,filep):
+        # Without unpack_from (see IpdrArray.iter_load) the kind of an element filtered out is unknown
+        before=self._decoding()
+        start=filep.tell() if hasattr(filep,"tell") else 0
+        started=timer()
+        try:
+            obj=self.loader.load(filep)
+        finally:
+            elapsed=timer()-started
+            self.calls=self.profile.type_calls_since(before)
+        size=filep.tell()-start if hasattr(filep,"tell") else 0
+        kind=None if obj is None else int(obj.kind)
+        descriptorId=int(obj.rec.descriptorId) if kind == IpdrElementTypeEnum.IPDRREC else None
+        self.decoded=(kind,descriptorId,obj,elapsed,size)
+        return obj
+
+    def accept(self,obj):
+        # The reader keeps the element last decoded
+        if self.decoded is not None:
+            self.profile.add_element(*self.decoded)
+        self.decoded=None
+        self.calls=[]
+        if self.loader_accept is not None:
+            self.loader_accept(obj)
+
+class DecodeProfile(object):
+    # Statistics gathered by the DecoderContexts given this profile, possibly across
+    # many documents. Usage:
+    #   profile=DecodeProfile()
+    #   doc=IPDRDoc.load(open("big.xdr","rb"),context=DecoderContext(profile=profile))
+    #   profile.report(sys.stderr)
+    def __init__(self):
+        self.documents=0
+        self.elements={}     # kind -> [count,seconds,bytes,returned]
+        self.descriptors={}  # descriptorId -> [count,seconds,bytes,returned] of its IPDRRecords
+        self.type_names={}   # descriptorId -> typeName
+        self.types={}        # Ipdr class name -> [calls,seconds]
+        self.reads=0         # read calls on the source
+        self.bytes_read=0
+        self.buffers=0       # buffers (e.g. mmaps) decoded in place, instead of read
+        self.buffer_bytes=0
+
+    def profiled_type(self,ipdr_type,ipdr_class):
+        # ipdr_type (decoding the values of ipdr_class) with its calls counted
+        counters=self.types.get(ipdr_class.__name__)
+        if counters is None:
+            counters=self.types[ipdr_class.__name__]=[0,0.0]
+        return ProfiledType(ipdr_type,counters)
+
+    def type_counts(self):
+        # {Ipdr class name:(calls,seconds)} so far
+        return dict([(name,(calls,seconds)) for (name,(calls,seconds)) in self.types.items()])
+
+    def type_calls_since(self,before):
+        # [(counters,calls,seconds)] of the types called since type_counts() returned before
+        since=[]
+        for (name,counters) in self.types.items():
+            (calls,seconds)=before.get(name,(0,0.0))
+            if counters[0] != calls:
+                since.append((counters,counters[0]-calls,counters[1]-seconds))
+        return since
+
+    def add_element(self,kind,descriptorId,obj,seconds,size):
+        counters=self.elements.get(kind)
+        if counters is None:
+            counters=self.elements[kind]=[0,0.0,0,0]
+        counters[0]+=1
+        counters[1]+=seconds
+        counters[2]+=size
+        if obj is not None:
+            counters[3]+=1
+        if kind == IpdrElementTypeEnum.IPDRREC:
+            counters=self.descriptors.get(descriptorId)
+            if counters is None:
+                counters=self.descriptors[descriptorId]=[0,0.0,0,0]
+            counters[0]+=1
+            counters[1]+=seconds
+            counters[2]+=size
+            if obj is not None:
+                counters[3]+=1
+
+    def watch(self,reader,offset=0):
+        # Counts the reads of a StreamReader (see IpdrXdrStream) from its source,
+        # or the bytes from offset of a buffer decoded in place
+        if not hasattr(reader,"raw_read"):
+            if hasattr(reader,"__len__"):
+                self.buffers+=1
+                self.buffer_bytes+=len(reader)-offset
+            return
+        if getattr(reader,"profile",None) is self:
+            return
+        raw_read=reader.raw_read
+        def counted_read(n):
+            data=raw_read(n)
+            self.reads+=1
+            self.bytes_read+=len(data)
+            return data
+        reader.raw_read=counted_read
+        reader.profile=self
+
+    def objects(self):
+        # IPDRStreamElements returned, with the IPDRRecord of each record, and attribute values decoded
+        # (values served from a value cache included)
+        returned=sum([counters[3] for counters in self.elements.values()])
+        records=self.elements.get(IpdrElementTypeEnum.IPDRREC,[0,0.0,0,0])[3]
+        return returned+records+sum([calls for (calls,seconds) in self.types.values()])
+
+    def stats(self):
+        def element_stats(counters):
+            (count,seconds,size,returned)=counters
+            return {"count":count,"seconds":seconds,"bytes":size,"returned":returned}
+        descriptors={}
+        for (descriptorId,counters) in self.descriptors.items():
+            descriptors[descriptorId]=element_stats(counters)
+            descriptors[descriptorId]["typeName"]=self.type_names.get(descriptorId)
+        return {
+            "documents":self.documents,
+            "elements":dict([(IpdrElementTypeEnum.enum.get(kind,"FILTERED"),element_stats(counters)) for (kind,counters) in self.elements.items()]),
+            "descriptors":descriptors,
+            "types":dict([(name,{"calls":calls,"seconds":seconds}) for (name,(calls,seconds)) in self.types.items()]),
+            "reads":self.reads,
+            "bytes_read":self.bytes_read,
+            "buffers":self.buffers,
+            "buffer_bytes":self.buffer_bytes,
+            "objects":self.objects()
+        }
+
+    def report(self,outp=sys.stderr):
+        # Writes the statistics as text tables, the costliest first
+        elements=sum([counters[1] for counters in self.elements.values()])
+        sources=[]
+        if self.reads or not self.buffers:
+            sources.append("%d reads (%d bytes)" % (self.reads,self.bytes_read))
+        if self.buffers:
+            sources.append("%d buffers/mmaps decoded in place (%d bytes)" % (self.buffers,self.buffer_bytes))
+        print >> outp, "%d documents, %.3fs decoding elements, %s, %d objects" % (self.documents,elements,", ".join(sources),self.objects())
+        print >> outp, "%-12s %10s %10s %12s %10s" % ("kind","count","seconds","bytes","us/each")
+        for (kind,(count,seconds,size,returned)) in sorted(self.elements.items(),key=lambda item: -item[1][1]):
+            print >> outp, "%-12s %10d %10.3f %12d %10.2f" % (IpdrElementTypeEnum.enum.get(kind,"FILTERED"),count,seconds,size,seconds*1e6/max(count,1))
+        print >> outp, "%-12s %-24s %10s %10s %12s %10s" % ("descriptorId","typeName","records","seconds","bytes","us/each")
+        for (descriptorId,(count,seconds,size,returned)) in sorted(self.descriptors.items(),key=lambda item: -item[1][1]):
+            print >> outp, "%-12d %-24s %10d %10.3f %12d %10.2f" % (descriptorId,self.type_names.get(descriptorId,"?")[:24],count,seconds,size,seconds*1e6/max(count,1))
+        print >> outp, "%-20s %10s %10s %10s" % ("type","calls","seconds","us/each")
+        for (name,(calls,seconds)) in sorted(self.types.items(),key=lambda item: -item[1][1]):
+            if calls:
+                print >> outp, "%-20s %10d %10.3f %10.2f" % (name,calls,seconds,seconds*1e6/calls)
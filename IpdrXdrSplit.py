@@ -0,0 +1,161 @@
+###############################################################################
+# Splitting of an Ipdr-Xdr file into self-contained shards, by record count,
+# byte size or time window.
+#
+# Records are copied as the packed byte spans of the input, never decoded.
+# Each shard repeats the IPDRHeader of the input with a docId derived from
+# the original one, streams the RecordDescriptors its records use just before
+# the first of them, and ends with an IPDRDocEnd counting its records. Its
+# endTime is the one of the input, or in time window mode the key time of the
+# last record of the shard, so splitting the same input gives the same shards.
+###############################################################################
+
+import copy,uuid
+from IpdrXdrWriter import *
+from IpdrXdrConvert import open_source
+from IpdrXdrIndex import key_reader,read_key,docend_size
+
+def shard_header(header,n):
+    # Copy of header with the docId of shard n, derived from the original docId
+    header=copy.copy(header)
+    header.docId=IpdrUuid(str(uuid.uuid5(header.docId,"shard-%d" % n)))
+    return header
+
+def default_output_pattern(xdr_file):
+    # "big.xdr" -> "big.0000.xdr", "big.0001.xdr"...
+    for ext in (".gz",".bz2",".xz"):
+        if xdr_file.endswith(ext):
+            xdr_file=xdr_file[:-len(ext)]
+    if xdr_file.endswith(".xdr"):
+        xdr_file=xdr_file[:-len(".xdr")]
+    return xdr_file.replace("%","%%")+".%04d.xdr"
+
+class ShardWriter(object):
+    # Writes the shards of one input, output_pattern % n being the path of shard n
+    def __init__(self,header,output_pattern,buffer_bytes=1<<20):
+        self.header=header
+        self.output_pattern=output_pattern
+        self.buffer_bytes=buffer_bytes
+        self.shards=[]   # (path,records,size) of the shards closed
+        self.pending=[]  # shards closed without an endTime, see finish()
+        self.outp=None
+        self.writer=None
+        self.streamed=set()
+
+    def open(self):
+        path=self.output_pattern % len(self.shards)
+        self.outp=open(path,"wb")
+        self.writer=IpdrXdrWriter(self.outp,shard_header(self.header,len(self.shards)),buffer_bytes=self.buffer_bytes)
+        self.path=path
+        self.streamed=set()
+
+    def close(self,endTime=None):
+        # Without endTime, the IPDRDocEnd endTime is the header startTime until finish()
+        if self.writer is None:
+            return
+        if endTime is None:
+            self.pending.append(len(self.shards))
+            endTime=self.header.startTime
+        try:
+            self.writer.close(endTime)
+        finally:
+            self.outp.close()
+        self.shards.append((self.path,self.writer.count,self.writer.size))
+        self.writer=None
+        self.outp=None
+
+    def finish(self,endTime):
+        # Sets the IPDRDocEnd endTime (the last 8 bytes) of the shards closed without one
+        if endTime is not None:
+            packed=IpdrDateTimeMsec(IpdrDateTimeMsec.to_value(endTime)).pack()
+            for n in self.pending:
+                (path,count,size)=self.shards[n]
+                with open(path,"r+b") as outp:
+                    outp.seek(size-len(packed))
+                    outp.write(packed)
+        self.pending=[]
+
+    def write(self,desc,packed):
+        # Copies the packed IPDRREC element of RecordDescriptor desc,
+        # desc is streamed first unless the shard already has it.
+        descriptorId=int(desc.descriptorId)
+        if descriptorId not in self.streamed:
+            self.writer.add_descriptor(desc)
+            self.streamed.add(descriptorId)
+        self.writer.write_packed(descriptorId,packed)
+
+def split_file(xdr_file,output_pattern=None,records=None,size=None,window=None,key_field=None,buffer_bytes=1<<20):
+    # Splits xdr_file (which may be compressed, stdin or a connection, see open_source)
+    # into shards written to output_pattern % n (default see default_output_pattern).
+    # A shard is ended once it holds records records, before a record would take it
+    # beyond size bytes, or at the first record whose key_field (dateTime attribute,
+    # see IpdrXdrIndex.key_fields) falls in another window of window seconds than
+    # the records before it, windows being aligned on the epoch.
+    # Records without the key attribute stay in the current shard.
+    # The IPDRDocEnd endTime of each shard is the one of the input (its IPDRHeader
+    # startTime when it has no IPDRDocEnd) or, splitting by time window, the key
+    # time of the last record of the shard with the key attribute.
+    # Returns [(path,records,size)] of the shards written.
+    if records is None and size is None and window is None:
+        raise ValueError("a number of records, a size or a time window is needed")
+    if window is not None and key_field is None:
+        raise ValueError("splitting by time window needs a key_field")
+    if output_pattern is None:
+        if xdr_file == "-" or xdr_file.startswith("tcp://"):
+            raise ValueError("an output pattern is needed to split %s" % xdr_file)
+        output_pattern=default_output_pattern(xdr_file)
+    window_usec=None if window is None else long(window*1000000)
+    descriptors={} # descriptorId -> (RecordDescriptor,size of its stream element)
+    keys={}        # RecordDecoder -> key_reader() of the window key
+    bucket=None    # window of the records of the current shard
+    last_key=None  # of the last record of the current shard with the key attribute
+    endTime=None
+    with open_source(xdr_file) as source:
+        elements=iter_raw_elements(source)
+        shards=ShardWriter(next(elements),output_pattern,buffer_bytes)
+        try:
+            for (kind,item,packed) in elements:
+                if kind == IpdrElementTypeEnum.RECORDDESC:
+                    descriptorId=int(item.descriptorId)
+                    descriptors[descriptorId]=(item,len(packed))
+                    # redefined within the input, it must be streamed again
+                    shards.streamed.discard(descriptorId)
+                    continue
+                if kind == IpdrElementTypeEnum.DOCEND:
+                    endTime=item.endTime
+                    continue
+                (desc,desc_size)=descriptors[int(item.descriptor.descriptorId)]
+                writer=shards.writer
+                record_bucket=bucket
+                key=None
+                if window_usec is not None:
+                    reader=keys.get(item,False)
+                    if reader is False:
+                        reader=keys[item]=key_reader(item,key_field)
+                    if reader is not None:
+                        key=read_key(item,reader,packed,0)
+                        record_bucket=key//window_usec
+                if writer is not None and writer.count > 0:
+                    needed=len(packed)+docend_size
+                    if int(desc.descriptorId) not in shards.streamed:
+                        needed+=desc_size
+                    if ((records is not None and writer.count >= records) or
+                        (size is not None and writer.size+needed > size) or
+                        (bucket is not None and record_bucket != bucket)):
+                        shards.close(None if last_key is None else last_key//1000)
+                if shards.writer is None:
+                    shards.open()
+                    last_key=None
+                bucket=record_bucket
+                if key is not None:
+                    last_key=key
+                shards.write(desc,packed)
+            if shards.writer is None and not shards.shards:
+                # no record at all, still one (empty) document
+                shards.open()
+            shards.close(None if last_key is None else last_key//1000)
+            shards.finish(endTime)
+        finally:
+            if shards.outp is not None:
+                shards.outp.close()
+    return shards.shards
@@ -0,0 +1,292 @@
+###############################################################################
+# Buffered Ipdr-Xdr input streams.
+#
+# A StreamReader reads its source (file, stdin, FIFO, socket) block_size bytes
+# at a time into one buffer, elements are decoded from it with unpack_from()
+# and the buffer is refilled when an element runs past its end. The end of
+# the stream is where the source is exhausted, no size is needed up front.
+#
+# Compressed input (gzip, bz2, xz) is detected by its magic bytes and 
+# decompressed while it is decoded, without temporary files.
+# xz needs the lzma module (backports.lzma on python 2), an optional dependency.
+###############################################################################
+
+import os,sys,stat,struct,socket,zlib,bz2
+from xdrlib import Error as XDRError
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma=None
+
+magic_numbers=[
+    ("\x1f\x8b","gzip"),
+    ("BZh","bz2"),
+    ("\xfd7zXZ\x00","xz")
+]
+
+def detect_compression(head):
+    # Compression of the data starting with head, None when not compressed
+    for (magic,compression) in magic_numbers:
+        if head.startswith(magic):
+            return compression
+    return None
+
+def decompressor(compression):
+    if compression == "gzip":
+        return zlib.decompressobj(16+zlib.MAX_WBITS)
+    if compression == "bz2":
+        return bz2.BZ2Decompressor()
+    if compression == "xz":
+        if lzma is None:
+            raise ImportError("the lzma module (backports.lzma) is required for xz compressed input")
+        return lzma.LZMADecompressor()
+    raise ValueError("unknown compression %r" % compression)
+
+def _raw_reader(raw):
+    # The function reading up to n bytes of raw, returning what is available
+    # rather than waiting for n bytes on sockets, pipes and terminals.
+    if isinstance(raw,socket.socket):
+        return raw.recv
+    if isinstance(raw,file) and not stat.S_ISREG(os.fstat(raw.fileno()).st_mode):
+        fd=raw.fileno()
+        return lambda n: os.read(fd,n)
+    return raw.read
+
+class TruncatedError(XDRError):
+    # The data ends within an element. StreamReader.iter_unpack (and FeedDecoder)
+    # decode it again once more data is read, for a buffer it is the end of it.
+    pass
+
+class StreamReader(object):
+    # Read-only file like object over raw with one buffer refilled a block at a time.
+    # read() slices the buffer, iter_unpack() decodes elements straight from it,
+    # at_eof() is what IpdrArray uses to detect the end of a stream whose size is unknown.
+    def __init__(self,raw,block_size=1<<20):
+        self.raw=raw
+        self.block_size=block_size
+        self.raw_read=_raw_reader(raw)
+        self.buf=""
+        self.pos=0       # of the next byte to read in buf
+        self.offset=0    # stream offset of buf[0]
+        self.raw_eof=False
+
+    def _read_block(self):
+        # Next data of the stream, "" at its end
+        if self.raw_eof:
+            return ""
+        data=self.raw_read(self.block_size)
+        if not data:
+            self.raw_eof=True
+        return data
+
+    def _more(self):
+        # Appends the next block to the buffer, False at the end of the stream
+        data=self._read_block()
+        if not data:
+            return False
+        self.offset+=self.pos
+        self.buf=self.buf[self.pos:]+data
+        self.pos=0
+        return True
+
+    def _fill(self,size):
+        # Makes size bytes available from pos unless the stream ends first
+        if len(self.buf)-self.pos >= size:
+            return
+        parts=[self.buf[self.pos:]]
+        available=len(parts[0])
+        while available < size:
+            data=self._read_block()
+            if not data:
+                break
+            parts.append(data)
+            available+=len(data)
+        self.offset+=self.pos
+        self.buf="".join(parts)
+        self.pos=0
+
+    def read(self,size=-1):
+        if size < 0:
+            parts=[self.buf[self.pos:]]
+            data=self._read_block()
+            while data:
+                parts.append(data)
+                data=self._read_block()
+            data="".join(parts)
+            self.offset+=self.pos+len(data)
+            self.buf=""
+            self.pos=0
+            return data
+        self._fill(size)
+        data=self.buf[self.pos:self.pos+size]
+        self.pos+=len(data)
+        return data
+
+    def tell(self):
+        return self.offset+self.pos
+
+    def peek(self,size):
+        self._fill(size)
+        return self.buf[self.pos:self.pos+size]
+
+    def at_eof(self):
+        if self.pos < len(self.buf):
+            return False
+        self._fill(1)
+        return self.pos >= len(self.buf)
+
+    def iter_unpack(self,loader,length=-1):
+        # Yields the elements loader.unpack_from() decodes from the buffer, length
+        # of them or up to the end of the stream when length is negative, except
+        # those it returns as None (e.g. filtered out by a RecordFilter). A stream
+        # ending before length elements raises TruncatedError.
+        # An element running past the buffer (or ending exactly at its end, which
+        # a nested array could mistake for its own end) is decoded again once the
+        # next block has been read, so a loader with an accept(obj) method is told
+        # of each element kept, only once.
+        accept=getattr(loader,"accept",None)
+        i=0
+        while i < length or length < 0:
+            if self.at_eof():
+                if length >= 0:
+                    raise TruncatedError, 'truncated stream, %d of %d elements at offset %d' % (i,length,self.tell())
+                break
+            while True:
+                end=None
+                try:
+                    (obj,end)=loader.unpack_from(self.buf,self.pos)
+                except (struct.error,TruncatedError):
+                    pass
+                if end is not None and (end < len(self.buf) or (end == len(self.buf) and self.raw_eof)):
+                    break
+                if not self._more():
+                    if end is not None and end == len(self.buf):
+                        break
+                    raise TruncatedError, 'truncated stream, element %d at offset %d is incomplete' % (i+1,self.tell())
+            self.pos=end
+            i+=1
+            if accept is not None:
+                accept(obj)
+            if obj is not None:
+                yield obj
+
+    def close(self):
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+class DecompressingReader(StreamReader):
+    # StreamReader over the decompressed data of raw, up to block_size compressed
+    # bytes are read at a time. Concatenated streams (e.g. several gzip members)
+    # are read one after the other. head: compressed data already read from raw
+    # (e.g. to detect the compression), decompressed first.
+    def __init__(self,raw,compression,block_size=1<<20,head=""):
+        super(DecompressingReader,self).__init__(raw,block_size)
+        self.compression=compression
+        self.decompressor=decompressor(compression)
+        self.head=head
+
+    def _read_block(self):
+        # Next decompressed data, "" once raw is exhausted
+        while not self.raw_eof:
+            if self.head:
+                data=self.head
+                self.head=""
+            else:
+                data=self.raw_read(self.block_size)
+            if not data:
+                self.raw_eof=True
+                if hasattr(self.decompressor,"flush"):
+                    return self.decompressor.flush()
+                return ""
+            try:
+                out=self.decompressor.decompress(data)
+            except EOFError:
+                # bz2: the previous stream ended with the previous block
+                self.decompressor=decompressor(self.compression)
+                out=self.decompressor.decompress(data)
+            while self.decompressor.unused_data:
+                # the next stream starts within this block
+                unused=self.decompressor.unused_data
+                if hasattr(self.decompressor,"flush"):
+                    out+=self.decompressor.flush()
+                self.decompressor=decompressor(self.compression)
+                out+=self.decompressor.decompress(unused)
+            if out:
+                return out
+        return ""
+
+def open_stream(raw,block_size=1<<20):
+    # StreamReader over raw (a file object or a connected socket), decompressing
+    # when its data starts with the magic bytes of a compression. The decompressing
+    # reader takes over the bytes peeked and reads raw itself, so that what has
+    # arrived is decoded without waiting for a whole block.
+    # Returns (reader,compression or None).
+    reader=StreamReader(raw,block_size)
+    compression=detect_compression(reader.peek(6))
+    if compression is None:
+        return (reader,None)
+    return (DecompressingReader(raw,compression,block_size,reader.buf[reader.pos:]),compression)
+
+def parse_address(address):
+    # "tcp://host:port" -> (host,port)
+    (host,sep,port)=address[len("tcp://"):].rpartition(":")
+    if not address.startswith("tcp://") or not sep:
+        raise ValueError("expected tcp://host:port, got %r" % address)
+    return (host.strip("[]"),int(port))
+
+def connect(address,timeout=None):
+    # Socket connected to "tcp://host:port"
+    return socket.create_connection(parse_address(address),timeout)
+
+def open_input(path,block_size=1<<20):
+    # path is a file, a FIFO, "-" for stdin or "tcp://host:port" to read from a connection.
+    # Returns (file object,compression or None): the opened file itself for an uncompressed
+    # regular file (e.g. to be mmapped), a StreamReader (or DecompressingReader) otherwise.
+    if path == "-":
+        return open_stream(sys.stdin,block_size)
+    if path.startswith("tcp://"):
+        return open_stream(connect(path),block_size)
+    filep=open(path,"rb")
+    try:
+        if not stat.S_ISREG(os.fstat(filep.fileno()).st_mode):
+            return open_stream(filep,block_size)
+        compression=detect_compression(filep.read(6))
+        filep.seek(0)
+    except:
+        filep.close()
+        raise
+    if compression is None:
+        return (filep,None)
+    return (DecompressingReader(filep,compression,block_size),compression)
+
+def test():
+    # A compressed stream from a pipe is decompressed as it arrives: the data
+    # before a pause in the writer is read without waiting for a whole block.
+    import threading,time
+    data="".join([chr(i%251) for i in range(100000)])
+    compressor=zlib.compressobj(9,zlib.DEFLATED,16+zlib.MAX_WBITS)
+    compressed=compressor.compress(data)+compressor.flush()
+    (r,w)=os.pipe()
+    def write():
+        os.write(w,compressed[:-10])
+        time.sleep(1)
+        os.write(w,compressed[-10:])
+        os.close(w)
+    writer=threading.Thread(target=write)
+    writer.start()
+    (reader,compression)=open_stream(os.fdopen(r,"rb"))
+    assert(compression=="gzip")
+    start=time.time()
+    assert(reader.read(100)==data[:100])
+    assert(time.time()-start < 0.5)
+    assert(reader.read()==data[100:])
+    writer.join()
+    reader.close()
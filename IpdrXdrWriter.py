@@ -0,0 +1,299 @@
+###############################################################################
+# Streaming IPDR-XDR encoder.
+#
+# An IpdrXdrWriter writes the IPDRHeader to an output stream, then the
+# RecordDescriptors and records as they are appended, and finishes with the
+# IPDRDocEnd carrying the number of records written. Records are given as
+# plain tuples/lists (in attribute order) or dicts (by attributeName) and
+# packed by a RecordEncoder compiled once per RecordDescriptor, output is
+# buffered and written buffer_bytes at a time.
+###############################################################################
+
+import time,uuid,struct
+from IpdrXdrDocumentClasses import *
+
+# to_value of these classes returns the value unchanged, struct packs it as is
+_identity_to_value=(IpdrNumericalBaseType.to_value.im_func,IpdrFloat.to_value.im_func)
+
+class RecordEncoder(object):
+    # Compiled once per RecordDescriptor, the counterpart of RecordDecoder.
+    # Consecutive fixed size attributes are packed with a single struct.Struct
+    # from the values their class' to_value() returns (no conversion at all for
+    # the numerical types), variable length attributes with their pack_value().
+    # steps are (struct.Struct,first,last,converters) for the attributes
+    # values[first:last], converters [(index in the run,to_value)] of those
+    # needing a conversion, or (None,i,i+1,pack_value) for a variable length attribute.
+    def __init__(self,recordDescriptor):
+        self.descriptor=recordDescriptor
+        self.descriptorId=int(recordDescriptor.descriptorId)
+        self.names=[]
+        self.classes=[]
+        self.steps=[]
+        self.prefix=struct.pack("!ll",IpdrElementTypeEnum.IPDRREC,self.descriptorId)
+        fmt=""
+        converters=[]
+        first=0
+        for attributeDescriptor in recordDescriptor.attributes:
+            ipdr_class=ipdr_class_from_type_id[attributeDescriptor.typeId]
+            i=len(self.names)
+            self.names.append(str(attributeDescriptor.attributeName))
+            self.classes.append(ipdr_class)
+            if ipdr_class.packed_size > 0:
+                if not converters:
+                    first=i
+                fmt+=getattr(ipdr_class,"pack_str",ipdr_class.unpack_str).lstrip("!")
+                converters.append(ipdr_class.to_value)
+                continue
+            if converters:
+                self._fixed_step(fmt,first,i,converters)
+                fmt=""
+                converters=[]
+            self.steps.append((None,i,i+1,ipdr_class.pack_value))
+        if converters:
+            self._fixed_step(fmt,first,len(self.names),converters)
+        self.index=dict([(name,i) for (i,name) in enumerate(self.names)])
+        # Records of only fixed size attributes are packed, prefix included, with a single call
+        self.whole=None
+        if len(self.steps) == 1 and self.steps[0][0] is not None:
+            self.whole=struct.Struct("!ll"+self.steps[0][0].format.lstrip("!"))
+
+    def _fixed_step(self,fmt,first,last,converters):
+        converters=[(j,f) for (j,f) in enumerate(converters) if f.im_func not in _identity_to_value]
+        self.steps.append((struct.Struct("!"+fmt),first,last,converters))
+
+    def values_from_dict(self,values):
+        try:
+            return [values[name] for name in self.names]
+        except KeyError as e:
+            raise XDRError, 'descriptorId=%d has no value for attributeName=%s' % (self.descriptorId,e.args[0])
+
+    def encode(self,values):
+        # The packed IPDRREC stream element of values, a tuple/list/record row in
+        # attribute order or a dict by attributeName
+        if isinstance(values,dict):
+            values=self.values_from_dict(values)
+        if len(values) != len(self.names):
+            raise XDRError, 'descriptorId=%d expects %d values, got %d' % (self.descriptorId,len(self.names),len(values))
+        try:
+            if self.whole is not None:
+                converters=self.steps[0][3]
+                if converters:
+                    values=list(values)
+                    for (j,f) in converters:
+                        values[j]=f(values[j])
+                return self.whole.pack(IpdrElementTypeEnum.IPDRREC,self.descriptorId,*values)
+            parts=[self.prefix]
+            for (packer,first,last,converters) in self.steps:
+                if packer is None:
+                    parts.append(converters(values[first]))
+                elif not converters:
+                    parts.append(packer.pack(*values[first:last]))
+                else:
+                    run=list(values[first:last])
+                    for (j,f) in converters:
+                        run[j]=f(run[j])
+                    parts.append(packer.pack(*run))
+            return "".join(parts)
+        except (struct.error,TypeError,ValueError) as e:
+            raise XDRError, 'descriptorId=%d: cannot pack %r: %s' % (self.descriptorId,values,e)
+
+def make_descriptor(descriptorId,typeName,attributes):
+    # RecordDescriptor from attributes [(attributeName,Ipdr class or typeId)]
+    array=IpdrArray(AttributeDescriptor)
+    for (name,typ) in attributes:
+        typeId=typ if isinstance(typ,(int,long)) else typ.type_id
+        if typeId not in ipdr_class_from_type_id:
+            raise XDRError, 'unknown typeId=%s for attributeName=%s' % (typeId,name)
+        array.append(AttributeDescriptor(attributeName=IpdrString(name),typeId=IpdrInt(typeId)))
+    array.length=IpdrInt(len(array))
+    return RecordDescriptor(descriptorId=IpdrInt(descriptorId),typeName=IpdrString(typeName),attributes=array)
+
+def projected_descriptor(desc,indexes):
+    # RecordDescriptor of only the attributes of desc at indexes (see RecordFilter.projection)
+    attributes=[desc.attributes[i] for i in indexes]
+    return make_descriptor(int(desc.descriptorId),str(desc.typeName),[(str(a.attributeName),int(a.typeId)) for a in attributes])
+
+def make_header(ipdrVersion=4,ipdrRecorderInfo="",startTime=None,defaultNameSpaceURI="http://www.ipdr.org/namespaces/ipdr",
+                otherNameSpaces=(),serviceDefinitionURIs=(),docId=None):
+    # IPDRHeader from plain values: startTime as for IpdrDateTimeMsec.to_value (default now),
+    # otherNameSpaces [(nameSpaceURI,nameSpaceID)], docId a UUID or its text (default random)
+    if startTime is None:
+        startTime=long(time.time()*1000)
+    if docId is None:
+        docId=uuid.uuid4()
+    return IPDRHeader(
+        ipdrVersion=IpdrInt(ipdrVersion),
+        ipdrRecorderInfo=IpdrString(ipdrRecorderInfo),
+        startTime=IpdrDateTimeMsec(IpdrDateTimeMsec.to_value(startTime)),
+        defaultNameSpaceURI=IpdrString(defaultNameSpaceURI),
+        otherNameSpaces=IpdrArray(NameSpaceInfo,array=[NameSpaceInfo(nameSpaceURI=IpdrString(uri),nameSpaceID=IpdrString(nid)) for (uri,nid) in otherNameSpaces]),
+        serviceDefinitionURIs=IpdrArray(IpdrString,array=[IpdrString(uri) for uri in serviceDefinitionURIs]),
+        docId=IpdrUuid(str(docId)))
+
+class IpdrXdrWriter(object):
+    # header is an IPDRHeader, or built by make_header from header_fields.
+    # length is the IPDRStreamElement count written after the header,
+    # -1 (the default) for a stream of unknown length, it is checked on close().
+    # Usage:
+    #   with open("out.xdr","wb") as outp, IpdrXdrWriter(outp,ipdrRecorderInfo="test") as writer:
+    #       writer.add_descriptor(1,"Usage",[("cmtsHostName",IpdrString),("octets",IpdrULong)])
+    #       writer.write_record(1,("cmts01",1024))
+    #       writer.write_record(1,{"cmtsHostName":"cmts02","octets":2048})
+    def __init__(self,outp,header=None,length=-1,buffer_bytes=1<<20,**header_fields):
+        self.outp=outp
+        self.buffer_bytes=buffer_bytes
+        self.parts=[]
+        self.buffered=0
+        self.encoders={}
+        self.count=0     # IPDRRecords written
+        self.elements=0  # IPDRStreamElements written
+        self.size=0      # bytes written, buffered ones included
+        self.length=length
+        self.closed=False
+        self.header=header if header is not None else make_header(**header_fields)
+        self._write(self.header.pack()+IpdrInt(length).pack())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.flush()
+
+    def _write(self,s):
+        self.parts.append(s)
+        self.buffered+=len(s)
+        self.size+=len(s)
+        if self.buffered >= self.buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.outp.write("".join(self.parts))
+            self.parts=[]
+            self.buffered=0
+
+    def _check_open(self):
+        if self.closed:
+            raise XDRError, 'IPDRDocEnd already written'
+
+    def add_descriptor(self,descriptorId,typeName=None,attributes=None):
+        # Writes a RecordDescriptor, given as such or as for make_descriptor,
+        # records of its descriptorId can then be written. Returns its RecordEncoder.
+        self._check_open()
+        if isinstance(descriptorId,RecordDescriptor):
+            desc=descriptorId
+        else:
+            desc=make_descriptor(descriptorId,typeName,attributes)
+        encoder=self.encoders[int(desc.descriptorId)]=RecordEncoder(desc)
+        self._write(IpdrElementTypeEnum(IpdrElementTypeEnum.RECORDDESC).pack()+desc.pack())
+        self.elements+=1
+        return encoder
+
+    def encoder(self,descriptorId):
+        encoder=self.encoders.get(descriptorId)
+        if encoder is None:
+            raise XDRError, 'value=%d not a previously streamed RecordDescriptor Id' % descriptorId
+        return encoder
+
+    def write_record(self,descriptorId,values):
+        self._check_open()
+        self._write(self.encoder(descriptorId).encode(values))
+        self.count+=1
+        self.elements+=1
+
+    def write_records(self,descriptorId,rows):
+        # Bulk variant of write_record for rows of the same descriptorId
+        self._check_open()
+        encode=self.encoder(descriptorId).encode
+        for values in rows:
+            self._write(encode(values))
+            self.count+=1
+            self.elements+=1
+
+    def write_packed(self,descriptorId,packed):
+        # Copies an IPDRREC stream element of descriptorId as packed (kind and descriptorId included)
+        self._check_open()
+        self.encoder(descriptorId)
+        self._write(packed)
+        self.count+=1
+        self.elements+=1
+
+    def write_element(self,element):
+        # Re-encodes a decoded IPDRStreamElement, e.g. from IPDRDoc.iter_elements().
+        # Lazy records are copied as packed, a DOCEND is written as it is (closing the writer).
+        if element.kind == IpdrElementTypeEnum.RECORDDESC:
+            self.add_descriptor(element.desc)
+        elif element.kind == IpdrElementTypeEnum.IPDRREC:
+            descriptorId=int(element.rec.descriptorId)
+            data=element.rec.data
+            if isinstance(data,IPDRLazyRecordRow):
+                self.write_packed(descriptorId,struct.pack("!ll",IpdrElementTypeEnum.IPDRREC,descriptorId)+data.pack())
+            else:
+                self.write_record(descriptorId,data)
+        elif element.kind == IpdrElementTypeEnum.DOCEND:
+            self.close(docEnd=element.docEnd)
+        else:
+            raise XDRError, 'bad switch=%s' % element.kind
+
+    def close(self,endTime=None,docEnd=None):
+        # Writes the IPDRDocEnd (count of the records written, endTime as for
+        # IpdrDateTimeMsec.to_value, default now) unless docEnd is given, and flushes.
+        # The output stream itself is left open.
+        if self.closed:
+            return
+        if docEnd is None:
+            if endTime is None:
+                endTime=long(time.time()*1000)
+            docEnd=IPDRDocEnd(count=IpdrInt(self.count),endTime=IpdrDateTimeMsec(IpdrDateTimeMsec.to_value(endTime)))
+        self._write(IpdrElementTypeEnum(IpdrElementTypeEnum.DOCEND).pack()+docEnd.pack())
+        self.elements+=1
+        self.closed=True
+        self.flush()
+        if self.length >= 0 and self.elements != self.length:
+            raise XDRError, 'header length=%d but %d IPDRStreamElements written' % (self.length,self.elements)
+
+def reencode(filep,outp,record_filter=None,context=None):
+    # Re-encodes the IPDRDoc of filep into outp, streaming. Without filtering the records
+    # are copied as packed, the output is then identical. With a record_filter (see
+    # IpdrXdrFilter.RecordFilter) the IPDRDocEnd counts the records kept and, when it
+    # keeps only some fields, each RecordDescriptor is written projected (as the filter returns it).
+    # Returns the IpdrXdrWriter.
+    doc=IPDRDoc()
+    elements=doc.iter_load(filep,lazy=record_filter is None,record_filter=record_filter,context=context)
+    header=next(elements)
+    writer=IpdrXdrWriter(outp,header,length=-1 if record_filter is not None else int(doc.elements.length))
+    for element in elements:
+        if record_filter is None:
+            writer.write_element(element)
+        elif element.kind == IpdrElementTypeEnum.DOCEND:
+            writer.close(endTime=element.docEnd.endTime)
+        else:
+            writer.write_element(element)
+    writer.close()
+    return writer
+
+def test():
+    # Re-encoding of example.xdr with a projection (-F) and a condition (-w)
+    import os,StringIO
+    from IpdrXdrFilter import RecordFilter
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),"example.xdr"),"rb") as filep:
+        outp=StringIO.StringIO()
+        writer=reencode(filep,outp,RecordFilter(fields=["Test_UInt","Test_Byte","Test_String"],conditions=["Test_Byte==-1"]))
+    assert(writer.count==1)
+    elements=list(IPDRDoc.iter_elements(StringIO.StringIO(outp.getvalue())))
+    assert([int(element.kind) for element in elements[1:]]==[1,1,2,3])
+    assert([str(a.attributeName) for a in elements[1].desc.attributes]==["Test_UInt","Test_Byte"])
+    assert([str(a.attributeName) for a in elements[2].desc.attributes]==["Test_String"])
+    assert(int(elements[3].rec.descriptorId)==1)
+    assert([int(value) for value in elements[3].rec.data]==[4294967295,-1])
+    assert(int(elements[4].docEnd.count)==1)
+    # without filtering the output is identical
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),"example.xdr"),"rb") as filep:
+        raw=filep.read()
+        filep.seek(0)
+        outp=StringIO.StringIO()
+        reencode(filep,outp)
+    assert(outp.getvalue()==raw)
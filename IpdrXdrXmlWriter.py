@@ -0,0 +1,109 @@
+###############################################################################
+# Streaming XML writer used by the write_xml() methods of the Ipdr classes.
+# Output is written to outp as it is produced (buffered), or kept for
+# getvalue() when no outp is given. Pretty printing is done in the same
+# pass: one element per line, indented, empty elements collapsed to <tag/>.
+###############################################################################
+
+from xml.sax.saxutils import escape
+
+def _escape(s):
+    if "&" in s or "<" in s or ">" in s:
+        return escape(s)
+    return s
+
+def _attrs(attrs):
+    return "".join([' %s="%s"' % (name,escape(str(value),{'"':"&quot;"})) for (name,value) in attrs])
+
+class IpdrXmlWriter(object):
+    def __init__(self,outp=None,pretty=False,indent="    ",buffer_parts=4096):
+        self.outp=outp
+        self.pretty=pretty
+        self.indent=indent
+        self.buffer_parts=buffer_parts
+        self.parts=[]
+        self.depth=0
+        self.pending=False # a start tag still waits for its ">"
+        self.text=False    # the last content written was text
+        self.first=True
+
+    def _write(self,s):
+        self.parts.append(s)
+        if self.outp is not None and len(self.parts) >= self.buffer_parts:
+            self.flush()
+
+    def _open(self):
+        if self.pending:
+            self._write(">")
+            self.pending=False
+
+    def _newline(self):
+        if self.pretty:
+            if self.first:
+                self.first=False
+            else:
+                self._write("\n"+self.indent*self.depth)
+
+    def declaration(self):
+        self._write('<?xml version="1.0" ?>')
+        if not self.pretty:
+            self._write("\n")
+        self.first=False
+
+    def start(self,tag,attrs=()):
+        self._open()
+        self._newline()
+        self._write("<%s%s" % (tag,_attrs(attrs)))
+        self.pending=True
+        self.text=False
+        self.depth+=1
+
+    def end(self,tag):
+        self.depth-=1
+        if self.pending:
+            self.pending=False
+            if self.pretty:
+                self._write("/>")
+            else:
+                self._write("></%s>" % tag)
+        else:
+            if not self.text:
+                self._newline()
+            self._write("</%s>" % tag)
+        self.text=False
+
+    def element(self,tag,text,attrs=()):
+        self._open()
+        self._newline()
+        self._write("<%s%s>%s</%s>" % (tag,_attrs(attrs),_escape(text),tag))
+        self.text=False
+
+    def empty(self,tag,attrs=()):
+        self._open()
+        self._newline()
+        self._write("<%s%s/>" % (tag,_attrs(attrs)))
+        self.text=False
+
+    def characters(self,text):
+        self._open()
+        self._write(_escape(text))
+        self.text=True
+
+    def raw(self,text):
+        # Content already written by another writer, e.g. at the same depth in a worker
+        self._open()
+        self._write(text)
+        self.text=False
+
+    def flush(self):
+        if self.outp is not None:
+            self.outp.write("".join(self.parts))
+            self.parts=[]
+
+    def close(self):
+        if self.pretty:
+            self._write("\n")
+        self.flush()
+
+    def getvalue(self):
+        return "".join(self.parts)
@@ -0,0 +1,33 @@
+###############################################################################
+# Convert a directory, glob or list of Ipdr-Xdr files to XML or python representation
+###############################################################################
+
+import sys,time,argparse
+from IpdrXdrBatch import *
+from IpdrXdrFilter import add_filter_arguments,record_filter_from_args
+
+parser=argparse.ArgumentParser(description="Batch convert IPDR-XDR files with a pool of processes.")
+parser.add_argument("inputs",nargs="+",help="IPDR-XDR files, directories or glob patterns")
+parser.add_argument("-f","--format",choices=sorted(converters),default="xml")
+parser.add_argument("-j","--processes",type=int,default=None,help="number of worker processes (default: one per cpu)")
+parser.add_argument("-o","--output-dir",default=None,help="write outputs here instead of next to the inputs")
+parser.add_argument("-p","--pattern",default="*.xdr",help="files picked from input directories (default: %(default)s)")
+parser.add_argument("--force",action="store_true",help="convert even if the output is up to date")
+add_filter_arguments(parser)
+args=parser.parse_args()
+
+counts={"converted":0,"skipped":0,"failed":0}
+total_size=0
+start=time.time()
+for result in iter_convert_files(args.inputs,args.format,args.processes,args.output_dir,args.force,args.pattern,record_filter_from_args(args)):
+    counts[result.status]+=1
+    if result.status == "converted":
+        total_size+=result.size
+        print "converted %s -> %s (%d bytes, %.3fs, %.2f MB/s)" % (result.xdr_file,result.out_file,result.size,result.seconds,result.mb_per_sec())
+    elif result.status == "skipped":
+        print "skipped %s, %s is up to date" % (result.xdr_file,result.out_file)
+    else:
+        print "FAILED %s: %s" % (result.xdr_file,result.error)
+elapsed=time.time()-start
+print "%d converted, %d skipped, %d failed in %.3fs (%.2f MB/s)" % (counts["converted"],counts["skipped"],counts["failed"],elapsed,total_size/max(elapsed,1e-9)/(1024*1024))
+sys.exit(1 if counts["failed"] else 0)
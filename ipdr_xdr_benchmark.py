@@ -0,0 +1,36 @@
+###############################################################################
+# Benchmark the Ipdr-Xdr decoder on a synthetic file, results are written as JSON
+###############################################################################
+
+import sys,json,argparse
+from IpdrXdrBenchmark import *
+
+parser=argparse.ArgumentParser(description="Generate a synthetic IPDR-XDR file and time load, pack, XML and repr conversion.")
+parser.add_argument("-n","--records",type=int,default=100000,help="number of records (default: %(default)s)")
+parser.add_argument("-s","--size",type=int,default=None,help="generate records until the file reaches SIZE bytes instead")
+parser.add_argument("-d","--descriptors",type=int,default=2)
+parser.add_argument("-f","--fields",type=int,default=20,help="attributes per RecordDescriptor (default: %(default)s)")
+parser.add_argument("--variable-ratio",type=float,default=0.2,help="share of string/hexBinary/ipAddr attributes (default: %(default)s)")
+parser.add_argument("--ipv6-ratio",type=float,default=0.5,help="share of IPv6 ipAddr values (default: %(default)s)")
+parser.add_argument("--seed",type=int,default=0)
+parser.add_argument("--distinct-records",type=int,default=1000,help="distinct records per descriptor the file cycles through (default: %(default)s)")
+parser.add_argument("--value-cache",type=int,default=None,help="enable the decoded value caches with this many entries per type")
+parser.add_argument("--stages",default=",".join(default_stages),help="comma separated, from: %s" % ",".join(default_stages))
+parser.add_argument("--timeout",type=float,default=None,help="seconds after which a stage is stopped and reported as failed")
+parser.add_argument("--file",default=None,help="write the synthetic file here and keep it")
+parser.add_argument("-o","--output",default=None,help="write the JSON results here rather than to stdout")
+parser.add_argument("--compare",default=None,help="JSON results of a previous run to compare records/s against")
+args=parser.parse_args()
+
+results=run_benchmark(args.file,args.stages.split(","),keep=args.file is not None,value_cache=args.value_cache,timeout=args.timeout,
+    distinct_records=args.distinct_records,records=args.records,size=args.size,descriptors=args.descriptors,fields=args.fields,
+    variable_ratio=args.variable_ratio,ipv6_ratio=args.ipv6_ratio,seed=args.seed)
+if args.compare:
+    with open(args.compare) as filep:
+        results["compared_to"]=args.compare
+        results["speedup"]=compare(results,json.load(filep))
+if args.output:
+    with open(args.output,"w") as outp:
+        dump_results(results,outp)
+else:
+    dump_results(results,sys.stdout)
@@ -0,0 +1,70 @@
+###############################################################################
+# Decode live Ipdr-Xdr feeds from collectors into XML files, one per document,
+# as the data arrives
+###############################################################################
+
+import os,sys,argparse
+from IpdrXdrFeed import *
+from IpdrXdrFilter import add_filter_arguments,record_filter_from_args
+
+class XmlFeed(FeedClient):
+    # Writes each document received to <output_dir>/<host>_<port>.<n>.xml
+    def __init__(self,address,output_dir,**kwargs):
+        self.output_dir=output_dir
+        self.outp=None
+        self.writer=None
+        self.records=0
+        FeedClient.__init__(self,address,**kwargs)
+
+    def start_document(self,header):
+        (host,port)=parse_address(self.address)
+        path=os.path.join(self.output_dir,"%s_%d.%d.xml" % (host.replace(":","_"),port,self.decoder.documents))
+        self.outp=open(path,"w")
+        self.writer=IpdrXmlWriter(self.outp,True)
+        self.writer.declaration()
+        self.writer.start("IPDRDoc")
+        header.write_xml(self.writer)
+        self.writer.start("array",[("length",self.decoder.length)])
+        self.records=0
+
+    def end_document(self):
+        self.writer.end("array")
+        self.writer.end("IPDRDoc")
+        self.writer.close()
+        self.outp.close()
+        print >> sys.stderr, "%s: %s, %d records" % (self.address,self.outp.name,self.records)
+        self.outp=None
+        self.writer=None
+
+    def handle_element(self,element):
+        if isinstance(element,IPDRHeader):
+            if self.writer is not None:
+                self.end_document()
+            self.start_document(element)
+            return
+        element.write_xml(self.writer)
+        if element.kind == IpdrElementTypeEnum.IPDRREC:
+            self.records+=1
+        elif element.kind == IpdrElementTypeEnum.DOCEND:
+            self.end_document()
+
+    def handle_end(self):
+        if self.writer is not None:
+            self.end_document()
+        if self.error is not None:
+            print >> sys.stderr, "%s: %s" % (self.address,self.error)
+
+parser=argparse.ArgumentParser(description="Decode IPDR-XDR documents received from collectors into XML files, as they arrive.")
+parser.add_argument("addresses",nargs="+",help="tcp://host:port of each collector, all are read at the same time")
+parser.add_argument("-o","--output-dir",default=".",help="directory of the XML files (default .)")
+add_filter_arguments(parser)
+parser.add_argument("--profile",action="store_true",help="count and time the decoding per element kind, descriptorId and type, printed to stderr")
+args=parser.parse_args()
+
+record_filter=record_filter_from_args(args)
+profile=DecodeProfile() if args.profile else None
+clients=[XmlFeed(address,args.output_dir,record_filter=record_filter,profile=profile) for address in args.addresses]
+run_feeds(clients)
+if profile is not None:
+    profile.report(sys.stderr)
+sys.exit(1 if any([client.error is not None for client in clients]) else 0)
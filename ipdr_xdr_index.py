@@ -0,0 +1,31 @@
+###############################################################################
+# Build (or refresh) the record offset index of Ipdr-Xdr files and print
+# selected records, by ordinal, descriptorId or key time range
+###############################################################################
+
+import sys,argparse
+from IpdrXdrIndex import *
+
+parser=argparse.ArgumentParser(description="Index IPDR-XDR files into <xdr_file>.idx and print records through it.")
+parser.add_argument("inputs",nargs="+",help="IPDR-XDR files, directories or glob patterns")
+parser.add_argument("-k","--key",default=None,help="dateTime attribute kept per record for time range queries, or per descriptorId: \"1:startTime,3:eventTime\"")
+parser.add_argument("-n","--ordinal",type=int,action="append",default=[],help="print the N-th record (repeatable, negative from the end)")
+parser.add_argument("-d","--descriptor",type=int,default=None,help="print the records of this descriptorId")
+parser.add_argument("--start",default=None,help="print the records whose key is at or after START, e.g. \"2018-03-07 02:00:00\"")
+parser.add_argument("--end",default=None,help="print the records whose key is before END")
+parser.add_argument("-p","--pattern",default="*.xdr",help="files picked from input directories (default: %(default)s)")
+parser.add_argument("--no-prune",action="store_true",help="do not skip files from their header startTime and DOCEND endTime")
+parser.add_argument("--rebuild",action="store_true",help="rebuild the indexes even if they are up to date")
+args=parser.parse_args()
+
+for xdr_file in expand_inputs(args.inputs,args.pattern):
+    if (args.start is not None or args.end is not None) and not args.no_prune and not file_may_overlap(xdr_file,args.start,args.end):
+        print >>sys.stderr, "%s: outside of the time range, skipped" % xdr_file
+        continue
+    with IpdrIndex(xdr_file,key_field=args.key,rebuild=args.rebuild) as index:
+        print >>sys.stderr, "%s: %d records, key %s" % (index.index_file,len(index),index.key_field)
+        for i in args.ordinal:
+            print repr(index.record(i))
+        if args.descriptor is not None or args.start is not None or args.end is not None:
+            for rec in index.records(args.descriptor,args.start,args.end):
+                print repr(rec)
@@ -0,0 +1,19 @@
+###############################################################################
+# Merge Ipdr-Xdr files into one, deduplicating their RecordDescriptors,
+# optionally in the order of a timestamp attribute
+###############################################################################
+
+import sys,argparse
+from IpdrXdrMerge import *
+
+parser=argparse.ArgumentParser(description="Merge IPDR-XDR files into one IPDR-XDR document.")
+parser.add_argument("inputs",nargs="+",help="IPDR-XDR files (may be compressed), directories or glob patterns")
+parser.add_argument("-o","--output",required=True,help="merged IPDR-XDR file")
+parser.add_argument("-p","--pattern",default="*.xdr",help="files to take from input directories (default *.xdr)")
+parser.add_argument("-k","--order-by",default=None,help="dateTime attribute to merge the records in the order of, or per descriptorId: \"1:startTime,3:eventTime\" (default concatenate the inputs)")
+args=parser.parse_args()
+
+stats=merge_files(args.inputs,args.output,args.order_by,args.pattern)
+print >> sys.stderr, "%s: %d records from %d files, %d RecordDescriptors" % (args.output,stats["records"],stats["inputs"],stats["descriptors"])
+for (in_id,out_id,typeName) in stats["remapped"]:
+    print >> sys.stderr, "descriptorId %d (%s) renumbered %d" % (in_id,typeName,out_id)
@@ -0,0 +1,25 @@
+###############################################################################
+# Serve Ipdr-Xdr files over TCP as a collector would, to test feed consumers
+###############################################################################
+
+import sys,argparse
+from IpdrXdrFeed import ReplayServer
+from IpdrXdrBatch import expand_inputs
+
+parser=argparse.ArgumentParser(description="Send IPDR-XDR files to each client connecting over TCP.")
+parser.add_argument("inputs",nargs="+",help="IPDR-XDR files (compressed ones are sent decompressed), directories or glob patterns")
+parser.add_argument("--host",default="127.0.0.1",help="address to listen on (default 127.0.0.1)")
+parser.add_argument("-p","--port",type=int,default=0,help="port to listen on (default any free port)")
+parser.add_argument("-c","--chunk-size",type=int,default=1<<16,help="bytes sent at a time (default 65536)")
+parser.add_argument("-r","--rate",type=float,default=None,help="bytes per second sent to each client at most")
+parser.add_argument("-n","--repeat",type=int,default=1,help="times the files are sent to each client (default 1)")
+args=parser.parse_args()
+
+server=ReplayServer(expand_inputs(args.inputs),(args.host,args.port),args.chunk_size,args.rate,args.repeat)
+print >> sys.stderr, "Replaying %d files on %s" % (len(server.paths),server.url)
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
@@ -0,0 +1,36 @@
+###############################################################################
+# Split an Ipdr-Xdr file into self-contained shards by record count,
+# byte size or time window
+###############################################################################
+
+import sys,argparse
+from IpdrXdrSplit import *
+
+size_units={"k":1<<10,"m":1<<20,"g":1<<30}
+window_units={"s":1,"m":60,"h":3600,"d":86400}
+
+def with_unit(text,units):
+    # "64M" -> 64*units["m"], a plain number is taken as is
+    text=text.strip().lower()
+    if text and text[-1] in units:
+        return float(text[:-1])*units[text[-1]]
+    return float(text)
+
+parser=argparse.ArgumentParser(description="Split an IPDR-XDR file into shards, each a complete IPDR-XDR document.")
+parser.add_argument("xdr_file",help="IPDR-XDR file (may be compressed), \"-\" for stdin, or tcp://host:port to read from a connection")
+parser.add_argument("-o","--output",default=None,help="path of the shards, %%d style pattern of the shard number (default <xdr_file without .xdr>.%%04d.xdr)")
+parser.add_argument("-n","--records",type=int,default=None,help="records per shard at most")
+parser.add_argument("-s","--size",default=None,help="bytes per shard at most, with an optional K, M or G unit")
+parser.add_argument("-t","--window",default=None,help="time window per shard, in seconds or with an s, m, h or d unit, from the key attribute")
+parser.add_argument("-k","--key",default=None,help="dateTime attribute of the time window, or per descriptorId: \"1:startTime,3:eventTime\"")
+args=parser.parse_args()
+
+if args.records is None and args.size is None and args.window is None:
+    parser.error("one of --records, --size or --window is needed")
+if args.window is not None and args.key is None:
+    parser.error("--window needs --key")
+size=None if args.size is None else int(with_unit(args.size,size_units))
+window=None if args.window is None else with_unit(args.window,window_units)
+shards=split_file(args.xdr_file,args.output,args.records,size,window,args.key)
+for (path,records,shard_size) in shards:
+    print "%s: %d records, %d bytes" % (path,records,shard_size)
@@ -1,45 +1,45 @@
-############################################################################### 
+###############################################################################
 # Convert an Ipdr-Xdr file into a python representation
-############################################################################### 
+###############################################################################
 
-import sys
-from IpdrXdrDocumentClasses import *
+import sys,json,argparse
+from IpdrXdrConvert import *
+from IpdrXdrFilter import add_filter_arguments,record_filter_from_args
+from IpdrXdrParallel import map_path,xdr_to_repr_parallel
 
-def mypprint(s):
-    indent = 0
-    max_indent=15
-    new_s = ''
-    a_new_line=False
-    for c in s:
-      if c == '\t' or c=='\n':
-        continue
-      if c == ' ' and a_new_line:
-        continue
-      a_new_line=False
-      if c == ')'  or c==']':
-        indent -= 2
-        if indent < (max_indent-2):
-            new_s += '\n' + ' '*indent
-      new_s += c
-      if c == '(' or c=='[':
-        indent += 2
-        if indent < max_indent:
-            new_s += '\n' + ' '*indent
-      if c == ',':
-        if indent < max_indent:
-            new_s += '\n' + ' '*indent
-            a_new_line=True
-    return new_s
-
-with open(sys.argv[1],"rb") as filep:
-    ipdr=IPDRDoc.load(filep)    
-    
-
-with open(sys.argv[1],"rb") as filep:
-    ipdr=None
-    ipdr=IPDRDoc.load(filep)    
-    repr_file = "%s.repr" % sys.argv[1]
-    print "Decoding IPDR-XDR file \"%s\" to a file containing the python representation: %s" % (sys.argv[1],repr_file) 
-    with open(repr_file,"w") as outp:
-        outp.write(mypprint(str(ipdr)))
+parser=argparse.ArgumentParser(description="Decode an IPDR-XDR file into <xdr_file>.repr")
+parser.add_argument("xdr_file",help="IPDR-XDR file (may be compressed), \"-\" for stdin, or tcp://host:port to read from a connection")
+parser.add_argument("-o","--output",default=None,help="output file, \"-\" for stdout (default <xdr_file>.repr, stdout when reading stdin or a connection)")
+add_filter_arguments(parser)
+parser.add_argument("--value-cache",type=int,default=None,help="cache up to VALUE_CACHE decoded values per type (addresses, strings...), statistics are printed to stderr")
+parser.add_argument("--profile",action="store_true",help="count and time the decoding per element kind, descriptorId and type, printed to stderr")
+parser.add_argument("-j","--processes",type=int,default=None,help="decode the file in chunks over PROCESSES processes (an uncompressed regular file only)")
+args=parser.parse_args()
+if args.processes:
+    if args.profile or args.value_cache:
+        parser.error("--profile and --value-cache are not supported with --processes")
+    try:
+        map_path(args.xdr_file).close()
+    except (ValueError,EnvironmentError), e:
+        parser.error(str(e))
+if args.value_cache:
+    enable_value_cache(args.value_cache)
+context=DecoderContext(profile=DecodeProfile()) if args.profile else None
 
+if args.output is not None:
+    repr_file = args.output
+elif args.xdr_file == "-" or args.xdr_file.startswith("tcp://"):
+    repr_file = "-"
+else:
+    repr_file = "%s.repr" % args.xdr_file
+log=sys.stderr if repr_file == "-" else sys.stdout
+print >>log, "Decoding IPDR-XDR file \"%s\" to a file containing the python representation: %s" % (args.xdr_file,repr_file)
+if args.processes:
+    xdr_to_repr_parallel(args.xdr_file,repr_file,processes=args.processes,record_filter=record_filter_from_args(args))
+else:
+    xdr_to_repr(args.xdr_file,repr_file,record_filter=record_filter_from_args(args),context=context)
+if args.value_cache:
+    json.dump(value_cache_stats(),sys.stderr,indent=2,sort_keys=True)
+    sys.stderr.write("\n")
+if args.profile:
+    context.profile.report(sys.stderr)
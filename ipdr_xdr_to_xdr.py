@@ -1,8 +1,24 @@
-import sys
-from IpdrDoc import *
+###############################################################################
+# Re-encode an Ipdr-Xdr file, streaming, through the IpdrXdrWriter
+###############################################################################
 
-with open(sys.argv[1],"rb") as filep:
-    ipdr=None
-    ipdr=IPDRDoc.load(filep)    
-    with open("%s.xdr" % sys.argv[1],"wb") as outp:
-        outp.write(ipdr.pack())
+import sys,argparse
+from IpdrXdrWriter import *
+from IpdrXdrFilter import add_filter_arguments,record_filter_from_args
+
+parser=argparse.ArgumentParser(description="Re-encode an IPDR-XDR file into <xdr_file>.xdr")
+parser.add_argument("xdr_file")
+parser.add_argument("-o","--output",default=None,help="output file (default <xdr_file>.xdr)")
+add_filter_arguments(parser)
+parser.add_argument("--profile",action="store_true",help="count and time the decoding per element kind, descriptorId and type, printed to stderr")
+args=parser.parse_args()
+
+record_filter=record_filter_from_args(args)
+context=DecoderContext(lazy=record_filter is None,profile=DecodeProfile()) if args.profile else None
+xdr_out="%s.xdr" % args.xdr_file if args.output is None else args.output
+print "Re-encoding IPDR-XDR file \"%s\" to: %s" % (args.xdr_file,xdr_out)
+with open(args.xdr_file,"rb") as filep:
+    with open(xdr_out,"wb") as outp:
+        reencode(filep,outp,record_filter,context)
+if args.profile:
+    context.profile.report(sys.stderr)
@@ -0,0 +1,45 @@
+###############################################################################
+# Convert an Ipdr-Xdr file into a human readable XML file
+###############################################################################
+
+import sys,json,argparse
+from IpdrXdrConvert import *
+from IpdrXdrFilter import add_filter_arguments,record_filter_from_args
+from IpdrXdrParallel import map_path,xdr_to_xml_parallel
+
+parser=argparse.ArgumentParser(description="Decode an IPDR-XDR file into <xdr_file>.xml")
+parser.add_argument("xdr_file",help="IPDR-XDR file (may be compressed), \"-\" for stdin, or tcp://host:port to read from a connection")
+parser.add_argument("-o","--output",default=None,help="output file, \"-\" for stdout (default <xdr_file>.xml, stdout when reading stdin or a connection)")
+add_filter_arguments(parser)
+parser.add_argument("--value-cache",type=int,default=None,help="cache up to VALUE_CACHE decoded values per type (addresses, strings...), statistics are printed to stderr")
+parser.add_argument("--profile",action="store_true",help="count and time the decoding per element kind, descriptorId and type, printed to stderr")
+parser.add_argument("-j","--processes",type=int,default=None,help="decode the file in chunks over PROCESSES processes (an uncompressed regular file only)")
+args=parser.parse_args()
+if args.processes:
+    if args.profile or args.value_cache:
+        parser.error("--profile and --value-cache are not supported with --processes")
+    try:
+        map_path(args.xdr_file).close()
+    except (ValueError,EnvironmentError), e:
+        parser.error(str(e))
+if args.value_cache:
+    enable_value_cache(args.value_cache)
+context=DecoderContext(profile=DecodeProfile()) if args.profile else None
+
+if args.output is not None:
+    xml_file = args.output
+elif args.xdr_file == "-" or args.xdr_file.startswith("tcp://"):
+    xml_file = "-"
+else:
+    xml_file = "%s.xml" % args.xdr_file
+log=sys.stderr if xml_file == "-" else sys.stdout
+print >>log, "Decoding IPDR-XDR file \"%s\" to the XML file: %s" % (args.xdr_file,xml_file)
+if args.processes:
+    xdr_to_xml_parallel(args.xdr_file,xml_file,processes=args.processes,record_filter=record_filter_from_args(args))
+else:
+    xdr_to_xml(args.xdr_file,xml_file,record_filter=record_filter_from_args(args),context=context)
+if args.value_cache:
+    json.dump(value_cache_stats(),sys.stderr,indent=2,sort_keys=True)
+    sys.stderr.write("\n")
+if args.profile:
+    context.profile.report(sys.stderr)